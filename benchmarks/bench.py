@@ -0,0 +1,239 @@
+#!/bin/env python3
+""" Reproducible client benchmarks against the local OMS stand-in server
+
+    Each scenario fetches a synthetic result set through a different
+    OMSQuery path and reports rows/s, requests/s, request latency
+    percentiles and peak Python memory (tracemalloc, measured in a separate
+    run of a child process, so that tracing does not distort the timings and
+    the in-process stand-in server is not counted). Results are written as
+    JSON and can be compared to an earlier run:
+
+        ./benchmarks/bench.py --output baseline.json
+        ./benchmarks/bench.py --compare baseline.json --threshold 0.1
+"""
+import sys
+import os
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(sys.path[0],'..'))
+from omsapi import OMSAPI
+import standin
+
+
+def _fetch_lumisections_data(api, args):
+    # Page by page via data(), as most user code does
+    rows = 0
+    page = 1
+    while True:
+        q = api.query("lumisections").paginate(page, args.per_page)
+        q.set_verbose(False)
+        data = q.data().json()
+        rows += len(data["data"])
+        if not data["links"].get("next"):
+            return rows
+        page += 1
+
+
+def _fetch_lumisections_pages(api, args):
+    return sum(len(p["data"]) for p in api.query("lumisections").iter_pages(args.per_page))
+
+
+def _fetch_lumisections_pages_parallel(api, args):
+    return sum(len(p["data"]) for p in api.query("lumisections").iter_pages(args.per_page, workers=args.workers))
+
+
+def _fetch_lumisections_stream(api, args):
+    return sum(1 for _ in api.query("lumisections").iter_rows(args.per_page, stream=True))
+
+
+def _fetch_lumisections_sharded(api, args):
+    return sum(1 for _ in api.query("lumisections").iter_sharded("run_number", args.workers, args.per_page))
+
+
+def _fetch_lumisections_columns(api, args):
+    return len(api.query("lumisections").columns(args.per_page, workers=args.workers)["run_number"])
+
+
+def _fetch_bunches(api, args):
+    return sum(1 for _ in api.query("bunches").filter("fill_number", 6000).iter_rows(args.per_page))
+
+
+def _fetch_triggers(api, args):
+    return sum(1 for _ in api.query("l1algorithmtriggers").filter("run_number", 300000)
+               .sort("bit").iter_rows(args.per_page, workers=args.workers))
+
+
+def _fetch_runs_small_pages(api, args):
+    # Request overhead dominated: many small pages
+    return sum(len(p["data"]) for p in api.query("runs").iter_pages(10))
+
+
+SCENARIOS = [
+    ("lumisections_data", _fetch_lumisections_data),
+    ("lumisections_iter_pages", _fetch_lumisections_pages),
+    ("lumisections_iter_pages_parallel", _fetch_lumisections_pages_parallel),
+    ("lumisections_iter_rows_stream", _fetch_lumisections_stream),
+    ("lumisections_iter_sharded", _fetch_lumisections_sharded),
+    ("lumisections_columns", _fetch_lumisections_columns),
+    ("bunches_iter_rows", _fetch_bunches),
+    ("l1algorithmtriggers_iter_rows", _fetch_triggers),
+    ("runs_small_pages", _fetch_runs_small_pages),
+]
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def _client(url):
+    api = OMSAPI(url, "v1", verbose=False, pool_maxsize=16)
+    latencies = []
+    api.session.hooks["response"].append(lambda r, *args, **kwargs: latencies.append(r.elapsed.total_seconds()))
+    return api, latencies
+
+
+def run_scenario(server, func, args):
+    """ Returns measurements of one scenario (best of args.repeat runs) """
+
+    best = None
+    for _ in range(args.repeat):
+        api, latencies = _client(server.url)
+        server.reset_stats()
+        start = time.perf_counter()
+        rows = func(api, args)
+        elapsed = time.perf_counter() - start
+        api.close()
+        if best is None or elapsed < best["seconds"]:
+            best = {
+                "rows": rows,
+                "requests": server.requests,
+                "bytes": server.bytes_sent,
+                "seconds": round(elapsed, 4),
+                "rows_per_s": round(rows / elapsed, 1),
+                "requests_per_s": round(server.requests / elapsed, 1),
+                "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 2),
+                "latency_p90_ms": round(_percentile(latencies, 0.9) * 1000, 2),
+                "latency_p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+            }
+
+    best["peak_memory_kb"] = peak_memory(server, func, args)
+    return best
+
+
+def peak_memory(server, func, args):
+    """ Peak Python memory in kB of one scenario run in a child process,
+        which holds the client only
+    """
+
+    name = next(n for n, f in SCENARIOS if f is func)
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), name, "--memory-of", server.url,
+                                      "--per-page", str(args.per_page), "--workers", str(args.workers)])
+    return float(output.decode().split()[-1])
+
+
+def _measure_memory(url, func, args):
+    api, _ = _client(url)
+    tracemalloc.start()
+    func(api, args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    api.close()
+    return round(peak / 1024.0, 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Metric -> True if higher is better
+COMPARED = {"rows_per_s": True, "requests_per_s": True, "latency_p50_ms": False, "latency_p99_ms": False, "peak_memory_kb": False}
+
+
+def compare(baseline, results, threshold):
+    """ Print relative change of each metric, returns number of regressions beyond threshold """
+
+    regressions = 0
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / float(old)
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "!"
+                regressions += 1
+            changes.append("{m} {c:+.1%}{f}".format(m=metric, c=change, f=flag))
+        print("{name:34s} {changes}".format(name=name, changes="  ".join(changes)))
+    return regressions
+
+
+parser = argparse.ArgumentParser(description='benchmark omsapi against a local stand-in server')
+parser.add_argument('scenarios', nargs='*', help='scenarios to run (default: all): ' + ", ".join(n for n, _ in SCENARIOS))
+parser.add_argument('--runs', type=int, default=200, help='synthetic runs (100 lumisections each)')
+parser.add_argument('--latency', type=float, default=0.005, help='seconds added to every response')
+parser.add_argument('--padding', type=int, default=0, help='bytes of filler text per row')
+parser.add_argument('--per-page', type=int, default=1000, help='page size')
+parser.add_argument('--workers', type=int, default=4, help='concurrency of parallel scenarios')
+parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, best one is reported')
+parser.add_argument('--output', help='write results to this JSON file')
+parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as regression')
+# Child process of peak_memory(): run one scenario against a running stand-in
+parser.add_argument('--memory-of', metavar='URL', help=argparse.SUPPRESS)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    selected = [(n, f) for n, f in SCENARIOS if not args.scenarios or n in args.scenarios]
+
+    if args.memory_of:
+        for name, func in selected:
+            print(_measure_memory(args.memory_of, func, args))
+        sys.exit(0)
+
+    server = standin.start(latency=args.latency, runs=args.runs, padding=args.padding)
+    results = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"runs": args.runs, "latency": args.latency, "padding": args.padding,
+                   "per_page": args.per_page, "workers": args.workers, "repeat": args.repeat},
+        "scenarios": {},
+    }
+
+    for name, func in selected:
+        result = run_scenario(server, func, args)
+        results["scenarios"][name] = result
+        print("{name:34s} {rows:8d} rows {seconds:8.3f}s {rows_per_s:10.0f} rows/s {requests:5d} req "
+              "p50 {latency_p50_ms:7.2f}ms p99 {latency_p99_ms:7.2f}ms peak {peak_memory_kb:9.0f}kB".format(name=name, **result))
+    server.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != results["params"]:
+            print("Warning: parameters differ from baseline {p}".format(p=baseline.get("params")))
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,335 @@
+#!/bin/env python3
+""" Local stand-in of the OMS aggregation API for benchmarks
+
+    Serves synthetic runs, fills, lumisections, bunches and
+    l1algorithmtriggers under /api/v1 as JSON:API documents, emulating
+    /meta, filter[attribute][OP], sort, fields, page[offset]/page[limit]
+    and group[granularity]=run|fill. Latency and payload size are
+    configurable. Data is generated deterministically.
+
+    Run standalone:
+        ./benchmarks/standin.py --port 8080 --runs 200 --latency 0.02
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+BUNCHES_PER_FILL = 3564
+
+FIELDS = {
+    "runs": OrderedDict([("run_number", "INTEGER"), ("fill_number", "INTEGER"), ("start_time", "DATE"), ("end_time", "DATE"),
+                         ("sequence", "STRING"), ("last_lumisection_number", "INTEGER"), ("delivered_lumi", "DOUBLE"),
+                         ("components", "STRING")]),
+    "fills": OrderedDict([("fill_number", "INTEGER"), ("start_time", "DATE"), ("end_time", "DATE"), ("fill_type_runtime", "STRING"),
+                          ("bunches_colliding", "INTEGER"), ("peak_lumi", "DOUBLE")]),
+    "lumisections": OrderedDict([("run_number", "INTEGER"), ("lumisection_number", "INTEGER"), ("fill_number", "INTEGER"),
+                                 ("start_time", "DATE"), ("end_time", "DATE"), ("cms_active", "BOOLEAN"),
+                                 ("delivered_lumi", "DOUBLE"), ("recorded_lumi", "DOUBLE"), ("pileup", "DOUBLE")]),
+    "bunches": OrderedDict([("fill_number", "INTEGER"), ("bunch_number", "INTEGER"), ("beam_1_configured", "BOOLEAN"),
+                            ("beam_2_configured", "BOOLEAN"), ("peak_lumi", "DOUBLE")]),
+    "l1algorithmtriggers": OrderedDict([("run_number", "INTEGER"), ("lumisection_number", "INTEGER"), ("bit", "INTEGER"),
+                                        ("name", "STRING"), ("pre_dt_rate", "DOUBLE"), ("post_dt_rate", "DOUBLE")]),
+}
+
+# Attributes forming the row id
+ID_FIELDS = {
+    "runs": ["run_number"],
+    "fills": ["fill_number"],
+    "lumisections": ["run_number", "lumisection_number"],
+    "bunches": ["fill_number", "bunch_number"],
+    "l1algorithmtriggers": ["run_number", "lumisection_number", "bit"],
+}
+
+OPERATORS = {
+    "EQ": lambda a, b: a == b,
+    "NEQ": lambda a, b: a != b,
+    "LT": lambda a, b: a is not None and a < b,
+    "GT": lambda a, b: a is not None and a > b,
+    "LE": lambda a, b: a is not None and a <= b,
+    "GE": lambda a, b: a is not None and a >= b,
+    "LIKE": lambda a, b: a is not None and b.replace("%", "") in str(a),
+    "CT": lambda a, b: a is not None and b in str(a),
+}
+
+_FILTER = re.compile(r"^filter\[(\w+)\]\[(\w+)\]$")
+
+
+def _timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1500000000 + seconds))
+
+
+def generate(runs=200, lumisections=100, bits=64, trigger_runs=3, fills=None, padding=0):
+    """ Generate synthetic data set
+
+        Args:
+            runs (int): number of runs (10 runs per fill)
+            lumisections (int): lumisections per run
+            bits (int): L1 algorithm bits
+            trigger_runs (int): runs with l1algorithmtriggers data (bits x lumisections rows each)
+            fills (int): fills with bunches data (default: all fills of the runs, at most 5)
+            padding (int): bytes of filler text added to every row (payload size)
+
+        Returns:
+            dict: resource -> list of attribute dicts
+    """
+
+    pad = {"comment": "x" * padding} if padding else {}
+    nfills = (runs + 9) // 10
+    data = {"runs": [], "fills": [], "lumisections": [], "bunches": [], "l1algorithmtriggers": []}
+
+    for f in range(nfills):
+        last = f == nfills - 1
+        data["fills"].append(dict(fill_number=6000 + f, start_time=_timestamp(f * 40000),
+                                  end_time=None if last else _timestamp(f * 40000 + 39000),
+                                  fill_type_runtime="PROTONS", bunches_colliding=2400 + f % 100,
+                                  peak_lumi=15000.0 + f, **pad))
+
+    for r in range(runs):
+        last = r == runs - 1
+        start = r * 4000
+        data["runs"].append(dict(run_number=300000 + r, fill_number=6000 + r // 10, start_time=_timestamp(start),
+                                 end_time=None if last else _timestamp(start + lumisections * 23),
+                                 sequence="GLOBAL-RUN" if r % 4 else "MINIDAQ", last_lumisection_number=lumisections,
+                                 delivered_lumi=lumisections * 1.5, components="ECAL,HCAL,TRACKER", **pad))
+        for l in range(1, lumisections + 1):
+            data["lumisections"].append(dict(run_number=300000 + r, lumisection_number=l, fill_number=6000 + r // 10,
+                                             start_time=_timestamp(start + l * 23), end_time=_timestamp(start + l * 23 + 23),
+                                             cms_active=l % 7 != 0, delivered_lumi=(l * 1.5) if l % 5 else None,
+                                             recorded_lumi=l * 1.4, pileup=30.0 + l % 20, **pad))
+
+    for r in range(min(trigger_runs, runs)):
+        for l in range(1, lumisections + 1):
+            for b in range(bits):
+                rate = float((b * 37 + l * 11 + r) % 500)
+                data["l1algorithmtriggers"].append(dict(run_number=300000 + r, lumisection_number=l, bit=b,
+                                                        name="L1_Bit{b}".format(b=b), pre_dt_rate=rate,
+                                                        post_dt_rate=rate * 0.95, **pad))
+
+    for f in range(min(fills if fills is not None else 5, nfills)):
+        for b in range(1, BUNCHES_PER_FILL + 1):
+            configured = b % 3 != 0
+            data["bunches"].append(dict(fill_number=6000 + f, bunch_number=b, beam_1_configured=configured,
+                                        beam_2_configured=configured and b % 5 != 0,
+                                        peak_lumi=(b % 50) * 0.1 if configured else None, **pad))
+
+    return data
+
+
+def _convert(value, sample):
+    """ Filter value from URL to type of attribute """
+
+    if value == "null":
+        return None
+    if isinstance(sample, bool):
+        return value.lower() == "true"
+    if isinstance(sample, int):
+        return int(value)
+    if isinstance(sample, float):
+        return float(value)
+    return value
+
+
+def _group(rows, key):
+    """ Mean of numeric attributes per key value (group[granularity]) """
+
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(row[key], []).append(row)
+
+    result = []
+    for rows in groups.values():
+        grouped = dict(rows[0])
+        for attr, value in grouped.items():
+            if isinstance(value, float):
+                values = [r[attr] for r in rows if r[attr] is not None]
+                grouped[attr] = sum(values) / len(values) if values else None
+        result.append(grouped)
+    return result
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    """ Threaded HTTP server holding data set, latency and request statistics
+
+        Args:
+            address (tuple): (host, port), port 0 picks a free port
+            data (dict): data set, see generate()
+            latency (float): seconds added to every response
+
+        Attributes:
+            max_page_size (int): page[limit] is capped to this size, None - no cap
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, data=None, latency=0.0):
+        HTTPServer.__init__(self, address, _Handler)
+        self.data = data if data is not None else generate()
+        self.latency = latency
+        self.max_page_size = None
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self._results = OrderedDict()  # (resource, filters, sort, group) -> rows, small LRU
+
+    @property
+    def url(self):
+        return "http://{host}:{port}/api".format(host=self.server_address[0], port=self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def add_rows(self, resource, rows):
+        """ Append rows to a resource (e.g. lumisections of an ongoing run) """
+
+        with self.lock:
+            self.data[resource].extend(rows)
+            self._results.clear()
+
+    def result_set(self, resource, filters, sort, granularity):
+        """ Filtered, sorted (and grouped) rows. Kept for repeated page requests,
+            so that the server costs little compared to the client.
+        """
+
+        key = (resource, tuple(filters), tuple(sort), granularity)
+        with self.lock:
+            rows = self._results.get(key)
+            if rows is not None:
+                self._results.move_to_end(key)
+                return rows
+
+        rows = self.data[resource]
+        for attr, op, value in filters:
+            sample = next((r[attr] for r in self.data[resource] if r.get(attr) is not None), None)
+            value = _convert(value, sample)
+            if value is None:
+                rows = [r for r in rows if (r.get(attr) is None) == (op == "EQ")]
+            else:
+                rows = [r for r in rows if OPERATORS[op](r.get(attr), value)]
+
+        if granularity in ("run", "fill"):
+            key_attr = granularity + "_number"
+            rows = _group(sorted(rows, key=lambda r: r[key_attr]), key_attr)
+
+        for attr in reversed(sort):
+            descending = attr.startswith("-")
+            attr = attr.lstrip("-")
+            rows = sorted(rows, key=lambda r: (r.get(attr) is None, r.get(attr)), reverse=descending)
+
+        with self.lock:
+            self._results[key] = rows
+            while len(self._results) > 64:
+                self._results.popitem(last=False)
+        return rows
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, document, status=200):
+        body = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        resource = parts[2] if len(parts) > 2 else None
+        if parts[:2] != ["api", "v1"] or resource not in server.data:
+            return self.send_json({"errors": [{"title": "Not found"}]}, 404)
+
+        if len(parts) > 3 and parts[3] == "meta":
+            fields = dict((name, {"type": kind, "searchable": True, "sortable": True})
+                          for name, kind in FIELDS[resource].items())
+            return self.send_json({"meta": {"fields": fields}})
+
+        offset, limit, fields, sort, filters, granularity = 0, 10, None, [], [], None
+        for key, value in parse_qsl(url.query, keep_blank_values=True):
+            match = _FILTER.match(key)
+            if match:
+                if match.group(2) not in OPERATORS:
+                    return self.send_json({"errors": [{"title": "Bad operator"}]}, 400)
+                filters.append((match.group(1), match.group(2), value))
+            elif key == "page[offset]":
+                offset = int(value)
+            elif key == "page[limit]":
+                limit = int(value)
+            elif key == "fields":
+                fields = value.split(",")
+            elif key == "sort":
+                sort = value.split(",")
+            elif key == "group[granularity]":
+                granularity = value
+
+        if server.max_page_size is not None:
+            limit = min(limit, server.max_page_size)
+
+        rows = server.result_set(resource, filters, sort, granularity)
+        id_fields = ID_FIELDS[resource]
+        data = []
+        for row in rows[offset:offset + limit]:
+            attributes = row if fields is None else dict((k, v) for k, v in row.items() if k in fields)
+            data.append({"id": "_".join(str(row[k]) for k in id_fields), "type": resource,
+                         "attributes": attributes, "links": {}, "meta": {"row": {}}})
+
+        links = {"next": "next"} if offset + limit < len(rows) else {}
+        self.send_json({"data": data, "links": links, "meta": {"totalResourceCount": len(rows)}})
+
+
+def start(port=0, latency=0.0, **data_options):
+    """ Start stand-in server in a background thread, see generate() for data options """
+
+    return StandinServer(("127.0.0.1", port), generate(**data_options), latency).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='local stand-in of the OMS API')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--lumisections', type=int, default=100, help='lumisections per run')
+    parser.add_argument('--padding', type=int, default=0, help='bytes of filler text per row')
+    args = parser.parse_args()
+
+    server = StandinServer(("127.0.0.1", args.port),
+                           generate(runs=args.runs, lumisections=args.lumisections, padding=args.padding), args.latency)
+    print("serving " + server.url + "/v1")
+    server.serve_forever()
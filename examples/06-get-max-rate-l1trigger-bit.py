@@ -11,7 +11,7 @@ import re
 
 if not os.path.exists( os.getcwd() + 'omsapi.py' ):
     sys.path.append('..')  # if you run the script in the more-examples sub-folder 
-from omsapi import OMSAPI
+from omsapi import OMSAPI, OMSParam
 
 parser = argparse.ArgumentParser( 
     description='python script using OMS API to get maximum rate of L1 trigger algos', 
@@ -68,26 +68,26 @@ query = omsapi.query("l1algorithmtriggers")
 query.per_page = 10000  # to get all LS in one go
 
 # Projection. Specify attributes you want to fetch
-query.attrs(["name","bit","pre_dt_rate"])
-
+query.attrs(["bit","pre_dt_rate"])
+query.filter("run_number", args.run )
+
+# Data per lumisection of all bits. Contiguous bits are fetched by one request
+query.filter_in("bit", [int(bit) for bit in triggerBits])
+
+# Maximum and mean rate of each bit, computed from a single fetch
+rates = query.aggregate("bit", {"pre_dt_rate": ["max", "mean"]})
+for bit, max_rate, mean_rate in zip(rates["bit"], rates["pre_dt_rate_max"], rates["pre_dt_rate_mean"]):
+    print('max rate: {max:8.1f} Hz    mean rate: {mean:8.1f} Hz    bit {bit:3d}'.format( max = round(max_rate),
+                                                                                         mean = mean_rate,
+                                                                                         bit = bit ) )
+
+# Mean value over run can be computed by the server as well, one request per bit.
+# Query is prepared once, only the bit is substituted in the loop
+per_run = omsapi.query("l1algorithmtriggers").attrs(["name","bit","pre_dt_rate"])
+per_run = per_run.filter("run_number", args.run ).filter("bit", OMSParam("bit")).custom('group[granularity]','run').prepare()
+per_run.query.verbose = False
 for bit in triggerBits:
-    query.clear_filter().filter("run_number", args.run ).filter("bit", bit)  # returns data per lumisection
-    data = query.data().json()['data']
-    query.verbose = False
-    max = 0.0
-    for ls in data:
-        if ls['attributes']['pre_dt_rate'] > max:
-            max = ls['attributes']['pre_dt_rate']
-    print('max rate: {rate:8.1f} Hz    bit {bit:3d} {algo}'.format( rate = round(max), 
-                                                                    bit = data[0]['attributes']['bit'],
-                                                                    algo = data[0]['attributes']['name'] ) )
-
-# let's check the mean rates
-for bit in triggerBits:
-    query.clear_filter().filter("run_number", args.run ).filter("bit", bit).custom('group[granularity]','run')  # returns mean value over run or lumisection range
-    data = query.data().json()['data']
+    data = per_run.data(bit=bit).json()['data']
     print('mean rate: {rate:8.1f} Hz    bit {bit:3d} {algo}'.format( rate = data[0]['attributes']['pre_dt_rate'],
                                                                     bit = data[0]['attributes']['bit'],
                                                                     algo = data[0]['attributes']['name'] ) )
-
-
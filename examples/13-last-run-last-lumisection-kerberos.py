@@ -1,9 +1,8 @@
 """ Simple example.
-    get last global run, get last lumisection
+    get last global run, follow its lumisections
 """
 
 from __future__ import print_function
-import time
 from omsapi import OMSAPI
 
 omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1", cert_verify=False, verbose=False)
@@ -38,13 +37,12 @@ q = omsapi.query("lumisections")
 q.attrs(['lumisection_number','start_time','end_time'])
 q.filter("run_number", runInfo['run_number'])
 q.filter('cms_active', True)
-q.sort("lumisection_number", asc=False).paginate(per_page = 1)  # get last ls only
 
-while True:
-    lsInfo = q.data().json()['data'][0]['attributes']
+# print every new lumisection as soon as it is available,
+# starting after the last lumisection which exists now
+for row in q.follow("lumisection_number", idle_timeout=600):
+    lsInfo = row['attributes']
     print('\rlumisection# {0}'.format(lsInfo['lumisection_number']))
     print('from {0}'.format(lsInfo['start_time']))
     print('to {0}'.format(lsInfo['end_time']))
     print()
-    print('sleeping for 25secs ...', end='', flush=True)
-    time.sleep(25)
\ No newline at end of file
@@ -0,0 +1,36 @@
+""" Batch example.
+    Count colliding bunches of the last 20 fills, fetching bunches of all fills concurrently
+"""
+
+from __future__ import print_function
+from omsapi import OMSAPI
+
+omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1", cert_verify=False, verbose=False)
+
+# Authenticate using kerberos
+omsapi.auth_krb()
+
+q = omsapi.query("fills")
+q.attrs(["fill_number"])
+q.filter('stable_beams', True)
+q.sort("fill_number", asc=False).paginate(per_page=20)
+
+fills = [fill['attributes']['fill_number'] for fill in q.data().json()['data']]
+
+# One query per fill, executed at most 8 at a time
+queries = []
+for fill in fills:
+    queries.append({"resource": "bunches",
+                    "attrs": ["beam_1_configured", "beam_2_configured"],
+                    "filters": [{"attribute_name": "fill_number", "value": fill, "operator": "EQ"}],
+                    "per_page": 10000})
+
+for fill, result in zip(fills, omsapi.batch(queries, max_workers=8)):
+    if not result.ok:
+        print('fill# {fill}: failed ({error})'.format(fill=fill, error=result.error))
+        continue
+    colliding_bunches = 0
+    for bunch in result.json()['data']:
+        if bunch['attributes']['beam_1_configured'] and bunch['attributes']['beam_2_configured']:
+            colliding_bunches += 1
+    print('fill# {fill}: {colliding_bunches} colliding bunches'.format(fill=fill, colliding_bunches=colliding_bunches))
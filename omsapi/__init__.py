@@ -8,15 +8,35 @@ import requests
 import subprocess
 import json
 import time
+import threading
+import hashlib
+import random
+import queue
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.cookiejar import DefaultCookiePolicy
 
 # Suppress InsecureRequestWarning
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, RequestException, Timeout
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+from .cache import OMSResponseCache
+from .credentials import OMSCredentialCache, credential_key
+from .coalesce import OMSRequestCoalescer
+from .store import url_filters
+from .instrument import OMSInstrumentation, OMSTimedAdapter, current_event
+
 OMS_FILTER_OPERATORS = ["EQ", "NEQ", "LT", "GT", "LE", "GE", "LIKE", 'CT']
 OMS_INCLUDES = ["meta", "presentation_timestamp", "data_only"]
 
+# Server side grouping (group[granularity]): key attribute -> granularity.
+# Grouped responses hold mean values of per lumisection resources.
+OMS_GROUP_GRANULARITY = {"run_number": "run", "fill_number": "fill"}
+OMS_GROUPING_RESOURCES = ["lumisections", "l1algorithmtriggers", "l1triggerrates", "hltpathrates", "deadtimes"]
+
 #OpenID parameters
 cern_api_url='https://auth.cern.ch/auth/realms/cern/api-access/token'
 
@@ -25,10 +45,643 @@ class OMSApiException(Exception):
     pass
 
 
-class OMSQuery(object):
-    """ OMS Query object """
+class OMSRetryPolicy(object):
+    """ Retry policy for OMS API requests
+
+        Failed attempts (connection errors, timeouts and HTTP statuses in
+        retry_statuses) are retried with exponential backoff and jitter,
+        waiting for Retry-After if the server sends it.
+
+        Args:
+            max_attempts (int): maximum number of attempts, None for unlimited
+            backoff (float): delay in seconds before the second attempt
+            backoff_factor (float): delay multiplier for each further attempt
+            max_backoff (float): maximum delay between attempts
+            jitter (float): fraction of the delay randomly removed (0..1),
+                so that many clients do not retry in lockstep
+            budget_sec (float): maximum total time spent on one request
+                including waits, None for unlimited
+            retry_statuses (tuple): HTTP statuses to retry
+            honor_retry_after (bool): use Retry-After response header as delay
+            timeout (tuple): (connect, read) timeout of each attempt in seconds
+                (or one number for both), capped by what is left of budget_sec.
+                Read timeout is the longest wait for data from the server,
+                not the time to download the whole response. None - wait forever
+
+        Examples:
+            OMSAPI(..., retry_policy=OMSRetryPolicy(max_attempts=8, budget_sec=300, timeout=(5, 120)))
+    """
+
+    def __init__(self, max_attempts=5, backoff=1.0, backoff_factor=2.0, max_backoff=60.0, jitter=0.5,
+                 budget_sec=None, retry_statuses=(429, 502, 503, 504), honor_retry_after=True, timeout=(10.0, 300.0)):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget_sec = budget_sec
+        self.retry_statuses = retry_statuses
+        self.honor_retry_after = honor_retry_after
+        self.timeout = timeout
+
+    @classmethod
+    def from_retry_on_err_sec(cls, retry_on_err_sec, throw_on_err=False):
+        """ Policy for legacy retry_on_err_sec option: no retries if 0,
+            otherwise unlimited retries starting at retry_on_err_sec
+        """
+
+        if retry_on_err_sec <= 0 or throw_on_err:
+            return cls(max_attempts=1)
+        return cls(max_attempts=None, backoff=retry_on_err_sec, max_backoff=max(60.0, retry_on_err_sec))
+
+    def retry_after(self, response):
+        """ Delay requested by Retry-After header in seconds, or None """
+
+        value = response.headers.get("Retry-After") if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff_delay(self, attempt):
+        """ Delay after given (1-based) failed attempt """
+
+        delay = min(self.max_backoff, self.backoff * self.backoff_factor ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def next_delay(self, attempt, started, response=None):
+        """ Seconds to wait before next attempt, or None if no attempts are left
+
+            Args:
+                attempt (int): number of attempts done so far
+                started (float): time.time() of the first attempt
+                response: failed response, if any
+        """
+
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            return None
+
+        delay = self.retry_after(response) if self.honor_retry_after else None
+        if delay is None:
+            delay = self.backoff_delay(attempt)
+
+        if self.budget_sec is not None and time.time() - started + delay > self.budget_sec:
+            return None
+        return delay
+
+    def is_retryable(self, response):
+        return response.status_code in self.retry_statuses
+
+    def request_timeout(self, started=None):
+        """ (connect, read) timeout of an attempt, None for no timeout
+
+            Args:
+                started (float): time.time() of the first attempt, the
+                    timeout does not exceed what is left of budget_sec
+        """
+
+        timeout = self.timeout
+        if timeout is not None and not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        if self.budget_sec is None or started is None:
+            return timeout
+
+        remaining = max(self.budget_sec - (time.time() - started), 0.001)
+        if timeout is None:
+            return (remaining, remaining)
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+
+    def call(self, func, label="request", exceptions=(ConnectionError, Timeout)):
+        """ Call func(timeout) returning requests.Response until it succeeds
+            or no attempts are left. timeout is the request_timeout() of the
+            attempt, to be passed to requests. The last response is returned,
+            the last exception is raised.
+        """
+
+        started = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = func(self.request_timeout(started))
+            except exceptions as ex:
+                delay = self.next_delay(attempt, started)
+                if delay is None:
+                    raise
+                print("Warning: will retry {label} in {delay:.2f} seconds after connection error: {ex}".format(
+                    label=label, delay=delay, ex=ex))
+                time.sleep(delay)
+                continue
+
+            if self.is_retryable(response):
+                delay = self.next_delay(attempt, started, response)
+                if delay is not None:
+                    print("Warning: will retry {label} in {delay:.2f} seconds after HTTP {code}".format(
+                        label=label, delay=delay, code=response.status_code))
+                    response.close()
+                    time.sleep(delay)
+                    continue
+
+            return response
+
+
+class _NoStoreCookiePolicy(DefaultCookiePolicy):
+    """ Cookie policy which never stores cookies set by responses.
+
+        Cookies passed explicitly to a request are still sent, so a shared
+        session behaves like independent requests.get() calls.
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+def create_http_adapter(pool_connections=4, pool_maxsize=10):
+    """ Create HTTP adapter holding a keep-alive connection pool
+
+        Args:
+            pool_connections (int): number of hosts to keep connection pools for
+            pool_maxsize (int): maximum number of connections kept per host
+    """
+
+    return OMSTimedAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+
+def create_session(adapter=None, keep_alive=True):
+    """ Create requests.Session used for all OMS API traffic
+
+        Args:
+            adapter (HTTPAdapter): connection pool to mount (new one if None)
+            keep_alive (bool): keep connections open between requests
+    """
+
+    session = requests.Session()
+    session.cookies.set_policy(_NoStoreCookiePolicy())
+
+    if adapter is None:
+        adapter = create_http_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+
+    return session
+
+
+class OMSMetaCache(object):
+    """ Cache of resource metadata (meta fields) shared by all queries
+
+        Entries expire after ttl seconds. If cache_dir is set, entries are
+        also stored as JSON files there and shared between processes.
+    """
+
+    def __init__(self, ttl=3600, cache_dir=None):
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._entries = {}  # (base_url, resource) -> (timestamp, fields)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1("|".join(key).encode()).hexdigest() + ".json"
+        return os.path.join(self.cache_dir, name)
+
+    def _fresh(self, timestamp):
+        return self.ttl is None or time.time() - timestamp < self.ttl
+
+    def get(self, base_url, resource):
+        """ Returns cached meta fields or None if missing or expired """
+
+        key = (base_url, resource)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and self._fresh(entry[0]):
+            return entry[1]
+
+        if self.cache_dir:
+            try:
+                with open(self._path(key)) as f:
+                    stored = json.load(f)
+            except (IOError, OSError, ValueError):
+                return None
+            if self._fresh(stored["time"]):
+                with self._lock:
+                    self._entries[key] = (stored["time"], stored["fields"])
+                return stored["fields"]
+
+        return None
+
+    def put(self, base_url, resource, fields):
+        """ Store meta fields of a resource """
+
+        key = (base_url, resource)
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (now, fields)
+
+        if self.cache_dir:
+            path = self._path(key)
+            tmp_path = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump({"base_url": base_url, "resource": resource,
+                           "time": now, "fields": fields}, f)
+            os.replace(tmp_path, path)
+
+    def get_or_load(self, base_url, resource, loader):
+        """ Returns cached meta fields, calling loader() at most once
+            per key at a time if they are missing or expired.
+            Nothing is cached if loader returns None.
+        """
+
+        fields = self.get(base_url, resource)
+        if fields is not None:
+            return fields
+
+        key = (base_url, resource)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have loaded it meanwhile
+            fields = self.get(base_url, resource)
+            if fields is None:
+                fields = loader()
+                if fields is not None:
+                    self.put(base_url, resource, fields)
+
+        return fields
+
+    def invalidate(self, base_url=None, resource=None):
+        """ Drop cached entries. None matches any base_url/resource """
+
+        def match(key):
+            return base_url in (None, key[0]) and resource in (None, key[1])
+
+        with self._lock:
+            for key in [k for k in self._entries if match(k)]:
+                del self._entries[key]
+
+        if self.cache_dir:
+            for key in self.resources(base_url, include_disk=True):
+                if match(key):
+                    try:
+                        os.remove(self._path(key))
+                    except OSError:
+                        pass
+
+    def resources(self, base_url=None, include_disk=False):
+        """ Returns list of (base_url, resource) keys known to the cache """
+
+        with self._lock:
+            keys = set(self._entries)
 
-    def __init__(self, base_url, resource, verbose, cookies, oms_auth, cert_verify, throw_on_err, retry_on_err_sec, proxies):
+        if include_disk and self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.cache_dir, name)) as f:
+                        stored = json.load(f)
+                    keys.add((stored["base_url"], stored["resource"]))
+                except (IOError, OSError, ValueError, KeyError):
+                    pass
+
+        return sorted(k for k in keys if base_url in (None, k[0]))
+
+
+_meta_caches = {}
+_meta_caches_lock = threading.Lock()
+
+
+def get_meta_cache(ttl=3600, cache_dir=None):
+    """ Returns process-wide OMSMetaCache for given settings """
+
+    with _meta_caches_lock:
+        key = (ttl, cache_dir)
+        if key not in _meta_caches:
+            _meta_caches[key] = OMSMetaCache(ttl, cache_dir)
+        return _meta_caches[key]
+
+
+def _unique(values):
+    """ Remove duplicates keeping order of first occurrence """
+
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+# Query parameter placeholders are serialized as name enclosed in this character
+_PARAM_MARK = "\x1f"
+
+
+class OMSParam(object):
+    """ Placeholder of a value bound when executing a prepared query,
+        see OMSQuery.prepare()
+
+        Examples:
+            q.filter("bit", OMSParam("bit"))
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return "{mark}{name}{mark}".format(mark=_PARAM_MARK, name=self.name)
+
+    def __repr__(self):
+        return "OMSParam({name!r})".format(name=self.name)
+
+
+def _split_range(low, high, parts):
+    """ Inner boundaries splitting [low, high] into equal parts. Supports
+        numbers and ISO timestamps ("2022-06-01T12:00:00Z"), returns empty
+        list for other values.
+    """
+
+    if isinstance(low, bool) or isinstance(high, bool):
+        return []
+
+    if isinstance(low, (int, float)) and isinstance(high, (int, float)):
+        step = (high - low) / float(parts)
+        values = [low + step * i for i in range(1, parts)]
+        if isinstance(low, int) and isinstance(high, int):
+            values = [int(v) for v in values]
+        return values
+
+    if isinstance(low, str) and isinstance(high, str):
+        try:
+            start = datetime.strptime(low[:19], "%Y-%m-%dT%H:%M:%S")
+            end = datetime.strptime(high[:19], "%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+            return []
+        suffix = "Z" if low.endswith("Z") else ""
+        step = (end - start) / parts
+        return [(start + step * i).strftime("%Y-%m-%dT%H:%M:%S") + suffix for i in range(1, parts)]
+
+    return []
+
+
+def _plan_ranges(values, max_gap):
+    """ Group values into (low, high) ranges: integers at most max_gap apart
+        share a range, other values get a range of their own
+    """
+
+    integers = sorted(set(v for v in values if isinstance(v, int) and not isinstance(v, bool)))
+    others = [v for v in values if not (isinstance(v, int) and not isinstance(v, bool))]
+
+    ranges = []
+    for value in integers:
+        if ranges and value - ranges[-1][1] <= max_gap:
+            ranges[-1][1] = value
+        else:
+            ranges.append([value, value])
+
+    return [tuple(r) for r in ranges] + [(v, v) for v in others]
+
+
+# Page size of filter_in() requests, unless the query or the caller asks for larger pages
+_IN_PAGE_SIZE = 1000
+
+
+def _value_key(value):
+    """ Comparison key of a filter value: numbers and numeric strings
+        compare by value ("5" == 5 == 5.0), other values as they are
+    """
+
+    if isinstance(value, str):
+        try:
+            value = float(value) if any(c in value for c in ".eE") else int(value)
+        except ValueError:
+            return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _coerce_value(value, field_meta):
+    """ Convert value to the type of an attribute described by its meta
+        field (e.g. "5" to 5 for INTEGER). Values which do not convert are kept.
+    """
+
+    type_name = ""
+    if isinstance(field_meta, dict):
+        type_name = str(field_meta.get("type") or field_meta.get("data_type") or "").upper()
+
+    if not type_name:
+        # Unknown type: only whole floats are sent as integers
+        return _value_key(value) if isinstance(value, float) else value
+    if value is None or isinstance(value, bool):
+        return value
+    try:
+        if "INT" in type_name or type_name in ("LONG", "SHORT"):
+            key = _value_key(value)
+            return key if isinstance(key, int) else value
+        if any(t in type_name for t in ("DOUBLE", "FLOAT", "DECIMAL", "NUMBER", "NUMERIC", "REAL")):
+            return float(value)
+        if any(t in type_name for t in ("STRING", "CHAR", "TEXT")):
+            return str(value)
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+def _fetch_all(queries, per_page, page_retries, workers, buffer_pages=4):
+    """ Fetch pages of queries concurrently and yield them in order of queries
+
+        Pages of the query being consumed are passed on as they arrive.
+        Queries ahead of it are fetched at the same time, but each of them
+        buffers at most buffer_pages pages and then waits, so memory use does
+        not grow with the size of the result sets.
+
+        Yields:
+            dict: decoded pages, all pages of the first query, then of the second, ...
+    """
+
+    stop = threading.Event()
+    buffers = [queue.Queue(maxsize=max(buffer_pages, 1)) for _ in queries]
+    done = object()
+
+    def put(buffer, item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch(q, buffer):
+        if stop.is_set():
+            return
+        try:
+            for page in q.iter_pages(per_page, page_retries=page_retries):
+                if not put(buffer, (page, None)):
+                    return
+        except Exception as ex:
+            put(buffer, (None, ex))
+            return
+        put(buffer, (done, None))
+
+    # Queries start in order, so the one being consumed always has a worker
+    executor = ThreadPoolExecutor(max_workers=max(min(workers, len(queries)), 1))
+    for q, buffer in zip(queries, buffers):
+        executor.submit(fetch, q, buffer)
+
+    try:
+        for buffer in buffers:
+            while True:
+                page, error = buffer.get()
+                if error is not None:
+                    raise error
+                if page is done:
+                    break
+                yield page
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+class SharedResponse(requests.models.Response):
+    """ Response handed to several callers (see OMSRequestCoalescer).
+        JSON body is decoded once, all callers get the same decoded object.
+    """
+
+    _decoded = None
+
+    def json(self, **kwargs):
+        if kwargs:
+            return super(SharedResponse, self).json(**kwargs)
+        if self._decoded is None:
+            self._decoded = super(SharedResponse, self).json()
+        return self._decoded
+
+
+def make_response(url, status_code, content, headers=None, response_class=requests.models.Response):
+    """ Build requests.Response from already downloaded content
+
+        Args:
+            url (str): request URL
+            status_code (int): HTTP status code
+            content (bytes): response body
+            headers (dict): response headers
+            response_class (type): requests.Response or subclass
+    """
+
+    response = response_class()
+    response.url = url
+    response.status_code = status_code
+    response._content = content
+    response.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+
+    return response
+
+
+class _OMSRequestMixin(object):
+    """ HTTP GET shared by query objects. Expects session, oms_auth,
+        cookies and proxies attributes, optionally response_cache and instrumentation.
+    """
+
+    response_cache = None
+    instrumentation = None
+
+    def _begin(self, url, resource):
+        """ Start measuring a request (OMSInstrumentation), None if not instrumented """
+
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.begin(url, resource)
+
+    def _auth_identity(self):
+        """ Identity of credentials used for requests (response cache key) """
+
+        if self.oms_auth:
+            return "oidc:{id}:{aud}".format(id=self.oms_auth.client_id, aud=self.oms_auth.audience)
+        if self.cookies:
+            return "cookies:" + hashlib.sha1(json.dumps(sorted(self.cookies.items())).encode()).hexdigest()
+        return ""
+
+    def _session_get(self, url, stream=False, **kwargs):
+        event = current_event()
+        if event is None:
+            return self.session.get(url, stream=stream, **kwargs)
+        return event.timed_get(lambda: self.session.get(url, stream=stream, **kwargs), stream)
+
+    def _get(self, url, verify=False, stream=False, headers=None, timeout=None):
+        if self.oms_auth:
+            # Token is renewed in advance if it is about to expire
+            token_headers, generation = self.oms_auth.get_token_headers()
+            req_headers = dict(token_headers, **(headers or {}))
+            response = self._session_get(url, verify=verify, headers=req_headers, proxies=self.proxies, allow_redirects=False, stream=stream,
+                                         timeout=timeout)
+            #check if token has expired (Unauthorized)
+            if response.status_code == 401:
+                print("Unauthorized. Will try to obtain a new token")
+                response.close()
+                event = current_event()
+                if event is not None:
+                    event.token_renewals += 1
+                self.oms_auth.renew_token(generation)
+                token_headers, _ = self.oms_auth.get_token_headers()
+                req_headers = dict(token_headers, **(headers or {}))
+                return self._session_get(url, verify=verify, headers=req_headers, proxies=self.proxies, allow_redirects=False, stream=stream,
+                                         timeout=timeout)
+            return response
+        else:
+            return self._session_get(url, verify=verify, headers=headers, cookies=self.cookies, proxies=self.proxies, allow_redirects=False, stream=stream,
+                                     timeout=timeout)
+
+    def get_request(self, url, verify=False, stream=False, no_cache=False, timeout=None):
+        cache = self.response_cache
+        if cache is None or stream or no_cache:
+            return self._get(url, verify, stream, timeout=timeout)
+
+        event = current_event()
+        key = cache.key(url, self._auth_identity())
+        entry = cache.lookup(key)
+        if entry is not None and entry.fresh():
+            if event is not None:
+                event.cache = "hit"
+            return make_response(url, entry.status_code, entry.content, entry.headers)
+
+        response = self._get(url, verify, headers=entry.validators() if entry else None, timeout=timeout)
+
+        if response.status_code == 304 and entry is not None:
+            cache.revalidated(key)
+            if event is not None:
+                event.cache = "revalidated"
+                event.bytes = len(entry.content)
+            return make_response(url, entry.status_code, entry.content, entry.headers)
+
+        if event is not None:
+            event.cache = "miss"
+
+        if response.status_code == 200:
+            resource = getattr(self, "resource", None)
+            cache.store(key, url, response.status_code, response.content, response.headers,
+                        resource.split("/")[0] if resource else None)
+
+        return response
+
+
+class _OMSQueryBuilder(object):
+    """ Projection, filtering, sorting and pagination of a query and its URL,
+        shared by OMSQuery and omsapi.aio.AsyncOMSQuery. Subclasses execute
+        the query, create siblings (_sibling()) and load metadata (_load_meta()).
+    """
+
+    def __init__(self, base_url, resource, verbose, cookies, oms_auth, cert_verify, throw_on_err, retry_on_err_sec, proxies, session,
+                 meta_cache=None, retry_policy=None):
         self.attribute_validation = True
         self.base_url = base_url
         self.resource = resource
@@ -39,6 +692,9 @@ class OMSQuery(object):
         self.err_sec = retry_on_err_sec
         self.proxies = proxies
         self.throw_on_err = throw_on_err
+        self.session = session
+        self.meta_cache = meta_cache or get_meta_cache()
+        self.retry_policy = retry_policy or OMSRetryPolicy.from_retry_on_err_sec(retry_on_err_sec, throw_on_err)
 
         self._attrs = None  # Projection
         self._filter = []  # Filtering
@@ -50,10 +706,20 @@ class OMSQuery(object):
         self.page = 1
         self.per_page = 10
 
-        # Metadata
-        self.metadata = None
+        # Metadata, loaded lazily on first use (_load_meta() of subclasses)
+        self._metadata = None
+        self._meta_loaded = False
 
-        self._load_meta()
+    @property
+    def metadata(self):
+        if not self._meta_loaded:
+            self._load_meta()
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+        self._meta_loaded = True
 
     def _attr_exists(self, attr):
         """ Check if attribute exists
@@ -63,6 +729,10 @@ class OMSQuery(object):
                       True if exists or it is not available to check
         """
 
+        # Do not fetch metadata only to print a warning
+        if not self.attribute_validation and not self._meta_loaded:
+            return True
+
         if self.metadata and attr not in self.metadata:
             self._warn("Attribute [{attr}] does not exist. " +
                        "Check for a typo or disable validation " +
@@ -73,25 +743,6 @@ class OMSQuery(object):
 
         return True
 
-    def _load_meta(self):
-        """ Load meta information about resource without fetching data"""
-
-        resourceBase = self.resource.split("/")[0]
-        url = "{base_url}/{resource}/meta".format(base_url=self.base_url,
-                                                  resource=resourceBase)
-
-        response = self.get_request(url, verify=self.cert_verify)
-
-        if response.status_code == 302:
-            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
-        elif response.status_code != 200:
-            self._warn("Failed to fetch meta information")
-        else:
-            try:
-                self.metadata = response.json()["meta"]["fields"]
-            except (ValueError, KeyError, TypeError):
-                self._warn("Meta information is incorrect")
-
     def _warn(self, message, raise_exc=False):
         """ Print Warning message or raise Exception
 
@@ -144,9 +795,8 @@ class OMSQuery(object):
         if not isinstance(attributes, list):
             self._warn("attrs() - attributes must be a list", raise_exc=True)
 
-        # Find only existing attributes, remove duplicates
-        self._attrs = [attr for attr in set(
-            attributes) if self._attr_exists(attr)]
+        # Find only existing attributes, remove duplicates keeping order
+        self._attrs = [attr for attr in _unique(attributes) if self._attr_exists(attr)]
 
         return self
 
@@ -187,7 +837,7 @@ class OMSQuery(object):
             # Check metadata if attribute is searchable
             searchable = True
             try:
-                searchable = self.metadata["searchable"]
+                searchable = self._metadata["searchable"]
             except (KeyError, TypeError):
                 # Metadata is not available or not complete
                 pass
@@ -225,7 +875,7 @@ class OMSQuery(object):
             # Check metadata if attribute is sortable
             sortable = True
             try:
-                sortable = self.metadata["fields"]["sortable"]
+                sortable = self._metadata["fields"]["sortable"]
             except (KeyError, TypeError):
                 # Metadata is not available or not complete
                 pass
@@ -294,31 +944,37 @@ class OMSQuery(object):
                 str
         """
 
+        return self._data_url(self.per_page * (self.page - 1), self.per_page)
+
+    def _data_url(self, page_offset, page_limit):
+        """ Contruct data URL for given page offset and limit """
+
         url = "{base_url}/{resource}".format(base_url=self.base_url,
                                               resource=self.resource)
 
+        # Parameters are always serialized in the same order, so that the same
+        # query gives the same URL (HTTP caches). Sort keys keep their priority.
         url_params = []
 
         # Project
         if self._attrs:
-            url_params.append("fields=" + ",".join(set(self._attrs)))
+            url_params.append("fields=" + ",".join(_unique(self._attrs)))
 
         # Filter
         url_params.extend(self._filter)
 
         # Sort
         if self._sort:
-            url_params.append("sort=" + ",".join(set(self._sort)))
+            url_params.append("sort=" + ",".join(_unique(self._sort)))
 
         # Include
         if self._include:
-            url_params.append("include=" + ",".join(set(self._include)))
+            url_params.append("include=" + ",".join(_unique(self._include)))
 
         # Paginate
-        page_offset = self.per_page * (self.page - 1)
         url_params.append("page[offset]={offset}".format(offset=page_offset))
         url_params.append(
-            "page[limit]={per_page}".format(per_page=self.per_page))
+            "page[limit]={per_page}".format(per_page=page_limit))
 
         # Custom parameters
         url_params.extend(self._custom)
@@ -328,38 +984,48 @@ class OMSQuery(object):
 
         return url
 
+    def copy(self):
+        """ Independent copy of the query (projection, filters, sorting,
+            pagination, ...) using the same client settings
 
-    def data(self):
-        """ Execute query and retrieve data
-
-            Returns:
-                requests.Response object
+            Examples:
+                last = q.copy().sort("run_number", asc=False).paginate(1, 1)
         """
 
-        url = self.data_query()
+        q = self._sibling(self.resource)
+        q.attribute_validation = self.attribute_validation
+        q._metadata = self._metadata
+        q._meta_loaded = self._meta_loaded
+        q._attrs = list(self._attrs) if self._attrs is not None else None
+        q._filter = list(self._filter)
+        q._sort = list(self._sort)
+        q._include = list(self._include)
+        q._custom = list(self._custom)
+        q.page = self.page
+        q.per_page = self.per_page
 
-        if self.verbose:
-            print(url)
-        if self.err_sec > 0:
-            while True:
-                try:
-                    ret = self.get_request(url, verify=self.cert_verify)
-                    break
-                except ConnectionError as ex:
-                    if self.throw_on_err:
-                        raise
-                    print("Warning: will retry in " + str(self.err_sec) + "seconds after connection error: " + str(ex))
-                    time.sleep(self.err_sec)
-        else:
-            ret = self.get_request(url, verify=self.cert_verify)
+        return q
 
-        if ret.status_code == 302:
-            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
+    @staticmethod
+    def _is_last_page(page, page_offset, page_limit):
+        """ Check from page content and response meta if there are more pages """
 
-        if self.throw_on_err and ret.status_code not in [200, 201]:
-            raise Exception("HTTP Error", ret)
+        return _OMSQueryBuilder._is_last(len(page.get("data") or []), page.get("meta"), page_offset, page_limit)
 
-        return ret
+    @staticmethod
+    def _is_last(rows_count, meta, page_offset, page_limit):
+        """ Row count from meta is trusted if present: server may return
+            fewer rows than page_limit (maximum page size). Otherwise a
+            short page is the last one.
+        """
+
+        if rows_count == 0:
+            return True
+
+        try:
+            return meta["totalResourceCount"] <= page_offset + rows_count
+        except (KeyError, TypeError):
+            return rows_count < page_limit
 
     def meta(self):
         """ Returns metadata of a resource.
@@ -370,166 +1036,1547 @@ class OMSQuery(object):
         """
         return self.metadata
 
-    def get_request(self, url, verify=False):
-        if self.oms_auth:
-            response = requests.get(url, verify=verify, headers=self.oms_auth.token_headers, proxies=self.proxies, allow_redirects=False)
-            #check if token has expired (Unauthorized)
-            if response.status_code == 401:
-                print("Unauthorized. Will try to obtain a new token")
-                self.oms_auth.auth_oidc()
-                return requests.get(url, verify=verify, headers=self.oms_auth.token_headers, proxies=self.proxies, allow_redirects=False)
-            return response
-        else:
-            return requests.get(url, verify=verify, cookies=self.cookies, proxies=self.proxies, allow_redirects=False)
 
+class OMSQuery(_OMSRequestMixin, _OMSQueryBuilder):
+    """ OMS Query object """
 
+    def __init__(self, base_url, resource, verbose, cookies, oms_auth, cert_verify, throw_on_err, retry_on_err_sec, proxies, session=None, meta_cache=None, response_cache=None, result_store=None,
+                 retry_policy=None, coalescer=None, instrumentation=None):
+        super(OMSQuery, self).__init__(base_url, resource, verbose, cookies, oms_auth, cert_verify, throw_on_err, retry_on_err_sec, proxies,
+                                       session or create_session(), meta_cache=meta_cache, retry_policy=retry_policy)
+        self.response_cache = response_cache
+        self.result_store = result_store
+        self.coalescer = coalescer
+        self.instrumentation = instrumentation
 
-class OMSMetaQuery(object):
-    """ OMS Meta Query object """
+        self._filter_in = None  # Set-membership filter: (attribute, values, max_gap, workers)
+        self._no_cache = False  # Bypass caches and request coalescing (polling queries)
 
-    def __init__(self, base_url, verbose, cookies, oms_auth, cert_verify, retry_on_err_sec, proxies):
-        self.attribute_validation = True
-        self.base_url = base_url
-        self.verbose = verbose
-        self.cookies = cookies
-        self.oms_auth = oms_auth
-        self.cert_verify = cert_verify
-        self.err_sec = retry_on_err_sec
-        self.proxies = proxies
+    def _load_meta(self, force=False):
+        """ Load meta information about resource without fetching data
 
-    def data(self, path):
-        if path.startswith('/'):
-            ret = self.get_request(self.base_url + path, verify=self.cert_verify)
-        else:
-            ret = self.get_request(self.base_url + '/' + path, verify=self.cert_verify)
-        if ret.status_code == 302:
-            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
-        return ret
- 
-    def get_request(self, url, verify=False):
-        if self.oms_auth:
-            response = requests.get(url, verify=verify, headers=self.oms_auth.token_headers, proxies=self.proxies, allow_redirects=False)
-            #check if token has expired (Unauthorized)
-            if response.status_code == 401:
-                print("Unauthorized. Will try to obtain a new token")
-                self.oms_auth.auth_oidc()
-                return requests.get(url, verify=verify, headers=self.oms_auth.token_headers, proxies=self.proxies, allow_redirects=False)
-            return response
-        else:
-            return requests.get(url, verify=verify, cookies=self.cookies, proxies=self.proxies, allow_redirects=False)
+            Args:
+                force (bool): bypass meta cache and fetch again
+        """
 
- 
-class OMSAPIOAuth(object):
-    """ OMS API token store and manager """
+        resourceBase = self.resource.split("/")[0]
 
-    def __init__(self, client_id, client_secret, audience="cmsoms-prod", cert_verify=True, proxies={}, retry_on_err_sec=0):
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.audience = audience
-        self.cert_verify = cert_verify
-        self.proxies = proxies
-        self.token_json = None
-        self.token_time = None
-        self.err_sec = retry_on_err_sec
- 
-    def auth_oidc(self):
-        """ Authorisation Using CERN Open ID authentication wrappeer"""
-        if self.err_sec > 0:
-            while True:
+        def fetch():
+            url = "{base_url}/{resource}/meta".format(base_url=self.base_url,
+                                                      resource=resourceBase)
+
+            event = self._begin(url, resourceBase + "/meta")
+            try:
+                response = self.retry_policy.call(lambda timeout: self.get_request(url, verify=self.cert_verify, timeout=timeout))
+            except Exception as ex:
+                if event is not None:
+                    self.instrumentation.end(event, error=ex)
+                raise
+            if event is not None:
+                self.instrumentation.end(event, response)
+
+            if response.status_code == 302:
+                raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
+            elif response.status_code != 200:
+                self._warn("Failed to fetch meta information")
+            else:
                 try:
-                    return self.auth_oidc_req()
-                except ConnectionError as ex:
-                    print("Warning: will retry auth_oidc in " + str(self.err_sec) + "seconds after connection error: " + str(ex))
-                    time.sleep(self.err_sec)
-        else:
-            return self.auth_oidc_req()
+                    return response.json()["meta"]["fields"]
+                except (ValueError, KeyError, TypeError):
+                    self._warn("Meta information is incorrect")
+            return None
 
-    def auth_oidc_req(self):
-        """ Authorisation Using CERN Open ID authentication """
+        if force:
+            self.meta_cache.invalidate(self.base_url, resourceBase)
 
-        current_time = time.time()
-        if self.token_json and self.token_time:
-            if current_time - self.token_time < 30:
-                print("Warning: token was requested less than 30 seconds ago. Will not renew this time.")
-                return "OK"
-                
-        self.token_time = current_time
-        token_req_data = {
-            'grant_type': 'client_credentials',
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'audience': self.audience
-        }
-        ret = requests.post(cern_api_url, data=token_req_data, verify=self.cert_verify, proxies=self.proxies)
-        if ret.status_code!=200:
-            raise Exception("Unable to acquire OAuth token: " + ret.content.decode())
+        self.metadata = self.meta_cache.get_or_load(self.base_url, resourceBase, fetch)
 
-        self.token_json = json.loads(ret.content)
-        self.token_headers = {'Authorization':'Bearer ' + self.token_json["access_token"], 'content-type':'application/json'}
-        return "OK"
+    def _no_filter_in(self, method):
+        """ Raise ValueError if filter_in() is set, for methods which cannot apply it """
 
- 
-class OMSAPI(object):
-    """ Base OMS API client """
+        if self._filter_in is not None:
+            raise ValueError("{method}() does not support filter_in()".format(method=method))
 
-    def __init__(self, api_url="https://cmsoms.cern.ch/agg/api", api_version="v1", verbose=True, cert_verify=True, throw_on_err=False, retry_on_err_sec=0, proxies={}):
-        self.api_url = api_url
-        self.api_version = api_version
-        self.verbose = verbose
-        self.cert_verify = cert_verify 
-        self.err_sec = retry_on_err_sec
-        self.proxies = proxies
-        self.throw_on_err = throw_on_err
+    def data(self):
+        """ Execute query and retrieve data
 
-        self.base_url = "{api_url}/{api_version}".format(api_url=api_url,
-                                                         api_version=api_version)
+            Returns:
+                requests.Response object
+        """
 
-        index =  self.api_url.find('://')
-        if index >= 0:
-            tmp = self.api_url[index + 3 : ]
-            self.api_url_host = self.api_url[: index + 3] + tmp[: tmp.find('/')]
-        else:
-            self.api_url_host = self.api_url_host[: self.api_url_host.find('/')]
-        self.oms_auth = None
-        self.cookies = {}
+        url = self.data_query()
+        if _PARAM_MARK in url:
+            self._warn("data() - query has unbound parameters (OMSParam), use prepare()", raise_exc=True)
+
+        if self._filter_in is not None:
+            # Merge rows of all filter_in() requests into one response
+            rows = [row for rows in self.rows_by_value().values() for row in rows]
+            content = {"data": rows, "links": {}, "meta": {"totalResourceCount": len(rows)}}
+            response = make_response(url, 200, json.dumps(content).encode(), {"Content-Type": "application/json"}, SharedResponse)
+            response._decoded = content
+            return response
 
-    def query(self, resource, query_validation=True):
-        """ Create query object """
+        return self._fetch_measured(url)
 
-        q = OMSQuery(self.base_url, resource=resource, verbose=self.verbose,
-                     cookies=self.cookies, oms_auth=self.oms_auth, cert_verify=self.cert_verify, throw_on_err=self.throw_on_err, retry_on_err_sec=self.err_sec, proxies=self.proxies)
+    def _fetch_measured(self, url):
+        """ _fetch() measured as one request of the query resource (see
+            omsapi.instrument). Requests made meanwhile by this thread for
+            another measured request are accounted to that request.
+        """
 
-        return q
+        event = self._begin(url, self.resource.split("/")[0])
+        if event is None:
+            return self._fetch(url)
 
-    def query_metadata(self, query_validation=True):
-        """ Create query object for metadata"""
+        try:
+            response = self._fetch(url)
+        except Exception as ex:
+            self.instrumentation.end(event, error=ex)
+            raise
+        self.instrumentation.end(event, response)
+        return response
 
-        q = OMSMetaQuery(self.api_url, verbose=self.verbose,
-                     cookies=self.cookies, oms_auth=self.oms_auth, cert_verify=self.cert_verify, retry_on_err_sec=self.err_sec, proxies=self.proxies)
+    def prepare(self):
+        """ Compile the query into a template, parameters given as OMSParam
+            are bound on each execution. Projection, filters and validation
+            are done once, executing the template only substitutes values.
 
-        return q
+            Returns:
+                OMSPreparedQuery
 
-    def auth_oidc(self, client_id, client_secret, audience="cmsoms-prod", proxies={}):
-        """ Authorisation Using CERN Open ID authentication """
+            Examples:
+                tmpl = q.filter("run_number", OMSParam("run")).filter("bit", OMSParam("bit")).prepare()
+                for bit in bits:
+                    rows = tmpl.data(run=355100, bit=bit).json()["data"]
+        """
 
-        if not self.oms_auth:
-            self.oms_auth = OMSAPIOAuth(client_id, client_secret, audience, self.cert_verify, proxies=proxies, retry_on_err_sec=self.err_sec)
-        self.oms_auth.auth_oidc()
+        return OMSPreparedQuery(self)
 
-    def auth_krb(self):
-        """ Authorisation for https using kerberos, also supports 2FA"""
-        import tsgauth
-        tsg_auth = tsgauth.oidcauth.KerbSessionAuth()
+    def _fetch(self, url, stream=False, no_cache=False):
+        """ Execute request for data URL, retrying on connection errors
+
+            Args:
+                stream (bool): do not download response body in advance
+                no_cache (bool): always send the request, bypassing result
+                    store, response cache and coalescing (also if the query
+                    has _no_cache set)
+
+            Returns:
+                requests.Response object
+        """
+
+        if self.verbose:
+            print(url)
+
+        no_cache = no_cache or self._no_cache
+        if self.coalescer is None or stream or no_cache:
+            return self._fetch_once(url, stream, no_cache)
+
+        # Identical requests in flight share one HTTP call
+        key = (OMSResponseCache.canonical_url(url), self._auth_identity())
+        ret = self.coalescer.do(key, lambda: self._fetch_once(url),
+                                share=lambda ret: make_response(ret.url, ret.status_code, ret.content, ret.headers, SharedResponse))
+
+        # Nothing was sent and nothing came from a cache: result of a concurrent request
+        event = current_event()
+        if event is not None and not event.attempts and event.cache is None:
+            event.cache = "coalesced"
+        return ret
+
+    def _fetch_once(self, url, stream=False, no_cache=False):
+        store = None if stream or no_cache else self.result_store
+        if store is not None:
+            stored = store.get(url, self._auth_identity())
+            if stored is not None:
+                event = current_event()
+                if event is not None:
+                    event.cache = "store"
+                return make_response(url, stored[0], stored[1], stored[2])
+
+        ret = self.retry_policy.call(lambda timeout: self.get_request(url, verify=self.cert_verify, stream=stream, no_cache=no_cache,
+                                                                      timeout=timeout))
+
+        if ret.status_code == 302:
+            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
+
+        if self.throw_on_err and ret.status_code not in [200, 201]:
+            raise Exception("HTTP Error", ret)
+
+        if store is not None and ret.status_code == 200:
+            # Filters of the URL, not of the query: prepared queries and shards fill in their own
+            resourceBase = self.resource.split("/")[0]
+            immutable = store.is_immutable(resourceBase, url_filters(url),
+                                           lambda: ret.json().get("data") or [], self._parent_finished)
+            store.put(url, resourceBase, ret.status_code, ret.content, ret.headers, immutable, self._auth_identity())
+
+        return ret
+
+    def _sibling(self, resource):
+        """ Create query for another resource with the same settings """
+
+        return OMSQuery(self.base_url, resource, verbose=self.verbose, cookies=self.cookies, oms_auth=self.oms_auth,
+                        cert_verify=self.cert_verify, throw_on_err=self.throw_on_err, retry_on_err_sec=self.err_sec,
+                        proxies=self.proxies, session=self.session, meta_cache=self.meta_cache,
+                        response_cache=self.response_cache, retry_policy=self.retry_policy, coalescer=self.coalescer,
+                        instrumentation=self.instrumentation)
+
+    def copy(self):
+        q = super(OMSQuery, self).copy()
+        q.result_store = self.result_store
+        q._filter_in = self._filter_in
+
+        return q
+
+    def _parent_finished(self, resource, key, value):
+        """ Check if run/fill exists and has end_time (result store helper).
+            The answer is kept in the result store, forever once finished.
+        """
+
+        parent = self._sibling(resource)
+        parent.set_validation(False)
+        parent.attrs([key, "end_time"]).filter(key, value).paginate(1, 1)
+        url = parent.data_query()
+
+        stored = self.result_store.get(url, self._auth_identity())
+        if stored is not None:
+            content = stored[1]
+        else:
+            # Measured separately from the request being stored
+            ret = parent._fetch_measured(url)
+            if ret.status_code != 200:
+                return False
+            content = ret.content
+
+        try:
+            rows = json.loads(content.decode("utf-8")).get("data") or []
+        except (ValueError, AttributeError):
+            return False
+        finished = bool(rows) and (rows[0].get("attributes") or {}).get("end_time") is not None
+
+        if stored is None:
+            self.result_store.put(url, resource, 200, content, ret.headers, finished, self._auth_identity())
+
+        return finished
+
+    def _fetch_page(self, page_offset, page_limit):
+        """ Fetch and decode one page of the result set
+
+            Returns:
+                dict: decoded JSON response
+        """
+
+        url = self._data_url(page_offset, page_limit)
+        event = self._begin(url, self.resource.split("/")[0])
+        try:
+            ret = self._fetch(url)
+
+            if ret.status_code not in [200, 201]:
+                raise OMSApiException("Failed to fetch page at offset {offset}: HTTP {code}".format(
+                    offset=page_offset, code=ret.status_code))
+
+            if event is None:
+                return ret.json()
+
+            start = time.perf_counter()
+            page = ret.json()
+            event.decode = time.perf_counter() - start
+        except Exception as ex:
+            if event is not None:
+                self.instrumentation.end(event, error=ex)
+            raise
+
+        self.instrumentation.end(event, ret)
+        return page
+
+    def _stream_page(self, page_offset, page_limit, members, chunk_size):
+        """ Fetch one page and yield its rows while the body is downloaded
+
+            Args:
+                members (dict): receives other top-level members ("meta", "links")
+        """
+
+        from .jsonstream import iter_array_items
+
+        url = self._data_url(page_offset, page_limit)
+        event = self._begin(url, self.resource.split("/")[0])
+        try:
+            ret = self._fetch(url, stream=True)
+        except Exception as ex:
+            if event is not None:
+                self.instrumentation.end(event, error=ex)
+            raise
+
+        chunks = ret.iter_content(chunk_size)
+        if event is not None:
+            # Rows are yielded to the caller, requests it makes meanwhile are not part of this one
+            self.instrumentation.detach(event)
+            chunks = self._count_chunks(chunks, event)
+        start = time.perf_counter()
+        error = None
+
+        try:
+            if ret.status_code not in [200, 201]:
+                raise OMSApiException("Failed to fetch page at offset {offset}: HTTP {code}".format(
+                    offset=page_offset, code=ret.status_code))
+
+            for row in iter_array_items(chunks, "data", members):
+                yield row
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            ret.close()
+            if event is not None:
+                event.download += time.perf_counter() - start
+                self.instrumentation.end(event, ret, error)
+
+    @staticmethod
+    def _count_chunks(chunks, event):
+        """ Pass chunks through, adding their size to the event """
+
+        event.bytes = 0
+        for chunk in chunks:
+            event.bytes += len(chunk)
+            yield chunk
+
+    def _fetch_page_retry(self, page_offset, page_limit, page_retries):
+        """ Fetch one page, retrying failures left after the retry policy
+            (e.g. other HTTP errors, broken JSON) page_retries times
+        """
+
+        attempt = 0
+        while True:
+            try:
+                return self._fetch_page(page_offset, page_limit)
+            except (OMSApiException, RequestException, ValueError) as ex:
+                attempt += 1
+                if attempt > page_retries:
+                    raise OMSApiException("Page at offset {offset} failed after {n} attempts: {ex}".format(
+                        offset=page_offset, n=attempt, ex=ex))
+                self._warn("page at offset {offset} failed, retrying: {ex}".format(offset=page_offset, ex=ex))
+                time.sleep(self.retry_policy.backoff_delay(attempt))
+
+    def iter_pages(self, per_page=None, workers=1, page_retries=2):
+        """ Iterate over all pages of a result set, starting from the current page.
+            Only one page is kept in memory at a time (up to workers pages
+            when fetching in parallel).
+
+            Args:
+                per_page (int): page size (default is query page size)
+                workers (int): number of pages fetched concurrently.
+                    Pages are still yielded in order.
+                    Keep it below pool_maxsize of OMSAPI
+                page_retries (int): retries of a failed page before giving up
+
+            Yields:
+                dict: decoded JSON response of each page. With filter_in()
+                    pages of its requests holding only matching rows
+
+            Examples:
+                for page in q.iter_pages(per_page=1000, workers=8):
+                    print(len(page["data"]))
+        """
+
+        if self._filter_in is not None:
+            for page in self._iter_in_pages(per_page, page_retries):
+                yield page
+            return
+
+        per_page = per_page or self.per_page
+        page_offset = per_page * (self.page - 1)
+
+        if workers > 1:
+            for page in self._iter_pages_parallel(page_offset, per_page, workers, page_retries):
+                yield page
+            return
+
+        while True:
+            page = self._fetch_page_retry(page_offset, per_page, page_retries)
+            yield page
+
+            if self._is_last_page(page, page_offset, per_page):
+                return
+            # Next page starts after the rows received (server may cap page size)
+            page_offset += len(page.get("data") or [])
+
+    def _iter_pages_parallel(self, page_offset, per_page, workers, page_retries):
+        """ Fetch pages with a thread pool, keeping up to workers requests
+            in flight, and yield them in order.
+
+            Total row count is taken from the first page meta if available.
+            Otherwise pages are requested ahead speculatively and those
+            beyond the last page are discarded. If the first page is shorter
+            than per_page but not the last one, the server caps page size
+            and following pages are requested with the size it returned.
+        """
+
+        first = self._fetch_page_retry(page_offset, per_page, page_retries)
+        yield first
+        if self._is_last_page(first, page_offset, per_page):
+            return
+        per_page = min(per_page, len(first.get("data") or []))
+
+        try:
+            end_offset = first["meta"]["totalResourceCount"]
+        except (KeyError, TypeError):
+            end_offset = None
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = []  # (offset, future) in page order
+        next_offset = page_offset + per_page
+
+        try:
+            while True:
+                while len(pending) < workers and (end_offset is None or next_offset < end_offset):
+                    pending.append((next_offset, executor.submit(self._fetch_page_retry,
+                                                                 next_offset, per_page, page_retries)))
+                    next_offset += per_page
+
+                if not pending:
+                    return
+
+                offset, future = pending.pop(0)
+                page = future.result()
+                yield page
+
+                if self._is_last_page(page, offset, per_page):
+                    return
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_rows(self, per_page=None, workers=1, page_retries=2, stream=False, chunk_size=65536):
+        """ Iterate over all rows of a result set, fetching pages on demand
+
+            Args:
+                per_page (int): page size (default is query page size)
+                workers (int): number of pages fetched concurrently
+                page_retries (int): retries of a failed page before giving up
+                stream (bool): parse rows incrementally while each page is
+                    downloaded, so only one row is held in memory.
+                    Pages are fetched one by one and are not retried
+                chunk_size (int): size of chunks read from the response in stream mode
+
+            Yields:
+                dict: single JSON:API resource object ("id", "attributes", ...)
+
+            Examples:
+                for row in q.iter_rows(per_page=1000):
+                    print(row["attributes"]["run_number"])
+        """
+
+        if stream:
+            if workers > 1:
+                self._warn("iter_rows() - stream mode fetches pages one by one, use workers=1",
+                           raise_exc=True)
+
+            if self._filter_in is not None:
+                # Requests of filter_in() one after another
+                attribute, accepted = self._in_accepted()
+                for q in self._in_queries():
+                    for row in q.iter_rows(per_page or max(self.per_page, _IN_PAGE_SIZE), stream=True,
+                                           chunk_size=chunk_size):
+                        if _value_key((row.get("attributes") or {}).get(attribute)) in accepted:
+                            yield row
+                return
+
+            per_page = per_page or self.per_page
+            page_offset = per_page * (self.page - 1)
+
+            while True:
+                members = {}
+                rows_count = 0
+                for row in self._stream_page(page_offset, per_page, members, chunk_size):
+                    rows_count += 1
+                    yield row
+
+                if self._is_last(rows_count, members.get("meta"), page_offset, per_page):
+                    return
+                page_offset += rows_count
+
+        for page in self.iter_pages(per_page, workers, page_retries):
+            for row in page.get("data") or []:
+                yield row
+
+    def columns(self, per_page=None, workers=1, page_retries=2):
+        """ Fetch all pages and return one typed numpy array per projected
+            attribute (all attributes if there is no projection).
+            Types come from resource metadata, nulls are masked
+            (numpy.ma.MaskedArray), timestamps are datetime64[ms] in UTC.
+            Requires numpy.
+
+            Args:
+                per_page (int): page size (default is query page size)
+                workers (int): number of pages fetched concurrently
+                page_retries (int): retries of a failed page before giving up
+
+            Returns:
+                dict: attribute name -> numpy array
+
+            Examples:
+                cols = q.attrs(["lumisection_number", "delivered_lumi"]).columns(per_page=10000)
+                print(cols["delivered_lumi"].sum())
+        """
+
+        from .columnar import page_columns, concat_columns
+
+        fields = self.metadata if self.attribute_validation else self._metadata
+        attributes = self._attrs or (list(fields) if fields else None)
+
+        pages = (page.get("data") or [] for page in self.iter_pages(per_page, workers, page_retries))
+
+        columns = []
+        for rows in pages:
+            if attributes is None and rows:
+                attributes = list(rows[0].get("attributes") or {})
+            columns.append(page_columns(rows, attributes or [], fields))
+
+        return concat_columns(columns, attributes or [])
+
+    def dataframe(self, per_page=None, workers=1, page_retries=2):
+        """ Same as columns(), but returns pandas DataFrame. Requires pandas.
+
+            Examples:
+                df = q.dataframe(per_page=10000, workers=4)
+        """
+
+        from .columnar import to_dataframe
+
+        return to_dataframe(self.columns(per_page, workers, page_retries))
+
+    def records(self, per_page=None, workers=1, page_retries=2, intern=True):
+        """ Fetch all pages and return rows as compact record objects instead
+            of JSON:API dicts. One class with __slots__ is generated per
+            resource and projection (see omsapi.records.record_class()),
+            repeated string values are interned.
+
+            Args:
+                per_page (int): page size (default is query page size)
+                workers (int): number of pages fetched concurrently
+                page_retries (int): retries of a failed page before giving up
+                intern (bool): intern string values
+
+            Returns:
+                list: OMSRecord objects, attributes accessible as r.run_number
+
+            Examples:
+                lumis = q.attrs(["run_number", "lumisection_number", "delivered_lumi"]).records(per_page=10000)
+                print(sum(r.delivered_lumi or 0 for r in lumis))
+        """
+
+        records = []
+        for chunk in self._iter_record_pages(per_page, workers, page_retries, intern):
+            records.extend(chunk)
+        return records
+
+    def iter_records(self, per_page=None, workers=1, page_retries=2, intern=True):
+        """ Same as records(), but yields records page by page """
+
+        for chunk in self._iter_record_pages(per_page, workers, page_retries, intern):
+            for record in chunk:
+                yield record
+
+    def _iter_record_pages(self, per_page, workers, page_retries, intern):
+        from .records import record_class, to_records
+
+        fields = self.metadata if self.attribute_validation else self._metadata
+        attributes = self._attrs or (list(fields) if fields else None)
+
+        pages = (page.get("data") or [] for page in self.iter_pages(per_page, workers, page_retries))
+
+        cls = None
+        for rows in pages:
+            if cls is None:
+                if attributes is None and rows:
+                    attributes = list(rows[0].get("attributes") or {})
+                cls = record_class(self.resource, _unique(attributes or []), intern)
+            yield to_records(rows, cls)
+
+    def aggregate(self, by, aggregates, per_page=None, workers=1, page_retries=2, pushdown=None):
+        """ Group-by aggregation of the result set.
+
+            Means grouped by run or fill are computed by the server
+            (group[granularity]) for per lumisection resources. Otherwise
+            result set is fetched once as columns and all aggregates are
+            computed locally with numpy. Requires numpy.
+
+            Args:
+                by (str/list): attribute(s) to group by
+                aggregates (dict): attribute -> list of functions, one of
+                    "count", "sum", "mean", "min", "max". Nulls are ignored.
+                per_page (int): page size (default is query page size)
+                workers (int): number of pages fetched concurrently
+                page_retries (int): retries of a failed page before giving up
+                pushdown (bool): force (True) or disable (False) server side
+                    grouping, None - use it whenever possible
+
+            Returns:
+                dict: group keys and "{attribute}_{function}" columns (numpy
+                    arrays), sorted by keys. Rows per group: "count" function
+                    of an attribute (not computed by the server)
+
+            Examples:
+                q = omsapi.query("l1algorithmtriggers").filter("run_number", 355100)
+                rates = q.aggregate("bit", {"pre_dt_rate": ["max", "mean"]}, per_page=10000)
+                print(rates["bit"], rates["pre_dt_rate_max"])
+        """
+
+        from .columnar import group_aggregate
+
+        by = [by] if isinstance(by, str) else list(by)
+        functions = set(f for fs in aggregates.values() for f in fs)
+        granularity = OMS_GROUP_GRANULARITY.get(by[0]) if len(by) == 1 else None
+        possible = (granularity is not None and functions == set(["mean"]) and
+                    self.resource.split("/")[0] in OMS_GROUPING_RESOURCES and self._filter_in is None)
+
+        if pushdown and not possible:
+            self._warn("aggregate() - only mean grouped by {keys} can be computed by the server".format(
+                keys=", ".join(OMS_GROUP_GRANULARITY)), raise_exc=True)
+
+        if possible and pushdown is not False:
+            try:
+                return self._aggregate_server(by[0], granularity, aggregates, per_page, workers, page_retries)
+            except OMSApiException as ex:
+                if pushdown:
+                    raise
+                self._warn("aggregate() - server side grouping failed, computing locally: {ex}".format(ex=ex))
+
+        q = self.copy()
+        q._attrs = _unique(by + list(aggregates))
+        return group_aggregate(q.columns(per_page, workers, page_retries), by, aggregates)
+
+    def _aggregate_server(self, key, granularity, aggregates, per_page, workers, page_retries):
+        """ Means per run/fill computed by the server """
+
+        import numpy as np
+
+        q = self.copy()
+        q._attrs = _unique([key] + list(aggregates))
+        q.custom("group[granularity]", granularity)
+        columns = q.columns(per_page, workers, page_retries)
+
+        order = np.argsort(columns[key], kind="stable")
+        result = {key: columns[key][order]}
+        for attr in aggregates:
+            result[attr + "_mean"] = columns[attr][order]
+
+        return result
+
+    def _extreme_value(self, attribute, highest=True):
+        """ Current maximum (or minimum) of attribute in the result set, None if it is empty """
+
+        q = self.copy()
+        q._sort = []
+        q._no_cache = True
+        q.set_validation(False)
+        q.sort(attribute, asc=not highest).paginate(1, 1)
+        ret = q._fetch_measured(q.data_query())
+        if ret.status_code not in [200, 201]:
+            raise OMSApiException("Failed to fetch {which} value of {attr}: HTTP {code}".format(
+                which="highest" if highest else "lowest", attr=attribute, code=ret.status_code))
+
+        rows = ret.json().get("data") or []
+        return (rows[0].get("attributes") or {}).get(attribute) if rows else None
+
+    def follow(self, attribute, start=None, per_page=1000, min_interval=5, max_interval=120, idle_timeout=None, stop=None):
+        """ Follow a growing result set (e.g. lumisections of an ongoing run).
+            Remembers the highest value of attribute seen so far (high-water
+            mark) and polls only for rows beyond it (GT filter), in ascending
+            order. Poll interval follows the observed arrival rate of rows and
+            grows while nothing arrives.
+
+            Attribute must increase with each new row (e.g. lumisection_number,
+            run_number, start_time), rows sharing the high-water mark value
+            which arrive later are not returned.
+
+            Args:
+                attribute (str): attribute used as high-water mark
+                start: initial high-water mark. If None, only rows which
+                    appear after the call are returned
+                per_page (int): page size of poll requests
+                min_interval (float): shortest time between polls in seconds
+                max_interval (float): longest time between polls in seconds
+                idle_timeout (float): stop if no new row arrived for this many seconds
+                stop (threading.Event): stop when set
+
+            Yields:
+                dict: single JSON:API resource object of each new row
+
+            Examples:
+                q = omsapi.query("lumisections").filter("run_number", 355100)
+                for row in q.follow("lumisection_number", start=0, idle_timeout=600):
+                    print(row["attributes"]["lumisection_number"])
+        """
+
+        self._no_filter_in("follow")
+        mark = self._extreme_value(attribute) if start is None else start
+
+        # Polls must see new rows, not cached empty pages
+        q = self.copy()
+        q._no_cache = True
+        q.set_validation(False)
+        if q._attrs and attribute not in q._attrs:
+            q._attrs.append(attribute)
+        q._sort = []
+        q.sort(attribute).paginate(1, per_page)
+        base_filter = list(q._filter)
+
+        interval = min_interval
+        last_arrival = time.time()
+
+        while stop is None or not stop.is_set():
+            q._filter = list(base_filter)
+            if mark is not None:
+                q._filter.append("filter[{k}][GT]={v}".format(k=attribute, v=mark))
+
+            new_rows = 0
+            for row in q.iter_rows(per_page):
+                value = (row.get("attributes") or {}).get(attribute)
+                if value is not None:
+                    mark = value
+                new_rows += 1
+                yield row
+
+            now = time.time()
+            if new_rows:
+                # Expect next row after the average time between rows of the last period
+                interval = (now - last_arrival) / new_rows
+                last_arrival = now
+            else:
+                if idle_timeout is not None and now - last_arrival >= idle_timeout:
+                    return
+                interval *= 1.5
+            interval = min(max(interval, min_interval), max_interval)
+
+            if stop is not None:
+                stop.wait(interval)
+            else:
+                time.sleep(interval)
+
+    def _shard_boundaries(self, attribute, shards, page_retries):
+        """ Values of attribute splitting the result set into shards of similar size """
+
+        q = self.copy()
+        q._sort = []
+        q.set_validation(False)
+        q.sort(attribute)
+
+        def value_at(offset):
+            rows = q._fetch_page_retry(offset, 1, page_retries).get("data") or []
+            return (rows[0].get("attributes") or {}).get(attribute) if rows else None
+
+        first = q._fetch_page_retry(0, 1, page_retries)
+        rows = first.get("data") or []
+        if not rows:
+            return []
+        low = (rows[0].get("attributes") or {}).get(attribute)
+
+        try:
+            total = first["meta"]["totalResourceCount"]
+        except (KeyError, TypeError):
+            total = None
+
+        if total:
+            # Sample values at evenly spaced positions of the sorted result set
+            offsets = sorted(set(total * i // shards for i in range(1, shards)))
+            with ThreadPoolExecutor(max_workers=max(len(offsets), 1)) as executor:
+                values = list(executor.map(value_at, offsets))
+        else:
+            values = _split_range(low, self._extreme_value(attribute), shards)
+
+        return sorted(set(v for v in values if v is not None and v != low))
+
+    def shard(self, attribute, shards=4, page_retries=2):
+        """ Split the query into up to shards disjoint sub-queries over ranges
+            of a numeric or time attribute (GE/LT filters).
+
+            Boundaries are sampled at evenly spaced positions of the result set
+            sorted by attribute, so shards hold similar number of rows. If the
+            server does not report totalResourceCount, range between minimum
+            and maximum is split into equal parts.
+
+            Args:
+                attribute (str): attribute to split on
+                shards (int): maximum number of sub-queries
+                page_retries (int): retries of a failed planning request
+
+            Returns:
+                list: OMSQuery objects, in sort order of attribute
+                    (descending if the query sorts attribute descending)
+
+            Examples:
+                for shard in q.shard("run_number", 8):
+                    print(shard.data_query())
+        """
+
+        self._no_filter_in("shard")
+        boundaries = self._shard_boundaries(attribute, shards, page_retries)
+        edges = [None] + boundaries + [None]
+
+        descending = "-" + attribute in self._sort
+        sort = [("-" if descending else "") + attribute] + [s for s in self._sort if s.lstrip("-") != attribute]
+
+        queries = []
+        for low, high in zip(edges[:-1], edges[1:]):
+            q = self.copy()
+            q._sort = list(sort)
+            q.page = 1
+            if low is not None:
+                q._filter.append("filter[{k}][GE]={v}".format(k=attribute, v=low))
+            if high is not None:
+                q._filter.append("filter[{k}][LT]={v}".format(k=attribute, v=high))
+            queries.append(q)
+
+        if descending:
+            queries.reverse()
+        return queries
+
+    def iter_sharded(self, attribute, shards=4, per_page=None, page_retries=2, buffer_pages=4):
+        """ Iterate over all rows, fetching shards of the query (see shard())
+            concurrently. Rows are yielded in sort order of attribute: rows of
+            the current shard are yielded as its pages arrive, later shards
+            are fetched ahead until buffer_pages of their pages are waiting.
+            Keep shards below pool_maxsize of OMSAPI.
+
+            Args:
+                attribute (str): numeric or time attribute to split on
+                shards (int): number of shards fetched concurrently
+                per_page (int): page size (default is query page size)
+                page_retries (int): retries of a failed page before giving up
+                buffer_pages (int): pages of each shard kept in memory ahead of
+                    the current shard
+
+            Yields:
+                dict: single JSON:API resource object
+
+            Examples:
+                q = omsapi.query("lumisections").filter("run_number", 355000, "GE").filter("run_number", 356000, "LT")
+                for row in q.iter_sharded("run_number", shards=8, per_page=5000):
+                    print(row["id"])
+        """
+
+        queries = self.shard(attribute, shards, page_retries)
+        for page in _fetch_all(queries, per_page or self.per_page, page_retries, len(queries), buffer_pages):
+            for row in page.get("data") or []:
+                yield row
+
+    def filter_in(self, attribute, values, max_gap=1, workers=4):
+        """ Set-membership filter: attribute equal to any of values.
+
+            Requests are planned to be as few as possible: integers closer
+            than max_gap are fetched as one GE/LE range, other values with
+            EQ filter. Requests are executed concurrently and rows not
+            matching values (in gaps of a range) are dropped locally.
+            With this filter data() returns all matching rows (all pages)
+            in order of values, rows_by_value() groups them by value,
+            iter_pages(), iter_rows(), columns() and records() fetch through
+            the same requests. prepare(), shard(), iter_sharded() and
+            follow() raise ValueError. A query has at most one filter_in(),
+            calling it again raises OMSApiException.
+
+            Values are converted to the type of the attribute given by
+            metadata (e.g. "5" matches integer 5). Requests fetch pages of
+            at least 1000 rows, or of the query page size if it is larger.
+
+            Args:
+                attribute (str): name of attribute
+                values (list): accepted values
+                max_gap (int): integers whose difference is at most max_gap
+                    share one range request (1 - only contiguous values)
+                workers (int): number of requests executed concurrently
+
+            Examples:
+                q.filter("run_number", 355100).filter_in("bit", [5, 6, 7, 8, 100])
+                rates = q.rows_by_value()
+        """
+
+        if self._filter_in is not None:
+            self._warn("filter_in() - query already has a set-membership filter on [{attr}], "
+                       "only one filter_in() is supported".format(attr=self._filter_in[0]), raise_exc=True)
+
+        if self._attr_exists(attribute):
+            self._filter_in = (attribute, _unique(values), max_gap, workers)
+
+        return self
+
+    def _in_queries(self):
+        """ Sub-queries of filter_in(), one per planned value range """
+
+        attribute, _, max_gap, _ = self._filter_in
+
+        queries = []
+        for low, high in _plan_ranges(_unique(self._in_values()), max_gap):
+            q = self.copy()
+            q._filter_in = None
+            q.page = 1
+            if q._attrs and attribute not in q._attrs:
+                q._attrs.append(attribute)
+            if low == high:
+                q._filter.append("filter[{k}][EQ]={v}".format(k=attribute, v=low))
+            else:
+                q._filter.append("filter[{k}][GE]={v}".format(k=attribute, v=low))
+                q._filter.append("filter[{k}][LE]={v}".format(k=attribute, v=high))
+            queries.append(q)
+
+        return queries
+
+    def _in_values(self):
+        """ Values of filter_in() converted to the type of the attribute, in order of values """
+
+        attribute, values = self._filter_in[:2]
+        fields = self.metadata if self.attribute_validation else self._metadata
+        return [_coerce_value(value, (fields or {}).get(attribute)) for value in values]
+
+    def _in_accepted(self):
+        """ Attribute of filter_in() and comparison keys (_value_key()) of its values """
+
+        return self._filter_in[0], set(_value_key(value) for value in self._in_values())
+
+    def _iter_in_pages(self, per_page=None, page_retries=2):
+        """ Pages of all filter_in() sub-queries, holding only rows matching the values """
+
+        attribute, accepted = self._in_accepted()
+        per_page = per_page or max(self.per_page, _IN_PAGE_SIZE)
+
+        for page in _fetch_all(self._in_queries(), per_page, page_retries, self._filter_in[3]):
+            rows = [row for row in page.get("data") or []
+                    if _value_key((row.get("attributes") or {}).get(attribute)) in accepted]
+            yield {"data": rows, "links": {}, "meta": {}}
+
+    def _iter_in_rows(self, page_retries=2):
+        """ Rows of all filter_in() sub-queries matching the values """
+
+        for page in self._iter_in_pages(page_retries=page_retries):
+            for row in page["data"]:
+                yield row
+
+    def rows_by_value(self, page_retries=2):
+        """ Execute query with filter_in() and group rows by value
+
+            Returns:
+                OrderedDict: value -> list of rows, in order of filter_in() values
+                    (values without rows map to empty list)
+        """
+
+        if self._filter_in is None:
+            self._warn("rows_by_value() - set values by filter_in() first", raise_exc=True)
+
+        attribute, values = self._filter_in[:2]
+        grouped = OrderedDict((value, []) for value in values)
+        # Rows are grouped under the values as given, e.g. "5" for bit 5
+        given = {}
+        for value, converted in zip(values, self._in_values()):
+            given.setdefault(_value_key(converted), value)
+
+        for row in self._iter_in_rows(page_retries):
+            grouped[given[_value_key(row["attributes"][attribute])]].append(row)
+
+        return grouped
+
+
+class OMSPreparedQuery(object):
+    """ Query template with bound parameters, created by OMSQuery.prepare()
+
+        URL is split once into literal parts and parameter names,
+        executing the template only joins them with parameter values.
+        Prepared query does not change, it can be shared by threads.
+    """
+
+    def __init__(self, query):
+        query._no_filter_in("prepare")
+        self.query = query.copy()
+
+        # Page offset and limit are parameters as well
+        url = self.query._data_url(OMSParam("page_offset"), OMSParam("page_limit"))
+        parts = url.split(_PARAM_MARK)
+        self._literals = parts[0::2]
+        self._names = parts[1::2]
+        self.params = [name for name in _unique(self._names) if name not in ("page_offset", "page_limit")]
+
+    def url(self, page=None, per_page=None, **params):
+        """ Data URL with bound parameters
+
+            Args:
+                page (int): page number (default is page of the query)
+                per_page (int): page size (default is page size of the query)
+                params: values of OMSParam placeholders
+        """
+
+        per_page = per_page or self.query.per_page
+        return self._url(per_page * ((page or self.query.page) - 1), per_page, params)
+
+    def _url(self, page_offset, page_limit, params):
+        values = dict(params, page_limit=page_limit, page_offset=page_offset)
+
+        missing = [name for name in self.params if name not in values]
+        if missing:
+            raise OMSApiException("Missing query parameters: " + ", ".join(missing))
+
+        url = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            url.append(str(values[name]))
+            url.append(literal)
+        return "".join(url)
+
+    def data(self, page=None, per_page=None, **params):
+        """ Execute query with bound parameters
+
+            Returns:
+                requests.Response object
+        """
+
+        return self.query._fetch_measured(self.url(page, per_page, **params))
+
+    def iter_rows(self, per_page=None, **params):
+        """ Iterate over all rows of the result set with bound parameters """
+
+        per_page = per_page or self.query.per_page
+        page_offset = 0
+        while True:
+            ret = self.query._fetch_measured(self._url(page_offset, per_page, params))
+            if ret.status_code not in [200, 201]:
+                raise OMSApiException("Failed to fetch page at offset {offset}: HTTP {code}".format(
+                    offset=page_offset, code=ret.status_code))
+
+            content = ret.json()
+            rows = content.get("data") or []
+            for row in rows:
+                yield row
+
+            if self.query._is_last(len(rows), content.get("meta"), page_offset, per_page):
+                return
+            page_offset += len(rows)
+
+
+class OMSMetaQuery(_OMSRequestMixin):
+    """ OMS Meta Query object """
+
+    def __init__(self, base_url, verbose, cookies, oms_auth, cert_verify, retry_on_err_sec, proxies, session=None, response_cache=None,
+                 retry_policy=None, instrumentation=None):
+        self.attribute_validation = True
+        self.base_url = base_url
+        self.verbose = verbose
+        self.cookies = cookies
+        self.oms_auth = oms_auth
+        self.cert_verify = cert_verify
+        self.err_sec = retry_on_err_sec
+        self.proxies = proxies
+        self.session = session or create_session()
+        self.response_cache = response_cache
+        self.retry_policy = retry_policy or OMSRetryPolicy.from_retry_on_err_sec(retry_on_err_sec)
+        self.instrumentation = instrumentation
+
+    def data(self, path):
+        if path.startswith('/'):
+            url = self.base_url + path
+        else:
+            url = self.base_url + '/' + path
+
+        event = self._begin(url, "meta:" + path.strip("/").split("/")[0])
+        try:
+            ret = self.retry_policy.call(lambda timeout: self.get_request(url, verify=self.cert_verify, timeout=timeout))
+        except Exception as ex:
+            if event is not None:
+                self.instrumentation.end(event, error=ex)
+            raise
+        if event is not None:
+            self.instrumentation.end(event, ret)
+        if ret.status_code == 302:
+            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
+        return ret
+
+
+class OMSAPIOAuth(object):
+    """ OMS API token store and manager
+
+        Token is renewed in advance, refresh_margin seconds before it
+        expires (according to expires_in of the token response). Renewal is
+        done under a lock: concurrent callers wait for a single token request.
+        With credential_cache (OMSCredentialCache) tokens are shared with
+        other processes until they expire.
+    """
+
+    def __init__(self, client_id, client_secret, audience="cmsoms-prod", cert_verify=True, proxies={}, retry_on_err_sec=0, session=None,
+                 retry_policy=None, refresh_margin=60, credential_cache=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.audience = audience
+        self.cert_verify = cert_verify
+        self.proxies = proxies
+        self.token_json = None
+        self.token_time = None
+        self.token_expiry = None  # time.time() when token expires, None if unknown
+        # (token_headers, token_generation), replaced at once so that readers
+        # never see new headers with the generation of the previous token
+        self._token = (None, 0)
+        self.refresh_margin = refresh_margin
+        self.credential_cache = credential_cache
+        self.err_sec = retry_on_err_sec
+        self.session = session or create_session()
+        self.retry_policy = retry_policy or OMSRetryPolicy.from_retry_on_err_sec(retry_on_err_sec)
+        self._lock = threading.Lock()
+
+    def auth_oidc(self):
+        """ Authorisation Using CERN Open ID authentication wrappeer"""
+        with self._lock:
+            return self.auth_oidc_req()
+
+    def token_valid(self):
+        """ True if there is a token which is not about to expire """
+
+        if self.token_json is None:
+            return False
+        if self.token_expiry is None:
+            return True
+        # Never consider token stale for more than half of its lifetime
+        margin = min(self.refresh_margin, (self.token_expiry - self.token_time) / 2.)
+        return time.time() < self.token_expiry - margin
+
+    @property
+    def token_headers(self):
+        return self._token[0]
+
+    @property
+    def token_generation(self):
+        """ Incremented with each new token """
+        return self._token[1]
+
+    def get_token_headers(self):
+        """ Returns (token_headers, token_generation), renewing the token
+            first if it is about to expire
+        """
+
+        token = self._token
+        if not self.token_valid():
+            self.renew_token(token[1])
+            token = self._token
+        return token
+
+    def renew_token(self, generation=None):
+        """ Renew token unless it was already renewed since given generation
+            (e.g. by another thread which got HTTP 401 at the same time)
+        """
+
+        with self._lock:
+            if generation is not None and generation != self.token_generation:
+                return "OK"
+            return self.auth_oidc_req()
+
+    def _token_key(self):
+        return credential_key("oidc", cern_api_url, self.client_id, self.client_secret, self.audience)
+
+    def _stale_token(self):
+        """ Returns access token which must not be taken from credential cache
+            again, since it is being renewed
+        """
+
+        return self.token_json["access_token"] if self.token_json else None
+
+    def _set_token(self, token_json, token_time):
+        """ Install new token, called with self._lock held """
+
+        headers = {'Authorization':'Bearer ' + token_json["access_token"], 'content-type':'application/json'}
+        expires_in = token_json.get("expires_in")
+        self.token_json = token_json
+        self.token_time = token_time
+        self.token_expiry = token_time + expires_in if expires_in else None
+        self._token = (headers, self._token[1] + 1)
+
+    def auth_oidc_req(self):
+        """ Authorisation Using CERN Open ID authentication, token request
+            is retried according to retry_policy
+        """
+
+        current_time = time.time()
+        # Token which is about to expire is always renewed
+        if self.token_json and self.token_time and self.token_valid():
+            if current_time - self.token_time < 30:
+                print("Warning: token was requested less than 30 seconds ago. Will not renew this time.")
+                return "OK"
+                
+        self.token_time = current_time
+        token_req_data = {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'audience': self.audience
+        }
+
+        def request():
+            ret = self.retry_policy.call(lambda timeout: self.session.post(cern_api_url, data=token_req_data, verify=self.cert_verify,
+                                                                           proxies=self.proxies, timeout=timeout),
+                                         label="auth_oidc")
+            if ret.status_code!=200:
+                raise Exception("Unable to acquire OAuth token: " + ret.content.decode())
+            token_json = json.loads(ret.content)
+            expires_in = token_json.get("expires_in")
+            return token_json, current_time + expires_in if expires_in else None
+
+        if self.credential_cache is None:
+            token_json, _ = request()
+            self._set_token(token_json, current_time)
+            return "OK"
+
+        # Token of another process is reused, unless it is the one being renewed
+        stale = self._stale_token()
+        entry = self.credential_cache.get_or_create(self._token_key(), request, min_ttl=self.refresh_margin,
+                                                    reject=lambda token_json: token_json["access_token"] == stale)
+        self._set_token(entry["value"], entry["created"])
+        return "OK"
+
+
+class OMSBatchResult(object):
+    """ Result of one query executed by OMSAPI.batch() """
+
+    def __init__(self, index, query, response=None, error=None):
+        self.index = index  # position in the input list
+        self.query = query
+        self.response = response  # requests.Response, if request was made
+        self.error = error  # exception raised while executing the query
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def json(self):
+        """ Decoded response, raises the captured error if query failed """
+
+        if self.error is not None:
+            raise self.error
+        return self.response.json()
+
+
+def _apply_spec(q, spec):
+    """ Apply query_from_spec() dict to a new query object """
+
+    if spec.get("attrs"):
+        q.attrs(spec["attrs"])
+    q.filters(spec.get("filters", []))
+    for attribute in spec.get("sort", []):
+        q.sort(attribute.lstrip("-"), asc=not attribute.startswith("-"))
+    for key in spec.get("include", []):
+        q.include(key)
+    for key, value in spec.get("custom", {}).items():
+        q.custom(key, value)
+    q.paginate(spec.get("page", 1), spec.get("per_page", 10))
+
+    return q
+
+
+class _OMSAPIBase(object):
+    """ Settings, credentials and metadata cache shared by OMSAPI and
+        omsapi.aio.AsyncOMSAPI. Subclasses create queries and send requests.
+    """
+
+    def __init__(self, api_url, api_version, verbose, cert_verify, throw_on_err, retry_on_err_sec, proxies,
+                 pool_connections, pool_maxsize, meta_cache_ttl, meta_cache_dir, retry_policy, credential_cache):
+        self.api_url = api_url
+        self.api_version = api_version
+        self.verbose = verbose
+        self.cert_verify = cert_verify 
+        self.err_sec = retry_on_err_sec
+        self.proxies = proxies
+        self.throw_on_err = throw_on_err
+
+        self.base_url = "{api_url}/{api_version}".format(api_url=api_url,
+                                                         api_version=api_version)
+
+        index =  self.api_url.find('://')
+        if index >= 0:
+            tmp = self.api_url[index + 3 : ]
+            self.api_url_host = self.api_url[: index + 3] + tmp[: tmp.find('/')]
+        else:
+            self.api_url_host = self.api_url_host[: self.api_url_host.find('/')]
+        self.oms_auth = None
+        self.cookies = {}
+
+        # Connection pool of requests (kerberos login, queries of OMSAPI)
+        self.adapter = create_http_adapter(pool_connections, pool_maxsize)
+
+        # Resource metadata cache, shared by all clients of the process
+        self.meta_cache = get_meta_cache(meta_cache_ttl, meta_cache_dir)
+
+        # OMSRetryPolicy, if None derived from retry_on_err_sec
+        self.retry_policy = retry_policy
+
+        # Optional OMSCredentialCache, shares login cookies and tokens between processes
+        self.credential_cache = credential_cache
+
+    def _request_timeout(self):
+        """ Timeout of requests sent by the client itself (prewarm, kerberos login) """
+
+        return (self.retry_policy or OMSRetryPolicy()).request_timeout()
+
+    def invalidate_meta(self, resource=None):
+        """ Drop cached metadata of a resource (or all resources if None) """
+
+        self.meta_cache.invalidate(self.base_url, resource)
+
+    def _auth_krb(self, renew=False):
+        """ Blocking kerberos login, see OMSAPI.auth_krb() """
+
+        if self.credential_cache is None:
+            self.cookies, _ = self._krb_login()
+            return
+
+        key = credential_key("krb", self.api_url_host, os.environ.get("KRB5CCNAME", ""))
+        entry = self.credential_cache.get_or_create(key, self._krb_login, reject=lambda cookies: renew)
+        self.cookies = entry["value"]
+
+    def _krb_login(self):
+        """ Log in using kerberos, returns (session cookies, expiry time) """
+
+        import tsgauth
+        tsg_auth = tsgauth.oidcauth.KerbSessionAuth()
         #tsg auth is designed to be used with requests as get(url, **tsg_auth.authparams())
         #it also does a generic log into the CERN SSO and then exchanges that for a session cookie of the appropiate website
         #however this doesnt work for us here as we want to use the cookies directly and more importantly we have forbidden
         #redirects when making the request which means we cant exchange the SSO cookie for the session cookie for oms
         #so what we do is we make a dummy request to the oms website to get the session cookie and then we use that to make the request
 
+        # Separate cookie jar, but connections come from the shared pool
         session = requests.Session()
-        session.get(self.api_url_host,**tsg_auth.authparams(),verify=False)
-        self.cookies = {}
-        for c in session.cookies.get_dict():
-            if c.startswith('mod_auth_openidc_'):
-                self.cookies[c] = session.cookies[c]
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        session.get(self.api_url_host,**tsg_auth.authparams(),verify=False,timeout=self._request_timeout())
+        cookies = {}
+        expiry = []
+        for c in session.cookies:
+            if c.name.startswith('mod_auth_openidc_'):
+                cookies[c.name] = c.value
+                if c.expires:
+                    expiry.append(c.expires)
+
+        # Failed login is not cached
+        if not cookies:
+            return cookies, time.time()
+
+        # Session cookies without expiry date are trusted for credential_cache.krb_ttl
+        if not expiry and self.credential_cache is not None:
+            expiry.append(time.time() + self.credential_cache.krb_ttl)
+        return cookies, min(expiry) if expiry else None
+
+
+class OMSAPI(_OMSAPIBase):
+    """ Base OMS API client """
+
+    def __init__(self, api_url="https://cmsoms.cern.ch/agg/api", api_version="v1", verbose=True, cert_verify=True, throw_on_err=False, retry_on_err_sec=0, proxies={},
+                 pool_connections=4, pool_maxsize=10, keep_alive=True, prewarm=0, meta_cache_ttl=3600, meta_cache_dir=None,
+                 response_cache=None, result_store=None, retry_policy=None, credential_cache=None, coalesce=False,
+                 collect_stats=False, metrics=None):
+        super(OMSAPI, self).__init__(api_url, api_version, verbose, cert_verify, throw_on_err, retry_on_err_sec, proxies,
+                                     pool_connections, pool_maxsize, meta_cache_ttl, meta_cache_dir, retry_policy, credential_cache)
+
+        # Connection pool shared by all queries created by this client
+        self.session = create_session(self.adapter, keep_alive)
+
+        # Optional OMSResponseCache shared by all queries
+        self.response_cache = response_cache
+
+        # Optional persistent OMSResultStore (omsapi.store) for data queries
+        self.result_store = result_store
+
+        # Identical data requests issued concurrently by several threads share one HTTP call
+        # and one decoded JSON body (opt-in: callers must not modify it in place)
+        self.coalescer = OMSRequestCoalescer() if coalesce else None
+
+        # Request hooks and per-resource request statistics, requests are
+        # only measured if hooks are registered or collect_stats is set
+        self.instrumentation = OMSInstrumentation(collect_stats)
+
+        # Optional omsapi.metrics.OMSMetrics registry (Prometheus), fed by request events
+        self.metrics = metrics
+        if metrics is not None:
+            self.instrumentation.add_hook(metrics.observe)
+
+        if prewarm:
+            self.prewarm(prewarm)
+
+    def prewarm(self, connections=1):
+        """ Open connections to the API host in advance, so that first
+            queries do not pay for TCP and TLS handshakes
+
+            Args:
+                connections (int): number of connections to open (up to pool_maxsize)
+        """
+
+        def _open():
+            try:
+                self.session.head(self.api_url_host, verify=self.cert_verify, proxies=self.proxies, allow_redirects=False,
+                                  timeout=self._request_timeout())
+            except (ConnectionError, Timeout) as ex:
+                if self.verbose:
+                    print("Warning: failed to prewarm connection: " + str(ex))
+
+        threads = [threading.Thread(target=_open) for _ in range(connections)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def close(self):
+        """ Close all pooled connections """
+
+        self.session.close()
+
+    def query(self, resource, query_validation=True):
+        """ Create query object """
+
+        q = OMSQuery(self.base_url, resource=resource, verbose=self.verbose,
+                     cookies=self.cookies, oms_auth=self.oms_auth, cert_verify=self.cert_verify, throw_on_err=self.throw_on_err, retry_on_err_sec=self.err_sec, proxies=self.proxies,
+                     session=self.session, meta_cache=self.meta_cache, response_cache=self.response_cache,
+                     result_store=self.result_store, retry_policy=self.retry_policy, coalescer=self.coalescer,
+                     instrumentation=self.instrumentation)
+
+        if not query_validation:
+            q.set_validation(False)
+
+        return q
+
+    def add_request_hook(self, func):
+        """ Call func(event) after every request of queries of this client
+
+            Args:
+                func (callable): receives omsapi.instrument.OMSRequestEvent with URL
+                    template, status, size, attempts, cache outcome and phase timings
+
+            Examples:
+                omsapi.add_request_hook(lambda e: print(e.template, e.status, e.ttfb, e.download, e.decode))
+        """
+
+        self.instrumentation.add_hook(func)
+
+    def remove_request_hook(self, func):
+        self.instrumentation.remove_hook(func)
+
+    def request_stats(self, reset=False):
+        """ Request statistics per resource, collected if the client was
+            created with collect_stats=True
+
+            Args:
+                reset (bool): start counting from zero afterwards
+
+            Returns:
+                dict: resource -> counters and summed phase timings, see OMSInstrumentation.summary()
+
+            Examples:
+                for resource, s in omsapi.request_stats().items():
+                    print(resource, s["requests"], s["bytes"], s["mean_seconds"], s["ttfb"], s["decode"])
+        """
+
+        if not self.instrumentation.collect_stats:
+            print("Warning: request statistics are not collected, create OMSAPI with collect_stats=True")
+        summary = self.instrumentation.summary()
+        if reset:
+            self.instrumentation.reset()
+        return summary
+
+    def preload_meta(self, resources=None):
+        """ Fetch metadata of resources into the meta cache
+
+            Args:
+                resources (list): resource names. If None, metadata of all
+                    resources already known to the cache is refreshed
+
+            Examples:
+                omsapi.preload_meta(["runs", "fills", "lumisections"])
+        """
+
+        if resources is None:
+            resources = [r for _, r in self.meta_cache.resources(self.base_url, include_disk=True)]
+
+        threads = [threading.Thread(target=self.query(r)._load_meta, kwargs={"force": True})
+                   for r in resources]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def query_from_spec(self, spec):
+        """ Create query object from a dict
+
+            Args:
+                spec (dict): "resource" (required), optional "attrs" (list),
+                    "filters" (list of dicts as in .filters()), "sort" (list of
+                    attribute names, "-" prefix for descending order), "include"
+                    (list), "custom" (dict), "page", "per_page", "validation"
+
+            Examples:
+                omsapi.query_from_spec({"resource": "bunches",
+                                        "filters": [{"attribute_name": "fill_number", "value": 7000, "operator": "EQ"}],
+                                        "per_page": 10000})
+        """
+
+        return _apply_spec(self.query(spec["resource"], query_validation=spec.get("validation", True)), spec)
+
+    def batch(self, queries, max_workers=8, ordered=True):
+        """ Execute many independent queries concurrently over the shared
+            connection pool. Errors are captured per query and do not abort
+            the batch (HTTP status other than 200/201 is an error too).
+
+            Args:
+                queries (list): OMSQuery objects or dicts for query_from_spec()
+                max_workers (int): maximum number of queries running at once
+                ordered (bool): return list in input order, or generator
+                    yielding results as they complete
+
+            Returns:
+                list (or generator) of OMSBatchResult
+
+            Examples:
+                results = omsapi.batch([omsapi.query("bunches").filter("fill_number", f) for f in fills])
+                for r in results:
+                    if r.ok:
+                        print(r.json()["data"])
+        """
+
+        def run(index, q):
+            try:
+                if isinstance(q, dict):
+                    q = self.query_from_spec(q)
+                response = q.data()
+            except Exception as ex:
+                return OMSBatchResult(index, q, error=ex)
+
+            if response.status_code not in [200, 201]:
+                return OMSBatchResult(index, q, response, OMSApiException(
+                    "HTTP {code} for {url}".format(code=response.status_code, url=response.url)))
+            return OMSBatchResult(index, q, response)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(run, index, q) for index, q in enumerate(queries)]
+        executor.shutdown(wait=False)
+
+        if ordered:
+            return [f.result() for f in futures]
+        return (f.result() for f in as_completed(futures))
+
+    def query_metadata(self, query_validation=True):
+        """ Create query object for metadata"""
+
+        q = OMSMetaQuery(self.api_url, verbose=self.verbose,
+                     cookies=self.cookies, oms_auth=self.oms_auth, cert_verify=self.cert_verify, retry_on_err_sec=self.err_sec, proxies=self.proxies,
+                     session=self.session, response_cache=self.response_cache, retry_policy=self.retry_policy,
+                     instrumentation=self.instrumentation)
+
+        return q
+
+    def auth_oidc(self, client_id, client_secret, audience="cmsoms-prod", proxies={}, refresh_margin=60):
+        """ Authorisation Using CERN Open ID authentication. Token is renewed
+            refresh_margin seconds before it expires.
+        """
+
+        if not self.oms_auth:
+            self.oms_auth = OMSAPIOAuth(client_id, client_secret, audience, self.cert_verify, proxies=proxies, retry_on_err_sec=self.err_sec,
+                                        session=self.session, retry_policy=self.retry_policy, refresh_margin=refresh_margin,
+                                        credential_cache=self.credential_cache)
+        self.oms_auth.auth_oidc()
+
+    def auth_krb(self, renew=False):
+        """ Authorisation for https using kerberos, also supports 2FA.
+            With credential_cache, session cookies of a previous login (of any
+            process) are reused until they expire, renew=True forces a new login.
+        """
 
+        self._auth_krb(renew)
@@ -0,0 +1,524 @@
+""" CMS OMS Aggregation API asyncio client
+
+    Same builder API as OMSAPI/OMSQuery, but requests are executed with
+    aiohttp on the running event loop. Requires aiohttp package.
+"""
+
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from . import (_OMSAPIBase, _OMSQueryBuilder, _apply_spec, OMSMetaQuery, OMSAPIOAuth, OMSApiException, OMSBatchResult,
+               make_response, cern_api_url)
+
+
+_RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+async def _retry(policy, func, label="request"):
+    """ Await func(timeout) until it succeeds or OMSRetryPolicy has no attempts
+        left, see OMSRetryPolicy.call()
+    """
+
+    started = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = await func(_client_timeout(policy.request_timeout(started)))
+        except _RETRY_EXCEPTIONS as ex:
+            delay = policy.next_delay(attempt, started)
+            if delay is None:
+                raise
+            print("Warning: will retry {label} in {delay:.2f} seconds after connection error: {ex}".format(
+                label=label, delay=delay, ex=ex))
+            await asyncio.sleep(delay)
+            continue
+
+        if policy.is_retryable(response):
+            delay = policy.next_delay(attempt, started, response)
+            if delay is not None:
+                print("Warning: will retry {label} in {delay:.2f} seconds after HTTP {code}".format(
+                    label=label, delay=delay, code=response.status_code))
+                await asyncio.sleep(delay)
+                continue
+
+        return response
+
+
+def _client_timeout(timeout):
+    """ aiohttp.ClientTimeout for OMSRetryPolicy.request_timeout() """
+
+    if timeout is None:
+        return aiohttp.ClientTimeout(total=None)
+    connect, read = timeout
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+
+def _proxy_for(proxies, url):
+    """ Select proxy from requests-style proxies dict for aiohttp """
+
+    proxy = (proxies or {}).get(url.split("://")[0])
+    if proxy and "://" not in proxy:
+        proxy = "http://" + proxy
+    return proxy
+
+
+class _AsyncOMSRequestMixin(object):
+    """ Async HTTP GET shared by async query objects. Expects session,
+        oms_auth, cookies and proxies attributes.
+    """
+
+    async def _get(self, url, verify, headers, timeout=None):
+        async with self.session.get(url, ssl=None if verify else False, headers=headers, timeout=timeout,
+                                    proxy=_proxy_for(self.proxies, url), allow_redirects=False) as resp:
+            content = await resp.read()
+            return make_response(url, resp.status, content, resp.headers)
+
+    async def get_request(self, url, verify=False, timeout=None):
+        if self.oms_auth:
+            # Token is renewed in advance if it is about to expire
+            token_headers, generation = await self.oms_auth.get_token_headers()
+            response = await self._get(url, verify, token_headers, timeout)
+            #check if token has expired (Unauthorized)
+            if response.status_code == 401:
+                print("Unauthorized. Will try to obtain a new token")
+                await self.oms_auth.renew_token(generation)
+                token_headers, _ = await self.oms_auth.get_token_headers()
+                return await self._get(url, verify, token_headers, timeout)
+            return response
+        else:
+            headers = {}
+            if self.cookies:
+                headers["Cookie"] = "; ".join("{k}={v}".format(k=k, v=v) for k, v in self.cookies.items())
+            return await self._get(url, verify, headers, timeout)
+
+
+class AsyncOMSQuery(_AsyncOMSRequestMixin, _OMSQueryBuilder):
+    """ OMS Query object with awaitable data(), async iter_pages() and iter_rows()
+
+        Builder methods are those of OMSQuery. Helpers built on top of
+        blocking requests (columns(), records(), aggregate(), follow(),
+        shard(), filter_in(), prepare(), ...) are available in OMSAPI only.
+
+        Metadata is never fetched implicitly. AsyncOMSAPI.query() loads it
+        before returning the query, or call load_meta() yourself.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._meta_locks = kwargs.pop("meta_locks", {})
+        super(AsyncOMSQuery, self).__init__(*args, **kwargs)
+
+    def _sibling(self, resource):
+        """ Create query for another resource with the same settings """
+
+        return AsyncOMSQuery(self.base_url, resource, verbose=self.verbose, cookies=self.cookies, oms_auth=self.oms_auth,
+                             cert_verify=self.cert_verify, throw_on_err=self.throw_on_err, retry_on_err_sec=self.err_sec,
+                             proxies=self.proxies, session=self.session, meta_cache=self.meta_cache,
+                             retry_policy=self.retry_policy, meta_locks=self._meta_locks)
+
+    def _load_meta(self, force=False):
+        """ Take metadata from the meta cache only, without network access """
+
+        self.metadata = self.meta_cache.get(self.base_url, self.resource.split("/")[0])
+
+    async def load_meta(self, force=False):
+        """ Load meta information about resource without fetching data
+
+            Args:
+                force (bool): bypass meta cache and fetch again
+        """
+
+        resourceBase = self.resource.split("/")[0]
+
+        if force:
+            self.meta_cache.invalidate(self.base_url, resourceBase)
+
+        fields = self.meta_cache.get(self.base_url, resourceBase)
+        if fields is None:
+            lock = self._meta_locks.setdefault((self.base_url, resourceBase), asyncio.Lock())
+            async with lock:
+                # Another task may have loaded it meanwhile
+                fields = self.meta_cache.get(self.base_url, resourceBase)
+                if fields is None:
+                    fields = await self._fetch_meta(resourceBase)
+                    if fields is not None:
+                        self.meta_cache.put(self.base_url, resourceBase, fields)
+
+        self.metadata = fields
+
+    async def _fetch_meta(self, resourceBase):
+        url = "{base_url}/{resource}/meta".format(base_url=self.base_url,
+                                                  resource=resourceBase)
+
+        response = await _retry(self.retry_policy, lambda timeout: self.get_request(url, verify=self.cert_verify, timeout=timeout))
+
+        if response.status_code == 302:
+            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
+        elif response.status_code != 200:
+            self._warn("Failed to fetch meta information")
+        else:
+            try:
+                return response.json()["meta"]["fields"]
+            except (ValueError, KeyError, TypeError):
+                self._warn("Meta information is incorrect")
+        return None
+
+    async def data(self):
+        """ Execute query and retrieve data
+
+            Returns:
+                requests.Response object
+        """
+
+        return await self._fetch(self.data_query())
+
+    async def _fetch(self, url):
+        """ Execute request for data URL, retrying according to retry_policy """
+
+        if self.verbose:
+            print(url)
+        ret = await _retry(self.retry_policy, lambda timeout: self.get_request(url, verify=self.cert_verify, timeout=timeout))
+
+        if ret.status_code == 302:
+            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
+
+        if self.throw_on_err and ret.status_code not in [200, 201]:
+            raise Exception("HTTP Error", ret)
+
+        return ret
+
+    async def _fetch_page(self, page_offset, page_limit):
+        ret = await self._fetch(self._data_url(page_offset, page_limit))
+
+        if ret.status_code not in [200, 201]:
+            raise OMSApiException("Failed to fetch page at offset {offset}: HTTP {code}".format(
+                offset=page_offset, code=ret.status_code))
+
+        return ret.json()
+
+    async def _fetch_page_retry(self, page_offset, page_limit, page_retries):
+        attempt = 0
+        while True:
+            try:
+                return await self._fetch_page(page_offset, page_limit)
+            except (OMSApiException, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as ex:
+                attempt += 1
+                if attempt > page_retries:
+                    raise OMSApiException("Page at offset {offset} failed after {n} attempts: {ex}".format(
+                        offset=page_offset, n=attempt, ex=ex))
+                self._warn("page at offset {offset} failed, retrying: {ex}".format(offset=page_offset, ex=ex))
+                await asyncio.sleep(self.retry_policy.backoff_delay(attempt))
+
+    async def iter_pages(self, per_page=None, workers=1, page_retries=2):
+        """ Async generator over all pages of a result set, see OMSQuery.iter_pages()
+
+            Examples:
+                async for page in q.iter_pages(per_page=1000, workers=8):
+                    print(len(page["data"]))
+        """
+
+        per_page = per_page or self.per_page
+        page_offset = per_page * (self.page - 1)
+
+        first = await self._fetch_page_retry(page_offset, per_page, page_retries)
+        yield first
+        if self._is_last_page(first, page_offset, per_page):
+            return
+        # Server caps page size, request pages of the size it returned
+        per_page = min(per_page, len(first.get("data") or []))
+
+        try:
+            end_offset = first["meta"]["totalResourceCount"]
+        except (KeyError, TypeError):
+            end_offset = None
+
+        pending = []  # (offset, task) in page order
+        next_offset = page_offset + per_page
+
+        try:
+            while True:
+                while len(pending) < max(workers, 1) and (end_offset is None or next_offset < end_offset):
+                    pending.append((next_offset, asyncio.ensure_future(
+                        self._fetch_page_retry(next_offset, per_page, page_retries))))
+                    next_offset += per_page
+
+                if not pending:
+                    return
+
+                offset, task = pending.pop(0)
+                page = await task
+                yield page
+
+                if self._is_last_page(page, offset, per_page):
+                    return
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def iter_rows(self, per_page=None, workers=1, page_retries=2):
+        """ Async generator over all rows of a result set, see OMSQuery.iter_rows()
+
+            Examples:
+                async for row in q.iter_rows(per_page=1000):
+                    print(row["attributes"]["run_number"])
+        """
+
+        async for page in self.iter_pages(per_page, workers, page_retries):
+            for row in page.get("data") or []:
+                yield row
+
+
+class AsyncOMSMetaQuery(_AsyncOMSRequestMixin, OMSMetaQuery):
+    """ OMS Meta Query object with awaitable data() """
+
+    async def data(self, path):
+        if path.startswith('/'):
+            url = self.base_url + path
+        else:
+            url = self.base_url + '/' + path
+        ret = await _retry(self.retry_policy, lambda timeout: self.get_request(url, verify=self.cert_verify, timeout=timeout))
+        if ret.status_code == 302:
+            raise Exception("Received redirect (HTTP 302). Try to switch between http/https protocol")
+        return ret
+
+
+class AsyncOMSAPIOAuth(OMSAPIOAuth):
+    """ OMS API token store and manager with awaitable token renewal,
+        see OMSAPIOAuth
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncOMSAPIOAuth, self).__init__(*args, **kwargs)
+        self._async_lock = None
+
+    def _get_lock(self):
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        return self._async_lock
+
+    async def auth_oidc(self):
+        """ Authorisation Using CERN Open ID authentication wrappeer"""
+
+        async with self._get_lock():
+            return await self.auth_oidc_req()
+
+    async def get_token_headers(self):
+        token = self._token
+        if not self.token_valid():
+            await self.renew_token(token[1])
+            token = self._token
+        return token
+
+    async def renew_token(self, generation=None):
+        # Concurrent 401s wait for a single renewal
+        async with self._get_lock():
+            if generation is not None and generation != self.token_generation:
+                return "OK"
+            return await self.auth_oidc_req()
+
+    async def auth_oidc_req(self):
+        """ Authorisation Using CERN Open ID authentication """
+
+        current_time = time.time()
+        # Token which is about to expire is always renewed
+        if self.token_json and self.token_time and self.token_valid():
+            if current_time - self.token_time < 30:
+                print("Warning: token was requested less than 30 seconds ago. Will not renew this time.")
+                return "OK"
+
+        self.token_time = current_time
+        token_req_data = {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'audience': self.audience
+        }
+
+        async def post(timeout):
+            async with self.session.post(cern_api_url, data=token_req_data, ssl=None if self.cert_verify else False, timeout=timeout,
+                                         proxy=_proxy_for(self.proxies, cern_api_url)) as resp:
+                return make_response(cern_api_url, resp.status, await resp.read(), resp.headers)
+
+        async def request():
+            ret = await _retry(self.retry_policy, post, label="auth_oidc")
+            if ret.status_code != 200:
+                raise Exception("Unable to acquire OAuth token: " + ret.content.decode())
+            token_json = json.loads(ret.content)
+            expires_in = token_json.get("expires_in")
+            return token_json, current_time + expires_in if expires_in else None
+
+        if self.credential_cache is None:
+            token_json, _ = await request()
+            self._set_token(token_json, current_time)
+            return "OK"
+
+        # Token of another process is reused, unless it is the one being renewed.
+        # The credential file stays locked during the login, so it is held by a
+        # worker thread which waits for the token request made on this loop.
+        loop = asyncio.get_running_loop()
+        stale = self._stale_token()
+
+        def create():
+            return asyncio.run_coroutine_threadsafe(request(), loop).result()
+
+        entry = await loop.run_in_executor(
+            None, lambda: self.credential_cache.get_or_create(self._token_key(), create, min_ttl=self.refresh_margin,
+                                                              reject=lambda token_json: token_json["access_token"] == stale))
+        self._set_token(entry["value"], entry["created"])
+        return "OK"
+
+
+class AsyncOMSAPI(_OMSAPIBase):
+    """ asyncio OMS API client
+
+        Must be used from a running event loop. The aiohttp session
+        (connection pool) is created on first use.
+
+        Examples:
+            async with AsyncOMSAPI("https://cmsoms.cern.ch/agg/api", "v1") as omsapi:
+                await omsapi.auth_oidc(my_app_id, my_app_secret)
+                q = await omsapi.query("runs")
+                resp = await q.attrs(["run_number"]).paginate(1, 100).data()
+    """
+
+    def __init__(self, api_url="https://cmsoms.cern.ch/agg/api", api_version="v1", verbose=True, cert_verify=True, throw_on_err=False, retry_on_err_sec=0, proxies={},
+                 pool_maxsize=10, keep_alive=True, meta_cache_ttl=3600, meta_cache_dir=None, retry_policy=None, credential_cache=None):
+        # requests connection pool is used by auth_krb() only
+        super(AsyncOMSAPI, self).__init__(api_url, api_version, verbose, cert_verify, throw_on_err, retry_on_err_sec, proxies,
+                                          1, 1, meta_cache_ttl, meta_cache_dir, retry_policy, credential_cache)
+
+        self.session = None
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self._meta_locks = {}
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_maxsize, force_close=not self.keep_alive)
+            # Do not store cookies set by responses, see create_session()
+            self.session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+        return self.session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """ Close all pooled connections """
+
+        if self.session is not None:
+            await self.session.close()
+        self.adapter.close()
+
+    async def prewarm(self, connections=1):
+        """ Open connections to the API host in advance """
+
+        session = self._get_session()
+
+        async def _open():
+            try:
+                async with session.head(self.api_url_host, ssl=None if self.cert_verify else False,
+                                        timeout=_client_timeout(self._request_timeout()),
+                                        proxy=_proxy_for(self.proxies, self.api_url_host), allow_redirects=False):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                if self.verbose:
+                    print("Warning: failed to prewarm connection: " + str(ex))
+
+        await asyncio.gather(*[_open() for _ in range(connections)])
+
+    async def query(self, resource, query_validation=True):
+        """ Create query object, loading resource metadata if validation is enabled """
+
+        q = AsyncOMSQuery(self.base_url, resource=resource, verbose=self.verbose,
+                          cookies=self.cookies, oms_auth=self.oms_auth, cert_verify=self.cert_verify, throw_on_err=self.throw_on_err, retry_on_err_sec=self.err_sec, proxies=self.proxies,
+                          session=self._get_session(), meta_cache=self.meta_cache, meta_locks=self._meta_locks,
+                          retry_policy=self.retry_policy)
+
+        if query_validation:
+            await q.load_meta()
+        else:
+            q.set_validation(False)
+
+        return q
+
+    async def preload_meta(self, resources=None):
+        """ Fetch metadata of resources into the meta cache, see OMSAPI.preload_meta() """
+
+        if resources is None:
+            resources = [r for _, r in self.meta_cache.resources(self.base_url, include_disk=True)]
+
+        queries = [await self.query(r, query_validation=False) for r in resources]
+        await asyncio.gather(*[q.load_meta(force=True) for q in queries])
+
+    async def query_from_spec(self, spec):
+        """ Create query object from a dict, see OMSAPI.query_from_spec() """
+
+        return _apply_spec(await self.query(spec["resource"], query_validation=spec.get("validation", True)), spec)
+
+    async def batch(self, queries, max_workers=8, ordered=True):
+        """ Execute many independent queries concurrently, see OMSAPI.batch()
+
+            Returns:
+                list of OMSBatchResult, in input order or (ordered=False) in
+                order of completion
+
+            Examples:
+                results = await omsapi.batch([{"resource": "bunches", "filters": [...]}, ...])
+        """
+
+        semaphore = asyncio.Semaphore(max_workers)
+        completed = []
+
+        async def run(index, q):
+            async with semaphore:
+                try:
+                    if isinstance(q, dict):
+                        q = await self.query_from_spec(q)
+                    response = await q.data()
+                except Exception as ex:
+                    result = OMSBatchResult(index, q, error=ex)
+                else:
+                    if response.status_code not in [200, 201]:
+                        result = OMSBatchResult(index, q, response, OMSApiException(
+                            "HTTP {code} for {url}".format(code=response.status_code, url=response.url)))
+                    else:
+                        result = OMSBatchResult(index, q, response)
+            completed.append(result)
+            return result
+
+        results = await asyncio.gather(*[run(index, q) for index, q in enumerate(queries)])
+        return results if ordered else completed
+
+    def query_metadata(self, query_validation=True):
+        """ Create query object for metadata"""
+
+        q = AsyncOMSMetaQuery(self.api_url, verbose=self.verbose,
+                              cookies=self.cookies, oms_auth=self.oms_auth, cert_verify=self.cert_verify, retry_on_err_sec=self.err_sec, proxies=self.proxies,
+                              session=self._get_session(), retry_policy=self.retry_policy)
+
+        return q
+
+    async def auth_oidc(self, client_id, client_secret, audience="cmsoms-prod", proxies={}, refresh_margin=60):
+        """ Authorisation Using CERN Open ID authentication. Token is renewed
+            refresh_margin seconds before it expires.
+        """
+
+        if not self.oms_auth:
+            self.oms_auth = AsyncOMSAPIOAuth(client_id, client_secret, audience, self.cert_verify, proxies=proxies, retry_on_err_sec=self.err_sec,
+                                             session=self._get_session(), retry_policy=self.retry_policy, refresh_margin=refresh_margin,
+                                             credential_cache=self.credential_cache)
+        await self.oms_auth.auth_oidc()
+
+    async def auth_krb(self, renew=False):
+        """ Authorisation for https using kerberos, see OMSAPI.auth_krb().
+            Login runs in a worker thread, it is done once per client.
+        """
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._auth_krb, renew)
@@ -0,0 +1,154 @@
+""" In-memory response cache for OMS API client
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _CacheEntry(object):
+    """ Cached response of a single URL """
+
+    __slots__ = ("url", "status_code", "content", "headers", "resource", "stored", "expires")
+
+    def __init__(self, url, status_code, content, headers, resource, ttl):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.resource = resource
+        self.stored = time.time()
+        self.expires = self.stored + ttl
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    def fresh(self):
+        return time.time() < self.expires
+
+    def validators(self):
+        """ Conditional request headers for revalidation """
+
+        headers = {}
+        if self.headers.get("ETag"):
+            headers["If-None-Match"] = self.headers["ETag"]
+        if self.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+
+class OMSResponseCache(object):
+    """ Size-bounded LRU cache of successful (HTTP 200) GET responses
+
+        Entries are keyed by canonical URL and auth identity. They are
+        served without a request for ttl seconds (per resource ttl can be
+        set by resource_ttl). Expired entries which have ETag or
+        Last-Modified are revalidated with a conditional request.
+
+        Args:
+            max_entries (int): maximum number of cached responses
+            max_bytes (int): maximum total size of cached bodies
+            ttl (float): default time to live in seconds
+            resource_ttl (dict): resource name -> time to live in seconds
+
+        Examples:
+            cache = OMSResponseCache(max_bytes=200 * 2**20, ttl=30, resource_ttl={"eras": 3600})
+            omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1", response_cache=cache)
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=100 * 2**20, ttl=60, resource_ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.resource_ttl = resource_ttl or {}
+
+        self._entries = OrderedDict()  # key -> _CacheEntry, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def canonical_url(url):
+        """ URL with query parameters in sorted order """
+
+        base, sep, query = url.partition("?")
+        if not sep:
+            return url
+        return base + "?" + "&".join(sorted(query.split("&")))
+
+    def key(self, url, identity=""):
+        return (self.canonical_url(url), identity)
+
+    def ttl_for(self, resource):
+        return self.resource_ttl.get(resource, self.ttl)
+
+    def lookup(self, key):
+        """ Returns cached entry (fresh or expired) or None.
+            Fresh entries are counted as hits, others as misses.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if entry.fresh():
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def store(self, key, url, status_code, content, headers, resource=None):
+        """ Store response body, evicting least recently used entries """
+
+        entry = _CacheEntry(url, status_code, content, dict(headers), resource, self.ttl_for(resource))
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+
+            self._entries[key] = entry
+            self._bytes += entry.size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def revalidated(self, key):
+        """ Server confirmed (HTTP 304) that cached entry is still valid """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.stored = time.time()
+                entry.expires = entry.stored + self.ttl_for(entry.resource)
+            self.revalidations += 1
+
+    def invalidate(self, resource=None):
+        """ Drop cached entries of a resource (or all entries if None) """
+
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if resource in (None, e.resource)]:
+                self._bytes -= self._entries.pop(key).size
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        """ Returns dict with cache counters and current size """
+
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses,
+                    "revalidations": self.revalidations, "evictions": self.evictions}
@@ -0,0 +1,324 @@
+""" omsapi command: export a resource to CSV, JSON Lines or Parquet
+
+    Pages are fetched concurrently and written as they arrive, so memory
+    use does not grow with the size of the export.
+
+    Examples:
+        omsapi lumisections -a run_number,lumisection_number,delivered_lumi \\
+            -f run_number GE 355100 -f run_number LE 355200 --sort=-run_number -s lumisection_number \\
+            -o lumis.parquet --per-page 10000 --workers 8
+        omsapi runs -f fill_number EQ 8000 --format jsonl
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+from . import OMSAPI, OMSApiException, OMS_FILTER_OPERATORS
+from .credentials import OMSCredentialCache
+
+FORMATS = ["csv", "jsonl", "parquet"]
+
+
+def _format_of(path):
+    extension = os.path.splitext(path or "")[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl",
+            ".parquet": "parquet", ".pq": "parquet"}.get(extension, "csv")
+
+
+def _text(value):
+    """ Value of a CSV cell """
+
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class _CSVWriter(object):
+
+    def __init__(self, out, columns):
+        self.out = out
+        self.writer = csv.writer(out)
+        self.writer.writerow(columns)
+        self.columns = columns
+
+    def write(self, rows):
+        columns = self.columns
+        for row in rows:
+            attributes = row.get("attributes") or {}
+            self.writer.writerow([_text(attributes.get(c)) for c in columns])
+        self.out.flush()
+
+    def close(self):
+        pass
+
+
+class _JSONLinesWriter(object):
+
+    def __init__(self, out, columns):
+        self.out = out
+
+    def write(self, rows):
+        self.out.write("".join(json.dumps(row.get("attributes") or {}) + "\n" for row in rows))
+        self.out.flush()
+
+    def close(self):
+        pass
+
+
+class _ParquetWriter(object):
+    """ One row group per page. Column types come from resource metadata
+        (or the first page), see omsapi.columnar.field_kind()
+    """
+
+    def __init__(self, path, columns, fields, first_rows):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise OMSApiException("Parquet output requires pyarrow (pip install pyarrow)")
+        from .columnar import field_kind
+
+        types = {"int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(), "datetime": pa.timestamp("ms", tz="UTC")}
+        self.kinds = []
+        schema = []
+        for column in columns:
+            sample = next((r["attributes"][column] for r in first_rows
+                           if (r.get("attributes") or {}).get(column) is not None), None)
+            kind = field_kind((fields or {}).get(column), sample)
+            self.kinds.append(kind)
+            schema.append(pa.field(column, types.get(kind, pa.string())))
+
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema(schema)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        import numpy as np
+        from .columnar import build_column
+
+        pa = self.pa
+        arrays = []
+        for column, kind, field in zip(self.columns, self.kinds, self.schema):
+            values = [(row.get("attributes") or {}).get(column) for row in rows]
+            if kind in ("int", "float", "bool", "datetime"):
+                data = build_column(values, kind)
+                mask = None
+                if isinstance(data, np.ma.MaskedArray):
+                    data, mask = data.data, data.mask
+                if data.dtype == object:
+                    # build_column() falls back to objects, the schema of the file is fixed
+                    raise self._mismatch(column, kind, values)
+                try:
+                    if kind == "datetime":
+                        # pyarrow does not take datetime64 together with a mask
+                        arrays.append(pa.array(data.view("int64"), type=pa.int64(), mask=mask).cast(field.type))
+                    else:
+                        arrays.append(pa.array(data, type=field.type, mask=mask))
+                except (pa.ArrowInvalid, pa.ArrowTypeError) as ex:
+                    raise self._mismatch(column, kind, values, ex)
+            else:
+                arrays.append(pa.array([v if v is None or isinstance(v, str) else json.dumps(v) if isinstance(v, (dict, list))
+                                        else str(v) for v in values], type=field.type))
+
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    @staticmethod
+    def _mismatch(column, kind, values, error=None):
+        from .columnar import build_column
+
+        value = next((v for v in values if v is not None and build_column([v], kind).dtype == object), None)
+        detail = "value {v!r}".format(v=value) if value is not None else str(error)
+        return OMSApiException("Column {c} of type {kind} (from metadata or the first page) cannot be written to parquet: {d}".format(
+            c=column, kind=kind, d=detail))
+
+    def close(self):
+        self.writer.close()
+
+
+class _Progress(object):
+    """ Rows, throughput and ETA on stderr, updated at most twice a second """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.rows = 0
+        self.pages = 0
+        self.bytes = 0
+        self.total = None
+        self.start = time.time()
+        self._shown = 0
+        self._lock = threading.Lock()
+
+    def add_bytes(self, event):
+        with self._lock:
+            self.bytes += event.network_bytes
+
+    def update(self, rows):
+        self.rows += rows
+        self.pages += 1
+        self.show()
+
+    def show(self, final=False):
+        now = time.time()
+        if not self.enabled or (not final and now - self._shown < 0.5):
+            return
+        self._shown = now
+
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.rows / elapsed
+        line = "{rows} rows, {pages} pages, {rate:.0f} rows/s, {mb:.1f} MB/s".format(
+            rows=self.rows, pages=self.pages, rate=rate, mb=self.bytes / elapsed / 1e6)
+        if self.total:
+            line += ", {pct:.1f}%".format(pct=100.0 * self.rows / self.total)
+            if not final and rate > 0:
+                line += ", ETA {eta:.0f}s".format(eta=(self.total - self.rows) / rate)
+        sys.stderr.write("\r" + line + "   ")
+        if final:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="omsapi", description='export OMS API resource to CSV, JSON Lines or Parquet')
+    parser.add_argument('resource', help='resource name, e.g. runs, lumisections')
+    parser.add_argument('-a', '--attrs', help='comma separated attributes (default: all)')
+    parser.add_argument('-f', '--filter', nargs=3, action='append', default=[], metavar=('ATTRIBUTE', 'OPERATOR', 'VALUE'),
+                        help='filter, operators: ' + ", ".join(OMS_FILTER_OPERATORS) + '. Can be repeated')
+    parser.add_argument('-s', '--sort', action='append', default=[], metavar='ATTRIBUTE',
+                        help='sort attribute, "-" prefix for descending order (--sort=-run_number). Can be repeated')
+    parser.add_argument('-o', '--output', help='output file (default: standard output)')
+    parser.add_argument('--format', choices=FORMATS, help='output format (default: from output file extension, csv)')
+    parser.add_argument('--per-page', type=int, default=1000, help='page size of requests')
+    parser.add_argument('--workers', type=int, default=4, help='pages fetched concurrently')
+    parser.add_argument('--page-retries', type=int, default=2, help='retries of a failed page')
+    parser.add_argument('--no-progress', action='store_true', help='do not show progress on stderr')
+    parser.add_argument('--no-validation', action='store_true', help='do not check attribute names against metadata')
+    parser.add_argument('--api-url', default='https://cmsoms.cern.ch/agg/api', help='OMS API URL')
+    parser.add_argument('--api-version', default='v1', help='OMS API version')
+    parser.add_argument('--auth', choices=['krb', 'oidc', 'none'], default='krb',
+                        help='authentication (oidc reads OMS_CLIENT_ID and OMS_CLIENT_SECRET)')
+    parser.add_argument('--audience', default='cmsoms-prod', help='OpenID audience')
+    parser.add_argument('--credential-cache', action='store_true', help='reuse login of earlier runs (see OMSCredentialCache)')
+    parser.add_argument('--insecure', action='store_true', help='do not verify server certificate')
+    return parser
+
+
+def _client(args):
+    omsapi = OMSAPI(args.api_url, args.api_version, verbose=False, cert_verify=not args.insecure,
+                    pool_maxsize=max(10, args.workers + 2),
+                    credential_cache=OMSCredentialCache() if args.credential_cache else None)
+    if args.auth == "krb":
+        omsapi.auth_krb()
+    elif args.auth == "oidc":
+        client_id, client_secret = os.environ.get("OMS_CLIENT_ID"), os.environ.get("OMS_CLIENT_SECRET")
+        if not client_id or not client_secret:
+            raise OMSApiException("--auth oidc requires OMS_CLIENT_ID and OMS_CLIENT_SECRET environment variables")
+        omsapi.auth_oidc(client_id, client_secret, audience=args.audience)
+    return omsapi
+
+
+def _query(omsapi, args):
+    q = omsapi.query(args.resource, query_validation=not args.no_validation)
+    q.set_verbose(False)
+    attributes = [a.strip() for a in (args.attrs or "").split(",") if a.strip()]
+    attributes += [attribute for attribute, _, _ in args.filter] + [a.lstrip("-") for a in args.sort]
+    if q.attribute_validation and q.metadata:
+        unknown = [a for a in attributes if a not in q.metadata]
+        if unknown:
+            raise OMSApiException("Unknown attributes of {r}: {a} (--no-validation to skip check)".format(
+                r=args.resource, a=", ".join(unknown)))
+
+    if args.attrs:
+        q.attrs([a.strip() for a in args.attrs.split(",") if a.strip()])
+    for attribute, operator, value in args.filter:
+        if operator.upper() not in OMS_FILTER_OPERATORS:
+            raise OMSApiException("Unknown filter operator {op}, use one of {ops}".format(
+                op=operator, ops=", ".join(OMS_FILTER_OPERATORS)))
+        q.filter(attribute, value, operator.upper())
+    for attribute in args.sort:
+        q.sort(attribute.lstrip("-"), asc=not attribute.startswith("-"))
+    return q
+
+
+def export(q, out, fmt, per_page=1000, workers=4, page_retries=2, progress=None):
+    """ Write all rows of a query to out (file object, or path for parquet)
+
+        Returns:
+            int: number of rows written
+    """
+
+    fields = q.metadata if q.attribute_validation else q._metadata
+    progress = progress or _Progress(False)
+    writer = None
+    rows_written = 0
+
+    try:
+        for page in q.iter_pages(per_page, workers=workers, page_retries=page_retries):
+            rows = page.get("data") or []
+            if writer is None:
+                try:
+                    progress.total = page["meta"]["totalResourceCount"]
+                except (KeyError, TypeError):
+                    pass
+                columns = q._attrs or (list(fields) if fields else list((rows[0].get("attributes") or {}) if rows else []))
+                if fmt == "parquet":
+                    writer = _ParquetWriter(out, columns, fields, rows)
+                elif fmt == "jsonl":
+                    writer = _JSONLinesWriter(out, columns)
+                else:
+                    writer = _CSVWriter(out, columns)
+
+            if rows:
+                writer.write(rows)
+            rows_written += len(rows)
+            progress.update(len(rows))
+    finally:
+        if writer is not None:
+            writer.close()
+        progress.show(final=True)
+
+    return rows_written
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    fmt = args.format or _format_of(args.output)
+    if fmt == "parquet" and not args.output:
+        sys.stderr.write("omsapi: parquet output requires --output\n")
+        return 2
+
+    try:
+        omsapi = _client(args)
+        q = _query(omsapi, args)
+
+        progress = _Progress(not args.no_progress)
+        omsapi.add_request_hook(progress.add_bytes)
+
+        if fmt == "parquet":
+            export(q, args.output, fmt, args.per_page, args.workers, args.page_retries, progress)
+        elif args.output:
+            with open(args.output, "w", newline="") as out:
+                export(q, out, fmt, args.per_page, args.workers, args.page_retries, progress)
+        else:
+            export(q, sys.stdout, fmt, args.per_page, args.workers, args.page_retries, progress)
+    except OMSApiException as ex:
+        sys.stderr.write("omsapi: {ex}\n".format(ex=ex))
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # e.g. piped into head
+        sys.stderr.close()
+        return 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+""" Coalescing of identical concurrent requests (single-flight)
+"""
+
+import threading
+
+
+class _Call(object):
+    """ Request in flight """
+
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class OMSRequestCoalescer(object):
+    """ Executes concurrent calls with the same key only once
+
+        The first caller executes the request, callers arriving while it is
+        in flight wait and receive the same result (or exception). Nothing
+        is kept after the request completes, later calls execute again.
+
+        Examples:
+            coalescer = OMSRequestCoalescer()
+            response = coalescer.do(url, lambda: session.get(url))
+            print(coalescer.stats())
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> _Call
+
+        self.requests = 0  # all calls of do()
+        self.executed = 0  # calls which were executed
+        self.coalesced = 0  # calls which waited for another one (saved requests)
+
+    def do(self, key, func, share=None):
+        """ Returns func() result, shared with concurrent calls of the same key
+
+            Args:
+                key: hashable request identity (e.g. canonical URL and auth identity)
+                func (callable): executes the request
+                share (callable): result -> result, applied once if the result is
+                    handed to waiting callers (e.g. to make it safe to share)
+        """
+
+        with self._lock:
+            self.requests += 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            try:
+                with self._lock:
+                    del self._in_flight[key]
+                    waiters = call.waiters
+                if waiters and share is not None and call.error is None:
+                    result = call.result
+                    try:
+                        call.result = share(result)
+                    except BaseException as ex:
+                        # Waiters get the error, this caller its own result
+                        call.error = ex
+                        call.result = result
+            finally:
+                call.done.set()
+
+        return call.result
+
+    def stats(self):
+        """ Returns dict with request counters and number of requests in flight """
+
+        with self._lock:
+            return {"requests": self.requests, "executed": self.executed,
+                    "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
@@ -0,0 +1,286 @@
+""" Columnar materialization of OMS API results
+
+    Builds one typed numpy array per attribute instead of a list of
+    JSON:API row dicts. Nulls are masked (numpy.ma.MaskedArray), timestamps
+    are converted to datetime64[ms] (UTC). Requires numpy, pandas is needed
+    for to_dataframe() only.
+"""
+
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+
+_ISO_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}")
+_TZ_OFFSET = re.compile(r"[+-]\d{2}:?\d{2}$")
+
+
+def field_kind(field_meta, sample=None):
+    """ Guess kind of an attribute from its meta field description,
+        falling back to the python type of a sample value
+
+        Returns:
+            str: one of "int", "float", "bool", "datetime", "str", "object"
+    """
+
+    type_name = ""
+    if isinstance(field_meta, dict):
+        type_name = str(field_meta.get("type") or field_meta.get("data_type") or "").upper()
+
+    if type_name:
+        if "BOOL" in type_name:
+            return "bool"
+        if "DATE" in type_name or "TIME" in type_name:
+            return "datetime"
+        if "INT" in type_name or type_name in ("LONG", "SHORT"):
+            return "int"
+        if any(t in type_name for t in ("DOUBLE", "FLOAT", "DECIMAL", "NUMBER", "NUMERIC", "REAL")):
+            return "float"
+        if any(t in type_name for t in ("STRING", "CHAR", "TEXT")):
+            return "str"
+
+    if isinstance(sample, bool):
+        return "bool"
+    if isinstance(sample, int):
+        return "int"
+    if isinstance(sample, float):
+        return "float"
+    if isinstance(sample, str):
+        return "datetime" if _ISO_TIMESTAMP.match(sample) else "str"
+
+    return "object"
+
+
+def _utc_naive(value):
+    """ ISO timestamp string to naive UTC string accepted by numpy """
+
+    if value.endswith("Z"):
+        return value[:-1]
+
+    match = _TZ_OFFSET.search(value)
+    if match:
+        value = value[:match.start()] + match.group(0).replace(":", "")
+        for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S.%f%z"):
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            return parsed.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+
+    return value
+
+
+def build_column(values, kind):
+    """ Convert list of python values to numpy array of given kind.
+        Returns masked array if there are nulls.
+    """
+
+    mask = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+
+    if kind == "int" and any(isinstance(v, float) for v in values):
+        kind = "float"
+
+    try:
+        if kind == "int":
+            data = np.array([0 if v is None else v for v in values], dtype=np.int64)
+        elif kind == "float":
+            data = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        elif kind == "bool":
+            data = np.array([False if v is None else v for v in values], dtype=bool)
+        elif kind == "datetime":
+            data = np.array(["NaT" if v is None else _utc_naive(v) for v in values], dtype="datetime64[ms]")
+        else:
+            data = np.array(values, dtype=object)
+    except (ValueError, TypeError, OverflowError):
+        # Values do not match the declared type
+        data = np.array(values, dtype=object)
+
+    if mask.any():
+        return np.ma.MaskedArray(data, mask=mask)
+    return data
+
+
+def page_columns(rows, attributes, fields=None):
+    """ Build columns of one page
+
+        Args:
+            rows (list): JSON:API resource objects ("data" of a response)
+            attributes (list): attribute names
+            fields (dict): meta fields of the resource (OMSQuery.meta())
+
+        Returns:
+            dict: attribute name -> numpy array
+    """
+
+    columns = {}
+    for attr in attributes:
+        values = [(row.get("attributes") or {}).get(attr) for row in rows]
+        sample = next((v for v in values if v is not None), None)
+        columns[attr] = build_column(values, field_kind((fields or {}).get(attr), sample))
+
+    return columns
+
+
+def concat_columns(pages, attributes):
+    """ Concatenate columns of several pages
+
+        Args:
+            pages (list): list of dicts returned by page_columns()
+            attributes (list): attribute names
+
+        Returns:
+            dict: attribute name -> numpy array
+    """
+
+    columns = {}
+    for attr in attributes:
+        parts = [p[attr] for p in pages if attr in p]
+        if not parts:
+            columns[attr] = np.array([], dtype=object)
+        elif len(parts) == 1:
+            columns[attr] = parts[0]
+        elif any(isinstance(p, np.ma.MaskedArray) for p in parts):
+            columns[attr] = np.ma.concatenate(parts)
+        else:
+            columns[attr] = np.concatenate(parts)
+
+    return columns
+
+
+def to_dataframe(columns):
+    """ pandas DataFrame view of columns. Masked integer and boolean
+        columns use pandas nullable dtypes, other nulls become NaN/NaT/None.
+    """
+
+    import pandas as pd
+
+    data = {}
+    for attr, column in columns.items():
+        if isinstance(column, np.ma.MaskedArray):
+            mask = np.ma.getmaskarray(column)
+            values = column.data
+            if values.dtype.kind in "iu":
+                data[attr] = pd.arrays.IntegerArray(values, mask)
+            elif values.dtype.kind == "b":
+                data[attr] = pd.arrays.BooleanArray(values, mask)
+            elif values.dtype.kind == "f":
+                data[attr] = np.where(mask, np.nan, values)
+            else:
+                # datetime64 columns already hold NaT, object columns None
+                data[attr] = values
+        else:
+            data[attr] = column
+
+    return pd.DataFrame(data, columns=list(columns))
+
+
+AGGREGATES = ("count", "sum", "mean", "min", "max")
+
+
+def _group_codes(columns, by):
+    """ Group index of each row and columns of group keys. Rows with null
+        key get index -1.
+    """
+
+    size = len(columns[by[0]]) if by else 0
+    valid = np.ones(size, dtype=bool)
+    codes = np.zeros(size, dtype=np.int64)
+    key_uniques = []
+
+    for attr in by:
+        column = columns[attr]
+        if isinstance(column, np.ma.MaskedArray):
+            valid &= ~np.ma.getmaskarray(column)
+            column = column.data
+        uniques, inverse = np.unique(column[valid], return_inverse=True)
+        full = np.zeros(size, dtype=np.int64)
+        full[valid] = inverse
+        codes = codes * len(uniques) + full
+        key_uniques.append(uniques)
+
+    groups, group_of_row = np.unique(codes[valid], return_inverse=True)
+    index = np.full(size, -1, dtype=np.int64)
+    index[valid] = group_of_row
+
+    # Decode group numbers back to key values
+    keys = {}
+    remainder = groups
+    for attr, uniques in reversed(list(zip(by, key_uniques))):
+        keys[attr] = uniques[remainder % len(uniques)] if len(uniques) else uniques
+        remainder = remainder // max(len(uniques), 1)
+
+    return index, len(groups), dict((attr, keys[attr]) for attr in by)
+
+
+def group_aggregate(columns, by, aggregates):
+    """ Group-by aggregation of columns
+
+        Args:
+            columns (dict): attribute name -> numpy array (see page_columns())
+            by (list): attributes to group by, rows with null key are skipped
+            aggregates (dict): attribute -> list of functions (AGGREGATES).
+                Null values are ignored, groups without values are masked.
+
+        Returns:
+            dict: group keys and one column "{attribute}_{function}"
+                per aggregate, sorted by keys
+
+        Examples:
+            group_aggregate(cols, ["bit"], {"pre_dt_rate": ["max", "mean"]})
+    """
+
+    index, ngroups, result = _group_codes(columns, by)
+    rows = index >= 0
+
+    for attr, functions in aggregates.items():
+        column = columns[attr]
+        valid = rows.copy()
+        if isinstance(column, np.ma.MaskedArray):
+            valid &= ~np.ma.getmaskarray(column)
+            column = column.data
+
+        datetime_kind = column.dtype.kind == "M"
+        # Integers and timestamps keep their type in sum, min and max
+        integer_kind = datetime_kind or column.dtype.kind in "iu"
+        if datetime_kind:
+            values = column.view(np.int64)[valid]
+        elif integer_kind:
+            values = column[valid].astype(np.int64)
+        elif column.dtype.kind in "fb":
+            values = column[valid].astype(np.float64)
+        else:
+            raise ValueError("Cannot aggregate non-numeric attribute " + attr)
+
+        groups = index[valid]
+        count = np.bincount(groups, minlength=ngroups)
+        empty = count == 0
+
+        for function in functions:
+            if function not in AGGREGATES:
+                raise ValueError("Unknown aggregate function " + function)
+            if datetime_kind and function in ("sum", "mean"):
+                raise ValueError("Cannot compute {f} of timestamps ({a})".format(f=function, a=attr))
+
+            if function == "count":
+                result[attr + "_count"] = count
+                continue
+            if function == "sum":
+                out = np.bincount(groups, weights=values, minlength=ngroups)
+                if integer_kind:
+                    out = out.astype(np.int64)
+            elif function == "mean":
+                out = np.bincount(groups, weights=values, minlength=ngroups) / np.maximum(count, 1)
+            elif function == "max":
+                out = np.full(ngroups, np.iinfo(np.int64).min if integer_kind else -np.inf, dtype=values.dtype)
+                np.maximum.at(out, groups, values)
+            else:
+                out = np.full(ngroups, np.iinfo(np.int64).max if integer_kind else np.inf, dtype=values.dtype)
+                np.minimum.at(out, groups, values)
+
+            if datetime_kind and function in ("min", "max"):
+                out = out.view(column.dtype)
+            if empty.any():
+                out = np.ma.MaskedArray(out, mask=empty)
+            result["{a}_{f}".format(a=attr, f=function)] = out
+
+    return result
@@ -0,0 +1,161 @@
+""" Persistent per-user cache of OMS API credentials
+
+    Kerberos session cookies (mod_auth_openidc_*) and OpenID bearer tokens
+    are kept in a JSON file readable by the owner only, so that short
+    processes can reuse them until they expire instead of logging in again.
+    Access is serialized by an exclusive lock on a separate lock file: when
+    several processes start at once, only one of them logs in.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, only threads are serialized
+    fcntl = None
+
+
+def default_credential_path():
+    """ ~/.cache/omsapi/credentials.json (or under $XDG_CACHE_HOME) """
+
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "omsapi", "credentials.json")
+
+
+def credential_key(kind, *parts):
+    """ Cache key of a credential, e.g. credential_key("oidc", client_id, audience).
+        Parts are hashed, so that the file does not reveal them.
+    """
+
+    digest = hashlib.sha256("\0".join(str(p) for p in parts).encode()).hexdigest()[:32]
+    return "{kind}:{digest}".format(kind=kind, digest=digest)
+
+
+class OMSCredentialCache(object):
+    """ File-based cache of credentials shared by processes of one user
+
+        Args:
+            path (str): credentials file (default default_credential_path()).
+                Directory is created with mode 0700, file with mode 0600.
+            krb_ttl (float): lifetime in seconds of Kerberos session cookies
+                which do not carry an expiry date
+
+        Examples:
+            omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1", credential_cache=OMSCredentialCache())
+            omsapi.auth_krb()
+    """
+
+    def __init__(self, path=None, krb_ttl=600):
+        self.path = path or default_credential_path()
+        self.krb_ttl = krb_ttl
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """ Exclusive lock of the credentials file, across threads and processes """
+
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        now = time.time()
+        return dict((k, e) for k, e in entries.items() if e.get("expires") is None or e["expires"] > now)
+
+    def _write(self, entries):
+        # Write to a private temporary file and swap it in, readers never see partial content
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".credentials.")
+        try:
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _usable(entry, min_ttl):
+        return entry is not None and (entry.get("expires") is None or entry["expires"] - min_ttl > time.time())
+
+    def get(self, key, min_ttl=0):
+        """ Returns cached entry {"value", "created", "expires"} which is valid
+            for at least min_ttl seconds, or None
+        """
+
+        with self._locked():
+            entry = self._read().get(key)
+        return entry if self._usable(entry, min_ttl) else None
+
+    def put(self, key, value, expires=None, created=None):
+        """ Store credential valid until expires (time.time() based, None = no expiry) """
+
+        entry = {"value": value, "created": created or time.time(), "expires": expires}
+        with self._locked():
+            entries = self._read()
+            entries[key] = entry
+            self._write(entries)
+        return entry
+
+    def get_or_create(self, key, create, min_ttl=0, reject=None):
+        """ Returns cached entry or creates a new one. Lock is held while
+            creating, so that concurrent processes wait for a single login.
+
+            Args:
+                key (str): credential key, see credential_key()
+                create (callable): returns (value, expires) of a new credential
+                min_ttl (float): cached entry must be valid for at least this many seconds
+                reject (callable): value -> bool, True if cached value must not
+                    be used (e.g. server already refused it)
+
+            Returns:
+                dict: entry {"value", "created", "expires"}
+        """
+
+        with self._locked():
+            entries = self._read()
+            entry = entries.get(key)
+            if self._usable(entry, min_ttl) and not (reject and reject(entry["value"])):
+                return entry
+
+            created = time.time()
+            value, expires = create()
+            entry = {"value": value, "created": created, "expires": expires}
+            entries[key] = entry
+            self._write(entries)
+        return entry
+
+    def invalidate(self, key=None):
+        """ Remove a credential (all credentials if key is None) """
+
+        with self._locked():
+            entries = self._read()
+            if key is None:
+                entries = {}
+            else:
+                entries.pop(key, None)
+            self._write(entries)
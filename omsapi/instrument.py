@@ -0,0 +1,332 @@
+""" Per-request instrumentation of OMS API calls
+
+    Every request made while instrumentation is active produces an
+    OMSRequestEvent with phase timings, size, status, retries and cache
+    outcome. Events are passed to registered hooks and summed up per
+    resource. Connection setup (TCP connect, TLS handshake) is timed by the
+    urllib3 connection classes installed by OMSTimedAdapter.
+"""
+
+import re
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.poolmanager import ProxyManager
+
+_local = threading.local()  # stack of events of requests running in this thread
+
+_NUMBER_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+# Event attributes summed up per resource
+_SUMMED = ("seconds", "connect", "tls", "ttfb", "download", "decode")
+
+
+def current_event():
+    """ Event of the request running in this thread, None if not instrumented """
+
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def url_template(url):
+    """ URL with values of filters, page offsets and numeric path segments
+        replaced by {}, so that requests of the same query shape compare equal
+
+        Examples:
+            url_template(".../v1/runs?filter[run_number][EQ]=355100&page[offset]=0&page[limit]=10")
+            # ".../v1/runs?filter[run_number][EQ]={}&page[offset]={}&page[limit]=10"
+    """
+
+    path, _, query = url.partition("?")
+    path = _NUMBER_SEGMENT.sub("/{}", path)
+    if not query:
+        return path
+
+    params = []
+    for param in query.split("&"):
+        key, sep, value = param.partition("=")
+        if key.startswith("filter[") or key == "page[offset]":
+            value = "{}"
+        params.append(key + sep + value)
+    return path + "?" + "&".join(params)
+
+
+class OMSRequestEvent(object):
+    """ Measurements of one logical request (including its retries)
+
+        Attributes:
+            url (str): request URL
+            template (str): url_template() of the URL
+            resource (str): resource name ("runs", "lumisections/meta", ...)
+            status (int): HTTP status of the last attempt, None if there was no response
+            bytes (int): response body size (also of responses served from a
+                cache or shared with a concurrent request, see network_bytes)
+            attempts (int): HTTP requests sent (0 if served from a cache or
+                shared with a concurrent identical request)
+            token_renewals (int): tokens renewed after HTTP 401
+            cache (str): None, "hit", "revalidated" (HTTP 304), "miss",
+                "store" (result store hit) or "coalesced"
+            error (Exception): exception raised by the request, if any
+            seconds (float): wall time of the request including retries and decoding
+            connect (float): DNS lookup and TCP connect of new connections
+            tls (float): TLS handshakes of new connections
+            ttfb (float): from sending the request until response headers arrived
+            download (float): reading the response body (stream mode: until
+                the response is closed, including row parsing)
+            decode (float): JSON decoding of pages decoded by the client
+                (iter_pages(), iter_rows(), columns(), ...). None for data(),
+                whose response is decoded by the caller
+    """
+
+    __slots__ = ("url", "template", "resource", "status", "bytes", "attempts", "token_renewals", "cache", "error",
+                 "started", "seconds", "connect", "tls", "ttfb", "download", "decode", "_start")
+
+    def __init__(self, url, resource):
+        self.url = url
+        self.template = url_template(url)
+        self.resource = resource
+        self.status = None
+        self.bytes = None
+        self.attempts = 0
+        self.token_renewals = 0
+        self.cache = None
+        self.error = None
+        self.started = time.time()
+        self.seconds = None
+        self.connect = 0.0
+        self.tls = 0.0
+        self.ttfb = 0.0
+        self.download = 0.0
+        self.decode = None
+        self._start = time.perf_counter()
+
+    def timed_get(self, get, stream=False):
+        """ Execute get() (one HTTP attempt) and record its timings """
+
+        setup = self.connect + self.tls
+        start = time.perf_counter()
+        self.attempts += 1
+        response = get()
+        seconds = time.perf_counter() - start
+
+        # elapsed covers connection setup, sending and waiting for headers
+        elapsed = response.elapsed.total_seconds()
+        self.status = response.status_code
+        self.ttfb += max(0.0, elapsed - (self.connect + self.tls - setup))
+        if not stream:
+            self.download += max(0.0, seconds - elapsed)
+            self.bytes = len(response.content)
+        return response
+
+    @property
+    def network_bytes(self):
+        """ Response body bytes received over the network: 0 for cache hits,
+            304 revalidations and responses shared with a concurrent request
+        """
+
+        if not self.attempts or self.cache == "revalidated":
+            return 0
+        return self.bytes or 0
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__ if not name.startswith("_"))
+
+    def __repr__(self):
+        return "<OMSRequestEvent {resource} {status} {seconds}s {url}>".format(
+            resource=self.resource, status=self.status, seconds=self.seconds, url=self.url)
+
+
+class OMSInstrumentation(object):
+    """ Request hooks and per-resource request statistics
+
+        Instrumentation is active if hooks are registered or collect_stats is
+        set, otherwise requests are not measured at all.
+
+        Args:
+            collect_stats (bool): sum up events per resource (see summary())
+
+        Examples:
+            omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1", collect_stats=True)
+            omsapi.add_request_hook(lambda e: print(e.template, e.status, e.seconds))
+            ...
+            print(omsapi.request_stats())
+    """
+
+    def __init__(self, collect_stats=False):
+        self.collect_stats = collect_stats
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._stats = {}  # resource -> dict of counters
+
+    @property
+    def active(self):
+        return self.collect_stats or bool(self._hooks)
+
+    def add_hook(self, func):
+        """ Call func(event) after every request """
+
+        with self._lock:
+            self._hooks = self._hooks + [func]
+
+    def remove_hook(self, func):
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not func]
+
+    def begin(self, url, resource):
+        """ Start measuring a request made by this thread, returns
+            OMSRequestEvent or None if instrumentation is not active
+        """
+
+        if not self.active:
+            return None
+
+        event = OMSRequestEvent(url, resource)
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(event)
+        return event
+
+    def detach(self, event):
+        """ Remove event from the requests running in this thread, while it
+            is still measured (e.g. body of a stream response read by a
+            generator, other requests made meanwhile are not its part)
+        """
+
+        stack = getattr(_local, "stack", None)
+        if stack and event in stack:
+            stack.remove(event)
+
+    def end(self, event, response=None, error=None):
+        """ Finish the request, update statistics and call hooks """
+
+        event.seconds = time.perf_counter() - event._start
+        if response is not None:
+            event.status = response.status_code
+            if event.bytes is None and isinstance(response._content, bytes):  # not for stream responses
+                event.bytes = len(response._content)
+        if error is not None:
+            event.error = error
+
+        self.detach(event)
+
+        if self.collect_stats:
+            self._count(event)
+
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception as ex:
+                print("Warning: request hook {hook} failed: {ex}".format(hook=hook, ex=ex))
+
+    def _count(self, event):
+        with self._lock:
+            stats = self._stats.get(event.resource)
+            if stats is None:
+                stats = self._stats[event.resource] = dict(
+                    requests=0, errors=0, bytes=0, attempts=0, retries=0, token_renewals=0, cache_hits=0,
+                    coalesced=0, max_seconds=0.0, decoded=0, **dict((name, 0.0) for name in _SUMMED))
+
+            stats["requests"] += 1
+            if event.error is not None or event.status is None or event.status >= 400:
+                stats["errors"] += 1
+            stats["bytes"] += event.network_bytes
+            stats["attempts"] += event.attempts
+            stats["retries"] += max(0, event.attempts - 1 - event.token_renewals)
+            stats["token_renewals"] += event.token_renewals
+            if event.cache in ("hit", "revalidated", "store"):
+                stats["cache_hits"] += 1
+            elif event.cache == "coalesced":
+                stats["coalesced"] += 1
+            if event.decode is not None:
+                stats["decoded"] += 1
+            for name in _SUMMED:
+                stats[name] += getattr(event, name) or 0.0
+            stats["max_seconds"] = max(stats["max_seconds"], event.seconds)
+
+    def summary(self):
+        """ Statistics per resource
+
+            Returns:
+                dict: resource -> {"requests", "errors", "bytes" (received over
+                    the network, see OMSRequestEvent.network_bytes), "attempts", "retries",
+                    "token_renewals", "cache_hits", "coalesced", "max_seconds",
+                    "mean_seconds", and summed phase timings "seconds", "connect",
+                    "tls", "ttfb", "download", "decode"}
+        """
+
+        with self._lock:
+            summary = {}
+            for resource, stats in self._stats.items():
+                stats = dict(stats)
+                stats["mean_seconds"] = stats["seconds"] / stats["requests"]
+                del stats["decoded"]
+                summary[resource] = stats
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+class _TimedConnectionMixin(object):
+    """ Adds time of new connections to the event of the current request """
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super(_TimedConnectionMixin, self)._new_conn()
+        finally:
+            event = current_event()
+            if event is not None:
+                event.connect += time.perf_counter() - start
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        event = current_event()
+        if event is None:
+            return super(_TimedHTTPSConnection, self).connect()
+
+        # connect() opens the socket (_new_conn(), counted as connect) and does the handshake
+        connect = event.connect
+        start = time.perf_counter()
+        try:
+            return super(_TimedHTTPSConnection, self).connect()
+        finally:
+            event.tls += max(0.0, time.perf_counter() - start - (event.connect - connect))
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+_TIMED_POOLS = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+class OMSTimedAdapter(HTTPAdapter):
+    """ HTTPAdapter whose connections report connect and TLS handshake time
+        to the request being measured. Costs nothing if no request is measured.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(OMSTimedAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _TIMED_POOLS
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super(OMSTimedAdapter, self).proxy_manager_for(proxy, **proxy_kwargs)
+        if type(manager) is ProxyManager:  # SOCKS proxies use their own connection classes
+            manager.pool_classes_by_scheme = _TIMED_POOLS
+        return manager
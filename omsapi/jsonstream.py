@@ -0,0 +1,123 @@
+""" Incremental parsing of JSON:API documents
+
+    Rows of the top-level "data" array are decoded one by one while the
+    response body is still being downloaded, so only one row (plus one
+    chunk) is held in memory at a time.
+"""
+
+import codecs
+import json
+
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader(object):
+    """ Text buffer over an iterator of byte chunks """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """ Append next chunk to the buffer, dropping consumed text
+
+            Returns:
+                bool: False if there is no more data
+        """
+
+        if self.eof:
+            return False
+
+        text = ""
+        while not text:
+            try:
+                text = self.utf8.decode(next(self.chunks))
+            except StopIteration:
+                text = self.utf8.decode(b"", final=True)
+                self.eof = True
+                break
+
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return bool(text)
+
+    def peek(self):
+        """ Returns next non-whitespace character without consuming it """
+
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected '{char}' at position {pos}".format(char=char, pos=self.pos))
+        self.pos += 1
+
+    def value(self):
+        """ Decode next complete JSON value """
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_array_items(chunks, key="data", members=None):
+    """ Iterate over items of an array member of a top-level JSON object
+
+        Args:
+            chunks (iterable): byte chunks of the document, e.g.
+                response.iter_content(chunk_size)
+            key (str): name of the array member
+            members (dict): if given, receives all other top-level members
+                (e.g. "meta", "links") as they are parsed
+
+        Yields:
+            decoded array items
+    """
+
+    reader = _Reader(chunks)
+    reader.expect("{")
+
+    while True:
+        char = reader.peek()
+        if char == "}":
+            return
+        if char == ",":
+            reader.pos += 1
+            continue
+
+        name = reader.value()
+        reader.expect(":")
+
+        if name == key and reader.peek() == "[":
+            reader.pos += 1
+            while True:
+                char = reader.peek()
+                if char == "]":
+                    reader.pos += 1
+                    break
+                if char == ",":
+                    reader.pos += 1
+                    continue
+                yield reader.value()
+        else:
+            value = reader.value()
+            if members is not None:
+                members[name] = value
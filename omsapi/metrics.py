@@ -0,0 +1,174 @@
+""" In-process metrics of OMS API requests in Prometheus text format
+
+    OMSMetrics is registered as request hook (see omsapi.instrument) and
+    keeps counters and a latency histogram per resource. Metrics are
+    rendered with render() or served over HTTP by serve(). Nothing is
+    measured while no OMSMetrics (or other hook) is registered.
+"""
+
+import bisect
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+# Upper bounds (seconds) of request duration histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Counters: (name, help, label names)
+_COUNTERS = [
+    ("oms_requests_total", "Requests by resource and HTTP status", ("resource", "status")),
+    ("oms_request_errors_total", "Failed requests (exception or HTTP status >= 400)", ("resource",)),
+    ("oms_response_bytes_total", "Response body bytes received over the network (not from caches)", ("resource",)),
+    ("oms_request_retries_total", "Repeated HTTP attempts (connection errors, retryable status)", ("resource",)),
+    ("oms_token_renewals_total", "Tokens renewed after HTTP 401", ("resource",)),
+    ("oms_request_cache_total", "Requests served without own HTTP request, by outcome (hit, revalidated, store, coalesced)",
+     ("resource", "outcome")),
+]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = ['{n}="{v}"'.format(n=n, v=_escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class OMSMetrics(object):
+    """ Registry of request metrics, fed by OMSRequestEvent hooks
+
+        Args:
+            buckets (tuple): upper bounds in seconds of the request duration histogram
+            prefix (str): replaces "oms" at the start of metric names
+
+        Examples:
+            metrics = OMSMetrics()
+            omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1", metrics=metrics)
+            metrics.serve(9105)  # http://localhost:9105/metrics
+            ...
+            print(metrics.render())
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="oms"):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = dict((name, {}) for name, _, _ in _COUNTERS)  # name -> label values -> value
+        self._histogram = {}  # resource -> [bucket counts..., count, sum]
+
+    def observe(self, event):
+        """ Account one request (omsapi.instrument.OMSRequestEvent), used as request hook """
+
+        resource = event.resource
+        with self._lock:
+            self._inc("oms_requests_total", (resource, event.status if event.status is not None else "none"))
+            if event.error is not None or event.status is None or event.status >= 400:
+                self._inc("oms_request_errors_total", (resource,))
+            if event.network_bytes:
+                self._inc("oms_response_bytes_total", (resource,), event.network_bytes)
+            retries = event.attempts - 1 - event.token_renewals
+            if retries > 0:
+                self._inc("oms_request_retries_total", (resource,), retries)
+            if event.token_renewals:
+                self._inc("oms_token_renewals_total", (resource,), event.token_renewals)
+            if event.cache is not None and event.cache != "miss":
+                self._inc("oms_request_cache_total", (resource, event.cache))
+
+            histogram = self._histogram.get(resource)
+            if histogram is None:
+                histogram = self._histogram[resource] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(self.buckets, event.seconds)] += 1
+            histogram[-1] += event.seconds
+
+    __call__ = observe
+
+    def _inc(self, name, labels, value=1):
+        values = self._counters[name]
+        values[labels] = values.get(labels, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._counters = dict((name, {}) for name, _, _ in _COUNTERS)
+            self._histogram = {}
+
+    def _name(self, name):
+        return self.prefix + name[3:] if self.prefix != "oms" else name
+
+    def render(self):
+        """ Returns all metrics in Prometheus text exposition format """
+
+        with self._lock:
+            counters = dict((name, dict(values)) for name, values in self._counters.items())
+            histograms = dict((resource, list(h)) for resource, h in self._histogram.items())
+
+        lines = []
+        for name, help_text, label_names in _COUNTERS:
+            metric = self._name(name)
+            lines.append("# HELP {m} {h}".format(m=metric, h=help_text))
+            lines.append("# TYPE {m} counter".format(m=metric))
+            for labels, value in sorted(counters[name].items(), key=lambda item: [str(v) for v in item[0]]):
+                lines.append("{m}{l} {v}".format(m=metric, l=_labels(label_names, labels), v=_number(value)))
+
+        metric = self._name("oms_request_duration_seconds")
+        lines.append("# HELP {m} Request duration including retries and decoding".format(m=metric))
+        lines.append("# TYPE {m} histogram".format(m=metric))
+        for resource in sorted(histograms):
+            histogram = histograms[resource]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram[:-1]):
+                cumulative += count
+                lines.append("{m}_bucket{l} {v}".format(
+                    m=metric, l=_labels(("resource",), (resource,), 'le="{b}"'.format(b=_number(bound))), v=cumulative))
+            lines.append("{m}_sum{l} {v}".format(m=metric, l=_labels(("resource",), (resource,)), v=repr(histogram[-1])))
+            lines.append("{m}_count{l} {v}".format(m=metric, l=_labels(("resource",), (resource,)), v=cumulative))
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9105, host="127.0.0.1"):
+        """ Serve render() at http://host:port/metrics from a background thread
+
+            Returns:
+                HTTPServer: call .shutdown() to stop serving
+        """
+
+        server = _MetricsServer((host, port), _MetricsHandler)
+        server.metrics = self
+        thread = threading.Thread(target=server.serve_forever, name="omsapi-metrics")
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
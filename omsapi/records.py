@@ -0,0 +1,137 @@
+""" Compact record objects for rows of OMS API results
+
+    A JSON:API row is a dict holding "id", "type", "links", "meta" and an
+    "attributes" dict. Record classes keep only the row id and the attribute
+    values in __slots__, one class is generated per resource and attribute
+    list. String values are interned, so values repeated across rows
+    (sequence names, fill types, timestamps, ...) are stored once.
+"""
+
+import keyword
+import re
+import sys
+import threading
+
+_classes = {}  # (resource, attributes, intern) -> record class
+_lock = threading.Lock()
+
+_NOT_IDENTIFIER = re.compile(r"\W")
+
+
+def _slot_name(attribute, taken):
+    """ Python identifier for an attribute name, unique among taken names """
+
+    name = _NOT_IDENTIFIER.sub("_", attribute) or "_"
+    if name[0].isdigit() or keyword.iskeyword(name):
+        name = "_" + name
+    while name in taken or name.startswith("__"):
+        name = name + "_"
+    taken.add(name)
+    return name
+
+
+def _intern(value):
+    return sys.intern(value) if value.__class__ is str else value
+
+
+class OMSRecord(object):
+    """ Base class of generated record classes
+
+        Attributes of a record are the resource attributes (names not valid
+        in python get "_" instead of other characters) and "id", the JSON:API
+        row id (unless the resource has an attribute called "id").
+    """
+
+    __slots__ = ()
+
+    _resource = None
+    _fields = ()  # attribute names, as in the API
+    _slots = ()  # python names of the attributes
+
+    def as_dict(self):
+        """ Attribute name -> value, like row["attributes"] """
+
+        return dict((field, getattr(self, slot)) for field, slot in zip(self._fields, self._slots))
+
+    def __getitem__(self, attribute):
+        try:
+            return getattr(self, self._slots[self._fields.index(attribute)])
+        except ValueError:
+            raise KeyError(attribute)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{cls}({values})".format(cls=type(self).__name__, values=", ".join(
+            "{s}={v!r}".format(s=s, v=getattr(self, s)) for s in self.__slots__))
+
+
+def record_class(resource, attributes, intern=True):
+    """ Returns record class of a resource with given attributes (created once)
+
+        Args:
+            resource (str): resource name, e.g. "lumisections"
+            attributes (list): attribute names, in order
+            intern (bool): intern string values (sys.intern)
+
+        Returns:
+            type: OMSRecord subclass with from_row(row) class method
+
+        Examples:
+            Lumisection = record_class("lumisections", ["run_number", "lumisection_number", "delivered_lumi"])
+            records = [Lumisection.from_row(row) for row in q.data().json()["data"]]
+            print(records[0].delivered_lumi)
+    """
+
+    attributes = tuple(attributes)
+    key = (resource, attributes, bool(intern))
+
+    with _lock:
+        cls = _classes.get(key)
+        if cls is None:
+            cls = _classes[key] = _make_class(resource, attributes, intern)
+    return cls
+
+
+def _make_class(resource, attributes, intern):
+    taken = set(dir(OMSRecord)) | {"from_row", "self", "cls", "row", "a", "_i"}
+    taken.discard("id")
+    slots = [_slot_name(a, taken) for a in attributes]
+    with_id = "id" not in slots
+    all_slots = (["id"] if with_id else []) + slots
+
+    # Constructor and row converter are generated, so that each value is a plain local access
+    values = [("_i(a.get({a!r}))" if intern else "a.get({a!r})").format(a=a) for a in attributes]
+    source = "\n".join([
+        "def __init__(self, {args}):".format(args=", ".join(all_slots)) if all_slots else "def __init__(self):",
+        "".join("    self.{s} = {s}\n".format(s=s) for s in all_slots) or "    pass\n",
+        "def from_row(cls, row, _i=_intern):",
+        "    a = row.get('attributes') or {}",
+        "    return cls({args})".format(args=", ".join((["row.get('id')"] if with_id else []) + values)),
+    ])
+    namespace = {"_intern": _intern}
+    exec(source, namespace)
+
+    name = "".join(part.capitalize() for part in _NOT_IDENTIFIER.split(resource.split("/")[0]) if part) + "Record"
+    return type(name, (OMSRecord,), {
+        "__slots__": tuple(all_slots),
+        "__init__": namespace["__init__"],
+        "from_row": classmethod(namespace["from_row"]),
+        "_resource": resource,
+        "_fields": attributes,
+        "_slots": tuple(slots),
+        "__doc__": "Record of {r}: {a}".format(r=resource, a=", ".join(attributes)),
+    })
+
+
+def to_records(rows, cls):
+    """ Convert JSON:API rows to records of cls (see record_class()) """
+
+    from_row = cls.from_row
+    return [from_row(row) for row in rows]
@@ -0,0 +1,254 @@
+""" Persistent local store of OMS API responses (SQLite)
+
+    Responses which cannot change any more (finished runs, dumped fills and
+    data belonging to them) are kept indefinitely, other responses expire
+    after a short time to live.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote
+
+from .cache import OMSResponseCache
+
+# Resources whose rows are finished once end_time is set: resource -> key attribute
+FINISHING_RESOURCES = {
+    "runs": "run_number",
+    "fills": "fill_number",
+}
+
+# Resources whose data is complete once the parent run/fill is finished:
+# resource -> (parent resource, key attribute)
+CHILD_RESOURCES = {
+    "lumisections": ("runs", "run_number"),
+    "l1algorithmtriggers": ("runs", "run_number"),
+    "l1triggerrates": ("runs", "run_number"),
+    "hltpathrates": ("runs", "run_number"),
+    "hltpathinfo": ("runs", "run_number"),
+    "deadtimes": ("runs", "run_number"),
+    "bunches": ("fills", "fill_number"),
+    "lhcrunconfigurations": ("fills", "fill_number"),
+}
+
+_FILTER = re.compile(r"^filter\[(.+?)\]\[(\w+)\]=(.*)$")
+
+
+def parse_filters(filters):
+    """ Parse "filter[attr][OP]=value" strings to (attr, op, value) tuples """
+
+    parsed = []
+    for f in filters:
+        match = _FILTER.match(f)
+        if match:
+            parsed.append(match.groups())
+    return parsed
+
+
+def url_filters(url):
+    """ Filter strings ("filter[attr][OP]=value") of a data URL """
+
+    params = (unquote(p) for p in url.partition("?")[2].split("&"))
+    return [p for p in params if _FILTER.match(p)]
+
+
+def _closing_key(filters, key, operators=("EQ", "LE", "LT")):
+    """ Value of key which closes the result set from above (EQ or upper bound),
+        or None if the set is open-ended
+    """
+
+    for attr, op, value in filters:
+        if attr != key or op not in operators:
+            continue
+        try:
+            number = int(value)
+        except ValueError:
+            continue
+        if op in ("EQ", "LE"):
+            return number
+        if op == "LT":
+            return number - 1
+    return None
+
+
+class OMSResultStore(object):
+    """ SQLite-backed persistent store of OMS query responses
+
+        Args:
+            path (str): SQLite database file
+            mutable_ttl (float): time to live in seconds of responses which
+                may still change
+            finishing_resources (dict): resource -> key attribute of resources
+                finished once end_time is set (default FINISHING_RESOURCES)
+            child_resources (dict): resource -> (parent resource, key attribute)
+                of resources complete once parent is finished (default CHILD_RESOURCES)
+
+        Examples:
+            store = OMSResultStore(os.path.expanduser("~/.cache/omsapi/results.sqlite"))
+            omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1", result_store=store)
+    """
+
+    def __init__(self, path, mutable_ttl=60, finishing_resources=None, child_resources=None):
+        self.path = path
+        self.mutable_ttl = mutable_ttl
+        self.finishing_resources = FINISHING_RESOURCES if finishing_resources is None else finishing_resources
+        self.child_resources = CHILD_RESOURCES if child_resources is None else child_resources
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                url TEXT PRIMARY KEY,
+                                resource TEXT,
+                                status INTEGER,
+                                headers TEXT,
+                                content BLOB,
+                                immutable INTEGER,
+                                stored REAL,
+                                expires REAL,
+                                accessed REAL)""")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def key(url, identity=""):
+        """ Stored responses are keyed by canonical URL and auth identity """
+
+        url = OMSResponseCache.canonical_url(url)
+        return "{identity} {url}".format(identity=identity, url=url) if identity else url
+
+    def get(self, url, identity=""):
+        """ Returns (status, content, headers) of a stored valid response or None """
+
+        key = self.key(url, identity)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT status, content, headers, expires FROM responses WHERE url=?",
+                                   (key,)).fetchone()
+            if row is None or (row[3] is not None and row[3] < now):
+                return None
+            self._db.execute("UPDATE responses SET accessed=? WHERE url=?", (now, key))
+
+        return row[0], bytes(row[1]), json.loads(row[2])
+
+    def put(self, url, resource, status, content, headers, immutable, identity=""):
+        """ Store a response. Immutable responses never expire. """
+
+        now = time.time()
+        expires = None if immutable else now + self.mutable_ttl
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (self.key(url, identity), resource, status, json.dumps(dict(headers)),
+                              sqlite3.Binary(content), int(bool(immutable)), now, expires, now))
+
+    def is_immutable(self, resource, filters, rows, parent_finished):
+        """ Decide if a response can never change
+
+            Args:
+                resource (str): resource name
+                filters (list): filter strings of the query (see url_filters()
+                    for filters of a fetched URL)
+                rows (callable): returns list of JSON:API rows of the response
+                parent_finished (callable): (resource, key, value) -> bool, True if
+                    that run/fill exists and is finished
+
+            Returns:
+                bool
+        """
+
+        filters = parse_filters(filters)
+
+        if resource in self.finishing_resources:
+            key = self.finishing_resources[resource]
+            closing = _closing_key(filters, key)
+            if closing is None:
+                return False
+            data = rows()
+            if not data:
+                return False
+            for row in data:
+                attributes = row.get("attributes") or {}
+                if attributes.get("end_time") is None:
+                    return False
+            # No new rows can appear below a run/fill which already finished
+            if any((row.get("attributes") or {}).get(key) == closing for row in data):
+                return True
+            return parent_finished(resource, key, closing)
+
+        if resource in self.child_resources:
+            # Only data of one run/fill: runs overlap in time, so an earlier
+            # run can still be open when a later one has finished
+            parent, key = self.child_resources[resource]
+            closing = _closing_key(filters, key, ("EQ",))
+            return closing is not None and parent_finished(parent, key, closing)
+
+        return False
+
+    def stats(self):
+        """ Returns dict with number of stored responses and bytes, total and per resource """
+
+        with self._lock:
+            rows = self._db.execute("""SELECT resource, immutable, COUNT(*), SUM(LENGTH(content))
+                                       FROM responses GROUP BY resource, immutable""").fetchall()
+
+        stats = {"entries": 0, "bytes": 0, "immutable": 0, "mutable": 0, "resources": {}}
+        for resource, immutable, count, size in rows:
+            stats["entries"] += count
+            stats["bytes"] += size or 0
+            stats["immutable" if immutable else "mutable"] += count
+            per_resource = stats["resources"].setdefault(resource, {"entries": 0, "bytes": 0})
+            per_resource["entries"] += count
+            per_resource["bytes"] += size or 0
+        stats["file_bytes"] = os.path.getsize(self.path)
+
+        return stats
+
+    def prune(self, max_bytes=None, older_than=None, resource=None, vacuum=True):
+        """ Remove expired responses and optionally trim the store
+
+            Args:
+                max_bytes (int): remove least recently used responses until
+                    stored content fits
+                older_than (float): remove responses not used for this many seconds
+                resource (str): remove all responses of a resource
+
+            Returns:
+                int: number of removed responses
+        """
+
+        now = time.time()
+        with self._lock:
+            removed = self._db.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?",
+                                       (now,)).rowcount
+            if older_than is not None:
+                removed += self._db.execute("DELETE FROM responses WHERE accessed < ?",
+                                            (now - older_than,)).rowcount
+            if resource is not None:
+                removed += self._db.execute("DELETE FROM responses WHERE resource=?",
+                                            (resource,)).rowcount
+            if max_bytes is not None:
+                total = 0
+                for url, size in self._db.execute("""SELECT url, LENGTH(content) FROM responses
+                                                     ORDER BY accessed DESC""").fetchall():
+                    total += size
+                    if total > max_bytes:
+                        removed += self._db.execute("DELETE FROM responses WHERE url=?", (url,)).rowcount
+            if vacuum:
+                self._db.execute("VACUUM")
+
+        return removed
+
+    def clear(self):
+        """ Remove all stored responses """
+
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("VACUUM")
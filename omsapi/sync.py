@@ -0,0 +1,247 @@
+""" Incremental mirror of OMS resources into a local SQLite database
+
+    Each resource is kept in a table of the same name, one column per
+    attribute and the JSON:API row id as primary key. A per-resource
+    watermark records how far the mirror is complete:
+
+    - runs, fills (FINISHING_RESOURCES): highest key synced. Rows above it
+      are fetched with a GT filter, rows still open (end_time null) are
+      fetched again.
+    - lumisections, ... (CHILD_RESOURCES): highest parent key whose rows
+      were fetched after the parent finished. Rows of parents above it are
+      fetched again. The parent resource must be synced first, and rows of
+      one parent must have a stable order (CHILD_ORDER) for paging.
+
+    Rows and watermark are committed together after each page (or parent),
+    so an interrupted sync continues where it stopped.
+"""
+
+import json
+import re
+import sqlite3
+import time
+
+from . import OMSApiException
+from .store import FINISHING_RESOURCES, CHILD_RESOURCES
+
+# Attribute(s) giving a stable order of rows of one parent (child resources).
+# Pages of a resource without one could skip or repeat rows.
+CHILD_ORDER = {
+    "lumisections": "lumisection_number",
+    "deadtimes": "lumisection_number",
+    "bunches": "bunch_number",
+}
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _sql_value(value):
+    """ Attribute value to SQLite value """
+
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class OMSSync(object):
+    """ Incremental high-water-mark sync of OMS resources into SQLite
+
+        Args:
+            omsapi (OMSAPI): authenticated client
+            path (str): SQLite database file
+            per_page (int): page size of requests
+            verbose (bool): print progress
+            child_order (dict): resource -> attribute (or list of attributes)
+                ordering rows of one run/fill (default CHILD_ORDER)
+
+        Examples:
+            omsapi = OMSAPI("https://cmsoms.cern.ch/agg/api", "v1")
+            omsapi.auth_krb()
+            sync = OMSSync(omsapi, "oms.sqlite")
+            print(sync.sync(["runs", "fills", "lumisections"]))
+    """
+
+    def __init__(self, omsapi, path, per_page=1000, verbose=False, child_order=None):
+        self.omsapi = omsapi
+        self.path = path
+        self.per_page = per_page
+        self.verbose = verbose
+        self.child_order = CHILD_ORDER if child_order is None else child_order
+
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+                                resource TEXT PRIMARY KEY,
+                                watermark TEXT,
+                                updated REAL)""")
+        self._columns = {}  # resource -> set of column names
+
+    def close(self):
+        self._db.close()
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
+
+    def watermark(self, resource):
+        """ Returns watermark of a resource, None if it was never synced """
+
+        row = self._db.execute("SELECT watermark FROM sync_state WHERE resource=?", (resource,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def _set_watermark(self, resource, value):
+        self._db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                         (resource, json.dumps(value), time.time()))
+
+    def reset(self, resource=None):
+        """ Forget watermark of a resource (all if None), next sync fetches everything again.
+            Mirrored rows are kept.
+        """
+
+        if resource is None:
+            self._db.execute("DELETE FROM sync_state")
+        else:
+            self._db.execute("DELETE FROM sync_state WHERE resource=?", (resource,))
+
+    def _table(self, resource):
+        """ Create table of a resource, returns set of its columns """
+
+        if resource not in self._columns:
+            if not _IDENTIFIER.match(resource):
+                raise OMSApiException("Cannot sync resource {r}: not a valid table name".format(r=resource))
+            self._db.execute('CREATE TABLE IF NOT EXISTS "{t}" (id TEXT PRIMARY KEY, synced REAL)'.format(t=resource))
+            self._columns[resource] = set(row[1] for row in self._db.execute('PRAGMA table_info("{t}")'.format(t=resource)))
+        return self._columns[resource]
+
+    def _upsert(self, resource, rows):
+        """ Insert or replace rows (JSON:API resource objects), within the current transaction """
+
+        columns = self._table(resource)
+        now = time.time()
+        for row in rows:
+            attributes = row.get("attributes") or {}
+            for attr in attributes:
+                if attr not in columns:
+                    if not _IDENTIFIER.match(attr):
+                        continue
+                    self._db.execute('ALTER TABLE "{t}" ADD COLUMN "{c}"'.format(t=resource, c=attr))
+                    columns.add(attr)
+
+            names = ["id", "synced"] + [a for a in attributes if a in columns]
+            values = [row.get("id"), now] + [_sql_value(attributes[a]) for a in names[2:]]
+            self._db.execute('INSERT OR REPLACE INTO "{t}" ({c}) VALUES ({v})'.format(
+                t=resource, c=",".join('"{n}"'.format(n=n) for n in names), v=",".join("?" * len(names))), values)
+
+    def _commit(self, resource, rows, watermark=None):
+        """ Store rows and (optionally) new watermark in one transaction """
+
+        self._db.execute("BEGIN")
+        try:
+            self._upsert(resource, rows)
+            if watermark is not None:
+                self._set_watermark(resource, watermark)
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _query(self, resource):
+        q = self.omsapi.query(resource)
+        q.set_verbose(self.verbose)
+        return q
+
+    def sync(self, resources=("runs", "fills", "lumisections")):
+        """ Sync resources in given order (parents before children)
+
+            Returns:
+                dict: resource -> number of fetched rows
+        """
+
+        return dict((resource, self.sync_resource(resource)) for resource in resources)
+
+    def sync_resource(self, resource):
+        """ Fetch new and still open rows of a resource
+
+            Returns:
+                int: number of fetched rows
+        """
+
+        if resource in FINISHING_RESOURCES:
+            return self._sync_finishing(resource, FINISHING_RESOURCES[resource])
+        if resource in CHILD_RESOURCES:
+            parent, key = CHILD_RESOURCES[resource]
+            return self._sync_child(resource, parent, key)
+        raise OMSApiException("Don't know how to sync {r} incrementally".format(r=resource))
+
+    def _sync_finishing(self, resource, key):
+        self._table(resource)
+        watermark = self.watermark(resource)
+        fetched = 0
+
+        # Rows which were still open last time
+        if watermark is not None and "end_time" in self._table(resource):
+            open_keys = [row[0] for row in self._db.execute(
+                'SELECT "{k}" FROM "{t}" WHERE end_time IS NULL AND "{k}" <= ? ORDER BY "{k}"'.format(k=key, t=resource),
+                (watermark,))]
+            for value in open_keys:
+                q = self._query(resource).filter(key, value)
+                rows = list(q.iter_rows(self.per_page))
+                self._commit(resource, rows)
+                fetched += len(rows)
+            self._log("{r}: refreshed {n} open rows".format(r=resource, n=len(open_keys)))
+
+        # New rows
+        q = self._query(resource)
+        if watermark is not None:
+            q.filter(key, watermark, "GT")
+        q.sort(key)
+        for page in q.iter_pages(self.per_page):
+            rows = page.get("data") or []
+            if not rows:
+                break
+            watermark = (rows[-1].get("attributes") or {}).get(key, watermark)
+            self._commit(resource, rows, watermark)
+            fetched += len(rows)
+            self._log("{r}: {n} rows, watermark {w}".format(r=resource, n=fetched, w=watermark))
+
+        return fetched
+
+    def _sync_child(self, resource, parent, key):
+        order = self.child_order.get(resource)
+        if not order:
+            raise OMSApiException("Don't know a stable order of {r} rows, pass it in child_order".format(r=resource))
+        order = [order] if isinstance(order, str) else list(order)
+
+        parent_columns = self._table(parent)
+        if key not in parent_columns:
+            raise OMSApiException("Sync {p} before {r}".format(p=parent, r=resource))
+
+        self._table(resource)
+        watermark = self.watermark(resource)
+        finished_column = "end_time" in parent_columns
+
+        sql = 'SELECT "{k}", {f} FROM "{t}"'.format(k=key, t=parent,
+                                                    f="end_time IS NOT NULL" if finished_column else "1")
+        params = ()
+        if watermark is not None:
+            sql += ' WHERE "{k}" > ?'.format(k=key)
+            params = (watermark,)
+        parents = self._db.execute(sql + ' ORDER BY "{k}"'.format(k=key), params).fetchall()
+
+        fetched = 0
+        advance = True
+        for value, finished in parents:
+            q = self._query(resource).filter(key, value)
+            for attribute in order:
+                q.sort(attribute)
+            rows = list(q.iter_rows(self.per_page))
+
+            # Watermark stops below the first parent which is still open
+            advance = advance and bool(finished)
+            self._commit(resource, rows, value if advance else None)
+            fetched += len(rows)
+            self._log("{r}: {k}={v}, {n} rows".format(r=resource, k=key, v=value, n=len(rows)))
+
+        return fetched
@@ -71,6 +71,17 @@ setuptools.setup(
         "Operating System :: OS Independent",
 
     ],
-    install_requires = ['requests']
+    install_requires = ['requests'],
+
+    extras_require = {
+        "async": ["aiohttp"],
+        "columnar": ["numpy"],
+        "pandas": ["numpy", "pandas"],
+        "parquet": ["numpy", "pyarrow"],
+    },
+
+    entry_points = {
+        "console_scripts": ["omsapi = omsapi.cli:main"],
+    }
 
 )
@@ -0,0 +1,26 @@
+""" Tests run against the local OMS stand-in server of the benchmarks """
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import pytest
+
+import standin
+from omsapi import OMSAPI
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = standin.start(runs=30, lumisections=20, bits=16, trigger_runs=2)
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture
+def omsapi(server):
+    api = OMSAPI(server.url, "v1", verbose=False)
+    yield api
+    api.close()
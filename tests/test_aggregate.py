@@ -0,0 +1,26 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+def lumisections(omsapi):
+    return omsapi.query("lumisections").filter("run_number", 300010, "LT")
+
+
+def test_pushdown_and_local_agree(omsapi):
+    aggregates = {"recorded_lumi": ["mean"], "pileup": ["mean"]}
+    server = lumisections(omsapi).aggregate("run_number", aggregates, per_page=100, pushdown=True)
+    local = lumisections(omsapi).aggregate("run_number", aggregates, per_page=100, pushdown=False)
+
+    assert sorted(server) == sorted(local) == ["pileup_mean", "recorded_lumi_mean", "run_number"]
+    assert server["run_number"].tolist() == local["run_number"].tolist() == list(range(300000, 300010))
+    assert np.allclose(server["recorded_lumi_mean"], local["recorded_lumi_mean"])
+
+
+def test_local_functions(omsapi):
+    q = omsapi.query("l1algorithmtriggers").filter("run_number", 300000)
+    rates = q.aggregate("bit", {"pre_dt_rate": ["count", "max"]}, per_page=100)
+
+    assert sorted(rates) == ["bit", "pre_dt_rate_count", "pre_dt_rate_max"]
+    assert rates["bit"].tolist() == list(range(16))
+    assert rates["pre_dt_rate_count"].tolist() == [20] * 16
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from omsapi.aio import AsyncOMSAPI, AsyncOMSQuery
+
+
+def run(coroutine_function, server):
+    async def main():
+        async with AsyncOMSAPI(server.url, "v1", verbose=False) as omsapi:
+            return await coroutine_function(omsapi)
+    return asyncio.run(main())
+
+
+def test_rows_and_copy(server):
+    async def rows(omsapi):
+        q = await omsapi.query("runs")
+        q.attrs(["run_number"]).filter("run_number", 300010, "LT")
+        copy = q.copy()
+        assert isinstance(copy, AsyncOMSQuery)
+        return [row["attributes"]["run_number"] async for row in copy.iter_rows(per_page=4, workers=2)]
+
+    assert run(rows, server) == list(range(300000, 300010))
+
+
+def test_query_from_spec_and_batch(server):
+    async def batch(omsapi):
+        q = await omsapi.query_from_spec({"resource": "runs", "sort": ["-run_number"], "per_page": 2})
+        return await omsapi.batch([q, {"resource": "fills", "per_page": 1}, {"resource": "unknown"}])
+
+    results = run(batch, server)
+    assert [r.ok for r in results] == [True, True, False]
+    assert [row["attributes"]["run_number"] for row in results[0].json()["data"]] == [300029, 300028]
+
+
+@pytest.mark.parametrize("method", ["columns", "dataframe", "records", "iter_records", "aggregate", "filter_in",
+                                    "rows_by_value", "follow", "shard", "iter_sharded", "prepare"])
+def test_sync_helpers_not_available(server, method):
+    async def query(omsapi):
+        return await omsapi.query("runs")
+
+    assert not hasattr(run(query, server), method)
+
+
+@pytest.mark.parametrize("method", ["add_request_hook", "remove_request_hook", "request_stats"])
+def test_request_hooks_not_available(method):
+    assert not hasattr(AsyncOMSAPI(verbose=False), method)
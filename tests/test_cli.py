@@ -0,0 +1,79 @@
+import csv
+import json
+
+import pytest
+
+import standin
+from omsapi import OMSApiException
+from omsapi.cli import main
+
+
+def run(server, tmp_path, name, *options):
+    path = str(tmp_path / name)
+    code = main(["runs", "-a", "run_number,start_time,delivered_lumi", "-s", "run_number", "-o", path,
+                 "--per-page", "7", "--workers", "3", "--no-progress", "--auth", "none", "--api-url", server.url] + list(options))
+    return code, path
+
+
+def test_csv(server, tmp_path):
+    code, path = run(server, tmp_path, "runs.csv")
+    assert code == 0
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["run_number", "start_time", "delivered_lumi"]
+    assert [int(r[0]) for r in rows[1:]] == list(range(300000, 300030))
+
+
+def test_jsonl(server, tmp_path):
+    code, path = run(server, tmp_path, "runs.jsonl")
+    assert code == 0
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    assert [r["run_number"] for r in rows] == list(range(300000, 300030))
+    assert set(rows[0]) == {"run_number", "start_time", "delivered_lumi"}
+
+
+def test_parquet(server, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    code, path = run(server, tmp_path, "runs.parquet")
+    assert code == 0
+    table = pq.read_table(path)
+    assert table.column("run_number").to_pylist() == list(range(300000, 300030))
+    assert str(table.schema.field("start_time").type) == "timestamp[ms, tz=UTC]"
+    assert str(table.schema.field("delivered_lumi").type) == "double"
+
+
+@pytest.fixture
+def bad_server():
+    srv = standin.start(runs=10, lumisections=1, bits=1, trigger_runs=1)
+    yield srv
+    srv.stop()
+
+
+@pytest.mark.parametrize("attribute, value", [("start_time", "yesterday"), ("delivered_lumi", "n/a")])
+def test_parquet_type_mismatch(bad_server, tmp_path, capsys, attribute, value):
+    pytest.importorskip("pyarrow")
+    row = dict(bad_server.data["runs"][-1], run_number=400000)
+    row[attribute] = value
+    bad_server.add_rows("runs", [row])
+
+    code, _ = run(bad_server, tmp_path, "runs.parquet")
+    assert code == 1
+    error = capsys.readouterr().err
+    assert "Column " + attribute in error and repr(value) in error
+
+
+def test_parquet_writer_mismatch(tmp_path):
+    pytest.importorskip("pyarrow")
+    from omsapi.cli import _ParquetWriter
+
+    first = [{"attributes": {"run_number": 1, "lumi": 1.5}}]
+    writer = _ParquetWriter(str(tmp_path / "x.parquet"), ["run_number", "lumi"], None, first)
+    writer.write(first)
+    with pytest.raises(OMSApiException, match="Column run_number"):
+        writer.write([{"attributes": {"run_number": 2.5, "lumi": 1.0}}])
+    with pytest.raises(OMSApiException, match="Column run_number.*'x'"):
+        writer.write([{"attributes": {"run_number": "x", "lumi": 1.0}}])
+    with pytest.raises(OMSApiException, match="Column lumi"):
+        writer.write([{"attributes": {"run_number": 2, "lumi": {"a": 1}}}])
+    writer.close()
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from omsapi import OMSAPI
+from omsapi.coalesce import OMSRequestCoalescer
+
+
+def concurrent(coalescer, func, share, callers=4):
+    results, errors = [], []
+    started = threading.Event()
+
+    def leader_func():
+        started.set()
+        time.sleep(0.2)
+        return func()
+
+    def call(f):
+        try:
+            results.append(coalescer.do("key", f, share))
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=call, args=(leader_func,), daemon=True)]
+    threads[0].start()
+    started.wait()
+    threads += [threading.Thread(target=call, args=(func,), daemon=True) for _ in range(callers - 1)]
+    for t in threads[1:]:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert not any(t.is_alive() for t in threads)
+    return results, errors
+
+
+def test_waiters_shared_result():
+    results, errors = concurrent(OMSRequestCoalescer(), lambda: [1], lambda r: tuple(r))
+    assert results == [(1,)] * 4 and not errors
+
+
+def test_failing_share_releases_waiters():
+    def share(result):
+        raise ValueError("cannot share")
+
+    results, errors = concurrent(OMSRequestCoalescer(), lambda: "result", share)
+    assert results == ["result"]
+    assert len(errors) == 3 and all(isinstance(ex, ValueError) for ex in errors)
+
+
+def test_coalescing_is_opt_in(server):
+    assert OMSAPI(server.url, "v1", verbose=False).coalescer is None
+    assert OMSAPI(server.url, "v1", verbose=False, coalesce=True).coalescer is not None
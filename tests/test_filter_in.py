@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from omsapi.cli import export
+from omsapi import OMSApiException, OMSParam
+
+BITS = [3, 4, 5, 9, 12]
+
+
+def triggers(omsapi):
+    return (omsapi.query("l1algorithmtriggers").attrs(["run_number", "lumisection_number", "bit", "pre_dt_rate"])
+            .filter("run_number", 300001).sort("lumisection_number").filter_in("bit", BITS, max_gap=3))
+
+
+def expected_ids(server):
+    return set("300001_{l}_{b}".format(l=l, b=b) for l in range(1, 21) for b in BITS)
+
+
+def test_data(server, omsapi):
+    rows = triggers(omsapi).data().json()["data"]
+    assert set(row["id"] for row in rows) == expected_ids(server)
+    assert len(rows) == len(expected_ids(server))
+
+
+def test_iter_pages(server, omsapi):
+    pages = list(triggers(omsapi).iter_pages(per_page=7))
+    assert len(pages) > 1
+    ids = [row["id"] for page in pages for row in page["data"]]
+    assert len(ids) == len(expected_ids(server)) and set(ids) == expected_ids(server)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_iter_rows(server, omsapi, stream):
+    rows = list(triggers(omsapi).iter_rows(per_page=7, stream=stream))
+    assert set(row["attributes"]["bit"] for row in rows) == set(BITS)
+    assert set(row["id"] for row in rows) == expected_ids(server)
+    assert len(rows) == len(expected_ids(server))
+
+
+def test_records_and_columns(server, omsapi):
+    records = triggers(omsapi).records(per_page=7)
+    assert sorted(set(r.bit for r in records)) == BITS
+    assert len(records) == len(expected_ids(server))
+
+    pytest.importorskip("numpy")
+    columns = triggers(omsapi).columns(per_page=7)
+    assert sorted(set(columns["bit"].tolist())) == BITS
+
+
+def test_cli_export(server, omsapi, tmp_path):
+    path = tmp_path / "rows.jsonl"
+    with open(str(path), "w") as out:
+        count = export(triggers(omsapi), out, "jsonl", per_page=7)
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert count == len(rows) == len(expected_ids(server))
+    assert set(row["bit"] for row in rows) == set(BITS)
+
+
+def test_unsupported(omsapi):
+    q = triggers(omsapi)
+    with pytest.raises(ValueError):
+        q.prepare()
+    with pytest.raises(ValueError):
+        q.shard("lumisection_number")
+    with pytest.raises(ValueError):
+        list(q.iter_sharded("lumisection_number"))
+    with pytest.raises(ValueError):
+        next(q.follow("lumisection_number", start=0))
+
+
+def test_values_converted(omsapi):
+    q = omsapi.query("l1algorithmtriggers").filter("run_number", 300000).filter_in("bit", ["5", "6", "40"])
+    grouped = q.rows_by_value()
+    assert list(grouped) == ["5", "6", "40"]
+    assert [len(rows) for rows in grouped.values()] == [20, 20, 0]
+    assert set(row["attributes"]["bit"] for row in grouped["5"]) == {5}
+
+
+def test_values_without_metadata(omsapi):
+    q = omsapi.query("l1algorithmtriggers", query_validation=False)
+    q.filter("run_number", 300000).filter_in("bit", ["5", 6.0])
+    assert [len(rows) for rows in q.rows_by_value().values()] == [20, 20]
+
+
+def test_large_pages(server, omsapi):
+    server.reset_stats()
+    rows = triggers(omsapi).data().json()["data"]
+    assert len(rows) == len(expected_ids(server))
+    # one request per planned range (3-5, 9-12), not pages of 10 rows
+    assert server.requests == 2
+
+
+def test_second_filter_in(omsapi):
+    q = omsapi.query("l1algorithmtriggers").filter_in("bit", [1, 2])
+    with pytest.raises(OMSApiException):
+        q.filter_in("run_number", [300000])
+    assert q._filter_in[0] == "bit"
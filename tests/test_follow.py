@@ -0,0 +1,48 @@
+import threading
+
+from omsapi import OMSAPI
+from omsapi.cache import OMSResponseCache
+from omsapi.store import OMSResultStore
+
+RUN = 300029  # last run, not finished
+
+
+def lumisection(number):
+    return dict(run_number=RUN, lumisection_number=number, fill_number=6002, start_time=None, end_time=None,
+                cms_active=True, delivered_lumi=1.0, recorded_lumi=1.0, pileup=30.0)
+
+
+def test_follow_bypasses_caches(server, tmp_path):
+    omsapi = OMSAPI(server.url, "v1", verbose=False, response_cache=OMSResponseCache(ttl=600),
+                    result_store=OMSResultStore(str(tmp_path / "results.sqlite"), mutable_ttl=600))
+    q = omsapi.query("lumisections").attrs(["run_number", "lumisection_number"]).filter("run_number", RUN)
+
+    stop = threading.Event()
+    rows = q.follow("lumisection_number", per_page=100, min_interval=0.05, max_interval=0.05, idle_timeout=5,
+                    stop=stop)
+    numbers = []
+
+    def insert():
+        server.add_rows("lumisections", [lumisection(21)])
+        threading.Timer(0.3, lambda: server.add_rows("lumisections", [lumisection(22)])).start()
+
+    # First polls find nothing beyond the current highest lumisection (20)
+    threading.Timer(0.3, insert).start()
+    for row in rows:
+        numbers.append(row["attributes"]["lumisection_number"])
+        if len(numbers) == 2:
+            stop.set()
+    omsapi.close()
+
+    assert numbers == [21, 22]
+
+
+def test_extreme_value_bypasses_caches(server, tmp_path):
+    omsapi = OMSAPI(server.url, "v1", verbose=False, response_cache=OMSResponseCache(ttl=600),
+                    result_store=OMSResultStore(str(tmp_path / "results.sqlite"), mutable_ttl=600))
+    q = omsapi.query("lumisections").filter("run_number", RUN - 1)
+
+    highest = q._extreme_value("lumisection_number")
+    server.add_rows("lumisections", [dict(lumisection(highest + 1), run_number=RUN - 1)])
+    assert q._extreme_value("lumisection_number") == highest + 1
+    omsapi.close()
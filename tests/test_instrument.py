@@ -0,0 +1,54 @@
+from omsapi import OMSAPI, OMSParam
+from omsapi.store import OMSResultStore
+
+
+def events_of(server, **options):
+    omsapi = OMSAPI(server.url, "v1", verbose=False, **options)
+    events = []
+    omsapi.add_request_hook(lambda event: events.append(event) if not event.resource.endswith("/meta") else None)
+    return omsapi, events
+
+
+def test_prepared_query(server):
+    omsapi, events = events_of(server)
+    prepared = omsapi.query("runs").attrs(["run_number"]).filter("fill_number", OMSParam("fill")).prepare()
+
+    assert len(prepared.data(fill=6001).json()["data"]) == 10
+    assert len(list(prepared.iter_rows(per_page=4, fill=6002))) == 10
+    assert [(e.resource, e.status, e.attempts) for e in events] == [("runs", 200, 1)] * 4
+    omsapi.close()
+
+
+def test_extreme_value(server):
+    omsapi, events = events_of(server)
+    assert omsapi.query("runs")._extreme_value("run_number") == 300029
+    assert [(e.resource, e.attempts) for e in events] == [("runs", 1)]
+    omsapi.close()
+
+
+def test_parent_check_is_separate_request(server, tmp_path):
+    omsapi, events = events_of(server, result_store=OMSResultStore(str(tmp_path / "results.sqlite")))
+    q = omsapi.query("lumisections").attrs(["run_number", "lumisection_number"]).filter("run_number", 300003)
+    q.paginate(1, 5).data()
+
+    # The store checks whether the run is finished while fetching lumisections
+    assert sorted((e.resource, e.attempts) for e in events) == [("lumisections", 1), ("runs", 1)]
+    omsapi.close()
+
+
+def test_stream_page_does_not_capture_other_requests(server):
+    from omsapi.instrument import current_event
+
+    omsapi, events = events_of(server)
+    q = omsapi.query("runs").attrs(["run_number"])
+    other = omsapi.query("fills").paginate(1, 1)
+
+    rows = q.iter_rows(per_page=10, stream=True)
+    next(rows)
+    assert current_event() is None
+    other.data()
+    rows.close()
+
+    assert sorted((e.resource, e.attempts) for e in events) == [("fills", 1), ("runs", 1)]
+    assert current_event() is None
+    omsapi.close()
@@ -0,0 +1,52 @@
+import threading
+
+from omsapi import OMSAPI
+from omsapi.cache import OMSResponseCache
+from omsapi.metrics import OMSMetrics
+
+
+def metric(metrics, name):
+    """ Sum of a counter over all labels of resource runs """
+
+    return sum(float(line.split()[-1]) for line in metrics.render().splitlines()
+               if line.startswith(name + "{") and 'resource="runs"' in line)
+
+
+def test_bytes_of_cached_responses_not_counted(server):
+    metrics = OMSMetrics()
+    omsapi = OMSAPI(server.url, "v1", verbose=False, collect_stats=True, metrics=metrics,
+                    response_cache=OMSResponseCache(ttl=600))
+    q = omsapi.query("runs").paginate(1, 20)
+    size = len(q.data().content)
+    q.data()
+
+    assert metric(metrics, "oms_response_bytes_total") == size
+    assert omsapi.request_stats()["runs"]["bytes"] == size
+    omsapi.close()
+
+
+def test_bytes_of_coalesced_responses_not_counted(server):
+    metrics = OMSMetrics()
+    omsapi = OMSAPI(server.url, "v1", verbose=False, coalesce=True, metrics=metrics, pool_maxsize=10)
+    q = omsapi.query("runs").paginate(1, 20)
+    sizes = []
+    barrier = threading.Barrier(8)
+
+    def fetch():
+        barrier.wait()
+        sizes.append(len(q.copy().data().content))
+
+    server.latency = 0.2
+    try:
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        server.latency = 0.0
+
+    downloads = metric(metrics, "oms_requests_total") - metric(metrics, 'oms_request_cache_total')
+    assert metric(metrics, "oms_response_bytes_total") == sizes[0] * downloads
+    assert downloads < 8
+    omsapi.close()
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from omsapi import OMSParam
+
+
+@pytest.fixture
+def capped(server):
+    server.max_page_size = 7
+    yield server
+    server.max_page_size = None
+
+
+def run_numbers(rows):
+    return [row["attributes"]["run_number"] for row in rows]
+
+
+@pytest.mark.parametrize("options", [dict(), dict(workers=3), dict(stream=True)])
+def test_server_capped_page_size(capped, omsapi, options):
+    q = omsapi.query("runs").attrs(["run_number"]).sort("run_number")
+    assert run_numbers(q.iter_rows(per_page=10, **options)) == list(range(300000, 300030))
+
+
+def test_prepared_query_capped_page_size(capped, omsapi):
+    prepared = omsapi.query("runs").attrs(["run_number"]).filter("run_number", OMSParam("low"), "GE").prepare()
+    assert run_numbers(prepared.iter_rows(per_page=10, low=300005)) == list(range(300005, 300030))
+
+
+def test_async_capped_page_size(capped):
+    pytest.importorskip("aiohttp")
+    from omsapi.aio import AsyncOMSAPI
+
+    async def main():
+        async with AsyncOMSAPI(capped.url, "v1", verbose=False) as omsapi:
+            q = (await omsapi.query("runs")).attrs(["run_number"]).sort("run_number")
+            return [row async for row in q.iter_rows(per_page=10, workers=2)]
+
+    assert run_numbers(asyncio.run(main())) == list(range(300000, 300030))
+
+
+def test_short_page_without_count_is_last():
+    from omsapi import OMSQuery
+
+    assert OMSQuery._is_last(3, None, 0, 10)
+    assert not OMSQuery._is_last(10, None, 0, 10)
+    assert not OMSQuery._is_last(7, {"totalResourceCount": 30}, 0, 10)
+    assert OMSQuery._is_last(7, {"totalResourceCount": 30}, 23, 10)
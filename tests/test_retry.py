@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import pytest
+from requests.exceptions import ReadTimeout
+
+from omsapi import OMSAPI, OMSRetryPolicy
+
+
+@pytest.fixture
+def slow(server):
+    server.latency = 1.0
+    yield server
+    server.latency = 0.0
+
+
+def test_request_timeout_capped_by_budget():
+    policy = OMSRetryPolicy(budget_sec=2, timeout=(10, 300))
+    assert policy.request_timeout() == (10, 300)
+    connect, read = policy.request_timeout(time.time() - 1.5)
+    assert 0 < connect <= 0.5 and 0 < read <= 0.5
+    assert OMSRetryPolicy(timeout=5).request_timeout() == (5, 5)
+    assert OMSRetryPolicy(timeout=None).request_timeout() is None
+
+
+def test_prewarm_without_retry_policy(server):
+    omsapi = OMSAPI(server.url, "v1", verbose=False, prewarm=2)
+    assert omsapi._request_timeout() == (10.0, 300.0)
+    omsapi.close()
+
+
+def test_read_timeout_is_retried(slow):
+    policy = OMSRetryPolicy(max_attempts=2, backoff=0.01, jitter=0, timeout=(5, 0.2))
+    omsapi = OMSAPI(slow.url, "v1", verbose=False, retry_policy=policy)
+    slow.reset_stats()
+    started = time.time()
+    with pytest.raises(ReadTimeout):
+        omsapi.query("runs").attrs(["run_number"]).data()
+    assert time.time() - started < 1.0
+    assert slow.requests == 2
+    omsapi.close()
+
+
+def test_budget_limits_read_timeout(slow):
+    policy = OMSRetryPolicy(max_attempts=None, backoff=0.01, jitter=0, budget_sec=0.5)
+    omsapi = OMSAPI(slow.url, "v1", verbose=False, retry_policy=policy)
+    started = time.time()
+    with pytest.raises(ReadTimeout):
+        omsapi.query("runs").attrs(["run_number"]).data()
+    assert time.time() - started < 1.0
+    omsapi.close()
+
+
+def test_async_read_timeout(slow):
+    pytest.importorskip("aiohttp")
+    from omsapi.aio import AsyncOMSAPI
+
+    async def main():
+        policy = OMSRetryPolicy(max_attempts=2, backoff=0.01, jitter=0, timeout=(5, 0.2))
+        async with AsyncOMSAPI(slow.url, "v1", verbose=False, retry_policy=policy) as omsapi:
+            q = (await omsapi.query("runs")).attrs(["run_number"])
+            await q.data()
+
+    started = time.time()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    assert time.time() - started < 1.0
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from omsapi import OMSApiException
+
+
+def test_iter_sharded_matches_iter_rows(omsapi):
+    q = omsapi.query("lumisections").attrs(["run_number", "lumisection_number"]).sort("run_number")
+    expected = [row["id"] for row in q.copy().sort("lumisection_number").iter_rows(per_page=100)]
+
+    rows = list(q.copy().sort("lumisection_number").iter_sharded("run_number", shards=4, per_page=30, buffer_pages=1))
+    assert [row["id"] for row in rows] == expected
+
+
+def test_iter_sharded_descending(omsapi):
+    q = omsapi.query("runs").attrs(["run_number"]).sort("run_number", asc=False)
+    numbers = [row["attributes"]["run_number"] for row in q.iter_sharded("run_number", shards=3, per_page=4)]
+    assert numbers == list(range(300029, 299999, -1))
+
+
+def test_iter_sharded_buffers_few_pages(server, omsapi):
+    q = omsapi.query("lumisections").attrs(["run_number"]).sort("run_number")
+    server.reset_stats()
+    rows = q.iter_sharded("run_number", shards=4, per_page=10, buffer_pages=1)
+    next(rows)
+    time.sleep(0.5)
+    rows.close()
+
+    # Shards wait once their buffer is full instead of fetching all 60 pages
+    assert server.requests < 30
+
+
+def test_iter_sharded_failed_shard(server, omsapi):
+    q = omsapi.query("runs").attrs(["run_number"]).sort("run_number")
+    shards = q.shard("run_number", 3)
+    shards[1].resource = "missing"
+    q.shard = lambda *args: shards
+
+    with pytest.raises(OMSApiException):
+        list(q.iter_sharded("run_number", 3, per_page=5, page_retries=0))
@@ -0,0 +1,44 @@
+from omsapi import OMSAPI, OMSParam
+from omsapi.store import OMSResultStore, url_filters
+
+
+def finished_except(open_run):
+    return lambda resource, key, value: value != open_run
+
+
+def test_child_ranges_are_not_immutable(tmp_path):
+    store = OMSResultStore(str(tmp_path / "results.sqlite"))
+    no_rows = lambda: []
+    parent_finished = finished_except(300010)
+    assert store.is_immutable("lumisections", ["filter[run_number][EQ]=300020"], no_rows, parent_finished)
+    assert not store.is_immutable("lumisections", ["filter[run_number][EQ]=300010"], no_rows, parent_finished)
+    # The last run of the range finished, an earlier one is still open
+    assert not store.is_immutable("lumisections", ["filter[run_number][LE]=300020"], no_rows, parent_finished)
+    assert not store.is_immutable("lumisections", ["filter[run_number][LT]=300021"], no_rows, parent_finished)
+
+
+def test_auth_identity_in_key(tmp_path):
+    store = OMSResultStore(str(tmp_path / "results.sqlite"))
+    url = "http://oms/api/v1/runs?page[offset]=0&page[limit]=10"
+    store.put(url, "runs", 200, b"{}", {}, True, identity="oidc:a:prod")
+    assert store.get(url, "oidc:a:prod") is not None
+    assert store.get(url, "oidc:b:prod") is None
+    assert store.get(url) is None
+
+
+def test_url_filters():
+    url = "http://oms/api/v1/runs?fields=run_number&filter[run_number][EQ]=5&filter[name][EQ]=a%20b&page[limit]=1"
+    assert url_filters(url) == ["filter[run_number][EQ]=5", "filter[name][EQ]=a b"]
+
+
+def test_prepared_query_stored_immutable(server, tmp_path):
+    store = OMSResultStore(str(tmp_path / "results.sqlite"))
+    omsapi = OMSAPI(server.url, "v1", verbose=False, result_store=store)
+    prepared = omsapi.query("lumisections").attrs(["run_number", "lumisection_number"]) \
+        .filter("run_number", OMSParam("run")).prepare()
+    rows = list(prepared.iter_rows(per_page=100, run=300005))
+    omsapi.close()
+
+    assert len(rows) == 20
+    assert store.stats()["resources"]["lumisections"]["entries"] == 1
+    assert store.stats()["mutable"] == 0
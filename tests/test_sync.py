@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+import standin
+from omsapi import OMSAPI, OMSApiException
+from omsapi.sync import OMSSync
+
+LAST_RUN = 300009  # not finished
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    srv = standin.start(runs=10, lumisections=5, bits=1, trigger_runs=1)
+    omsapi = OMSAPI(srv.url, "v1", verbose=False)
+    yield srv, omsapi, str(tmp_path / "oms.sqlite")
+    omsapi.close()
+    srv.stop()
+
+
+def count(path, table, where="1"):
+    with sqlite3.connect(path) as db:
+        return db.execute('SELECT COUNT(*) FROM "{t}" WHERE {w}'.format(t=table, w=where)).fetchone()[0]
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_interrupted_sync_resumes(mirror):
+    srv, omsapi, path = mirror
+    sync = OMSSync(omsapi, path, per_page=3)
+    sync.sync(["runs"])
+
+    # Stop after the lumisections of three runs were committed
+    commit = sync._commit
+    commits = []
+
+    def failing_commit(resource, rows, watermark=None):
+        if len(commits) == 3:
+            raise Interrupted()
+        commit(resource, rows, watermark)
+        commits.append(watermark)
+
+    sync._commit = failing_commit
+    with pytest.raises(Interrupted):
+        sync.sync(["lumisections"])
+    sync.close()
+    assert count(path, "lumisections") == 15
+
+    sync = OMSSync(omsapi, path, per_page=3)
+    assert sync.watermark("lumisections") == 300002
+    # Only runs above the watermark are fetched again
+    assert sync.sync(["lumisections"]) == {"lumisections": 35}
+    assert count(path, "lumisections") == 50
+    # The open run stays above the watermark
+    assert sync.watermark("lumisections") == LAST_RUN - 1
+    sync.close()
+
+
+def test_open_rows_refreshed(mirror):
+    srv, omsapi, path = mirror
+    sync = OMSSync(omsapi, path, per_page=4)
+    assert sync.sync(["runs"]) == {"runs": 10}
+    assert count(path, "runs", "end_time IS NULL") == 1
+
+    # The open run finishes and a new one starts
+    srv.data["runs"][-1]["end_time"] = srv.data["runs"][-2]["end_time"]
+    srv.add_rows("runs", [dict(srv.data["runs"][-1], run_number=LAST_RUN + 1, end_time=None)])
+
+    assert sync.sync(["runs"]) == {"runs": 2}
+    assert count(path, "runs") == 11
+    assert count(path, "runs", "end_time IS NULL AND run_number={r}".format(r=LAST_RUN)) == 0
+    assert count(path, "runs", "end_time IS NULL") == 1
+    assert sync.watermark("runs") == LAST_RUN + 1
+    sync.close()
+
+
+def test_child_without_order_refused(mirror):
+    srv, omsapi, path = mirror
+    sync = OMSSync(omsapi, path)
+    sync.sync(["runs"])
+    with pytest.raises(OMSApiException, match="child_order"):
+        sync.sync_resource("l1algorithmtriggers")
+
+    sync = OMSSync(omsapi, path, child_order={"l1algorithmtriggers": ["lumisection_number", "bit"]})
+    assert sync.sync_resource("l1algorithmtriggers") == 5
+    sync.close()
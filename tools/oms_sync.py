@@ -0,0 +1,35 @@
+#!/bin/env python3
+""" Mirror OMS resources into a local SQLite database (omsapi.sync.OMSSync).
+    Only new and still open rows are fetched, interrupted sync can be rerun.
+"""
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.join(sys.path[0],'..'))
+from omsapi import OMSAPI
+from omsapi.sync import OMSSync
+
+parser = argparse.ArgumentParser(description='incremental sync of OMS resources into SQLite')
+parser.add_argument('path', help='SQLite database file')
+parser.add_argument('resources', nargs='*', default=['runs', 'fills', 'lumisections'],
+                    help='resources to sync, parents before children (default: runs fills lumisections)')
+parser.add_argument('--api-url', default='https://cmsoms.cern.ch/agg/api', help='OMS API URL')
+parser.add_argument('--per-page', type=int, default=1000, help='page size of requests')
+parser.add_argument('--reset', action='store_true', help='forget watermarks and fetch everything again')
+parser.add_argument('--verbose', action='store_true', help='print progress')
+
+args = parser.parse_args()
+
+omsapi = OMSAPI(args.api_url, "v1", verbose=False)
+omsapi.auth_krb()
+
+sync = OMSSync(omsapi, args.path, per_page=args.per_page, verbose=args.verbose)
+if args.reset:
+    for resource in args.resources:
+        sync.reset(resource)
+
+for resource in args.resources:
+    fetched = sync.sync_resource(resource)
+    print("{resource:20s} {n:8d} rows fetched, watermark {w}".format(resource=resource, n=fetched, w=sync.watermark(resource)))
+sync.close()
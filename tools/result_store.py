@@ -0,0 +1,42 @@
+#!/bin/env python3
+""" Inspect and prune local OMS API result store (omsapi.store.OMSResultStore)
+"""
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.join(sys.path[0],'..'))
+from omsapi.store import OMSResultStore
+
+parser = argparse.ArgumentParser(description='inspect and prune OMS API result store')
+parser.add_argument('path', help='SQLite result store file')
+subparsers = parser.add_subparsers(dest='command')
+subparsers.add_parser('stats', help='show number of stored responses and size per resource')
+prune = subparsers.add_parser('prune', help='remove expired responses and optionally trim the store')
+prune.add_argument('--max-mb', type=float, help='remove least recently used responses above this size')
+prune.add_argument('--older-than-days', type=float, help='remove responses not used for this many days')
+prune.add_argument('--resource', help='remove all responses of a resource')
+subparsers.add_parser('clear', help='remove all stored responses')
+
+args = parser.parse_args()
+
+if not os.path.exists(args.path):
+    print("File not found: " + args.path)
+    sys.exit(1)
+
+store = OMSResultStore(args.path)
+
+if args.command == 'prune':
+    removed = store.prune(max_bytes=int(args.max_mb * 2**20) if args.max_mb is not None else None,
+                          older_than=args.older_than_days * 86400 if args.older_than_days is not None else None,
+                          resource=args.resource)
+    print("removed {n} responses".format(n=removed))
+elif args.command == 'clear':
+    store.clear()
+    print("store cleared")
+
+stats = store.stats()
+print("{entries} responses ({immutable} immutable, {mutable} mutable), {mb:.1f} MB content, {file_mb:.1f} MB file".format(
+    mb=stats["bytes"] / 2.**20, file_mb=stats["file_bytes"] / 2.**20, **stats))
+for resource, s in sorted(stats["resources"].items()):
+    print("  {resource:30s} {entries:8d} {mb:10.2f} MB".format(resource=resource, entries=s["entries"], mb=s["bytes"] / 2.**20))